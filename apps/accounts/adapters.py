@@ -1,15 +1,47 @@
-import random
-from datetime import timedelta
-from django.utils import timezone
+import threading
 from django.conf import settings
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from requests.adapters import HTTPAdapter
+from rest_framework.exceptions import Throttled
+from allauth.core import context as allauth_context
 from allauth.socialaccount.adapter import DefaultSocialAccountAdapter
+from allauth.account import app_settings as account_settings
 from allauth.account.adapter import DefaultAccountAdapter
 
-from .models import OTPModel
+from . import email_templates, timing
+from .mail import send_message
+from .otp import get_otp_backend
+from .throttling import SendEmailCodeThrottle
+
+_requests_session = None
+_requests_session_lock = threading.Lock()
+
+
+def record_http_time(response, *args, **kwargs):
+    """time to the response headers of an outbound call, for `timing`"""
+    timing.record("http", response.elapsed.total_seconds() * 1000)
 
 
 class CustomSocialAdapter(DefaultSocialAccountAdapter):
 
+    def get_requests_session(self):
+        """
+        One keep-alive session shared by all the calls to the providers,
+        instead of a new connection (and TLS handshake) per call.
+        Requests time out after `SOCIALACCOUNT_REQUESTS_TIMEOUT` seconds.
+        """
+        global _requests_session
+        with _requests_session_lock:
+            if _requests_session is None:
+                session = super().get_requests_session()
+                adapter = HTTPAdapter(pool_maxsize=settings.SOCIALACCOUNT_REQUESTS_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.hooks["response"].append(record_http_time)
+                _requests_session = session
+        return _requests_session
+
     def populate_user(self, request, sociallogin, data):
         user = super().populate_user(request, sociallogin, data)
         acc_data = sociallogin.serialize().get("account", {})
@@ -22,17 +54,54 @@ class CustomSocialAdapter(DefaultSocialAccountAdapter):
 
 
 class CustomAccountAdapter(DefaultAccountAdapter):
+    def send_mail(self, template_prefix, email, context):
+        """same as the default, but delivered according to `EMAIL_SEND_MODE`"""
+        request = allauth_context.request
+        ctx = {
+            "request": request,
+            "email": email,
+            "current_site": get_current_site(request),
+        }
+        ctx.update(context)
+        with timing.timed("mail_render"):
+            msg = self.render_mail(template_prefix, email, ctx)
+        send_message(msg)
+
+    def save_user(self, request, user, form, commit=True):
+        """also sets the `image` of the register serializer, in the same INSERT as the rest"""
+        if "image" in form.cleaned_data:
+            user.image = form.cleaned_data["image"]
+        return super().save_user(request, user, form, commit)
+
+    def render_mail(self, template_prefix, email, context, headers=None):
+        """same as the default, from the compiled `email_templates` and without the context processors"""
+        to = [email] if isinstance(email, str) else email
+        [(subject, text, html)] = email_templates.render_mail(
+            template_prefix, [context], account_settings.TEMPLATE_EXTENSION
+        )
+        subject = self.format_email_subject(subject)
+        from_email = self.get_from_email()
+        if text is None:
+            msg = EmailMessage(subject, html, from_email, to, headers=headers)
+            msg.content_subtype = "html"
+            return msg
+        msg = EmailMultiAlternatives(subject, text, from_email, to, headers=headers)
+        if html is not None:
+            msg.attach_alternative(html, "text/html")
+        return msg
+
     def send_confirmation_mail(self, request, emailconfirmation, signup):
+        email = emailconfirmation.email_address.email
+        # a signup is for a new address, counting it per IP would turn
+        # away the signups of every user behind the same NAT
+        throttle = SendEmailCodeThrottle()
+        if request is not None and not throttle.allow(request, email, per_ip=not signup):
+            raise Throttled(throttle.wait())
         if settings.EMAIL_VERIFICATION_BY_CODE:
-            # TODO: use a better token generation library like pyotp
-            code = str(random.randint(100000, 999999))
-            expire_minutes = settings.VERIFICATION_CODE_EXPIRATION_TIME
-            OTPModel.objects.create(
-                user=emailconfirmation.email_address.user,
-                code=code,
-                expires_at=timezone.now() + timezone.timedelta(minutes=expire_minutes)
-            )
-            ctx = {"code": code}
+            email_address = emailconfirmation.email_address
+            code = get_otp_backend().create(email_address.user, email_address.email)
+            # the template greets the user, the emails get no context processors
+            ctx = {"code": code, "user": email_address.user}
             template = 'accounts/email/email_confirmation_code'
             self.send_mail(template, emailconfirmation.email_address.email, ctx)
         else:
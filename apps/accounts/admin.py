@@ -2,7 +2,8 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
-from .models import User, Profile, OTPModel
+from . import search
+from .models import User, Profile, OTPModel, QueuedEmail, Broadcast
 from .forms import CustomUserCreationForm, CustomUserChangeForm
 
 
@@ -28,10 +29,33 @@ class UserAdmin(BaseUserAdmin):
             }
         )
     ]
+    # matched on the indexed search_text, see `get_search_results`
     search_fields = ["email", "first_name", "last_name"]
-    ordering = ["first_name", "last_name"]
+    # newest first on the created_at/id index, the name ordering had none
+    ordering = ["-created_at", "-id"]
+    # skip the COUNT(*) of the whole table next to the filtered count
+    show_full_result_count = False
     filter_horizontal = []
 
+    def get_search_results(self, request, queryset, search_term):
+        """the indexed user search instead of `icontains` on every search field"""
+        return search.search(queryset, search_term), False
+
 admin.site.register(User, UserAdmin)
 admin.site.register(Profile)
 admin.site.register(OTPModel)
+
+
+@admin.register(QueuedEmail)
+class QueuedEmailAdmin(admin.ModelAdmin):
+    """Outbound mail queue"""
+    list_display = ["subject", "status", "attempts", "scheduled_at", "sent_at"]
+    list_filter = ["status"]
+
+
+@admin.register(Broadcast)
+class BroadcastAdmin(admin.ModelAdmin):
+    """Emails sent to many users, with the `send_broadcast` command"""
+    list_display = ["subject", "status", "sent", "failed", "created_at", "finished_at"]
+    list_filter = ["status"]
+    readonly_fields = ["status", "last_user_id", "sent", "failed", "last_error", "finished_at"]
@@ -7,3 +7,6 @@ class AccountsConfig(AppConfig):
 
     def ready(self):
         import apps.accounts.signals
+        from django.conf import settings
+        from . import email_templates
+        email_templates.preload(settings.EMAIL_TEMPLATES)
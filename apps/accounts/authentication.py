@@ -0,0 +1,127 @@
+"""JWT authentication that trusts the token claims instead of loading the user"""
+import time
+from django.conf import settings
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from dj_rest_auth.jwt_auth import JWTCookieAuthentication, CookieTokenRefreshSerializer
+
+from .models import User
+
+CLAIMS = ("email", "is_active", "is_staff", "is_superuser")
+CLAIMS_ISSUED_AT = "claims_at"
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Adds the user flags to the tokens. The refresh token hands them on
+    to every access token made from it, together with the time they were read.
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        stamp_claims(token, user)
+        return token
+
+
+class ClaimsTokenRefreshSerializer(CookieTokenRefreshSerializer):
+    """
+    Reads the claims again when a token is refreshed. Copied from the
+    refresh token they would be as old as the login, and every access
+    token made after `JWT_CLAIMS_MAX_AGE` would query the user.
+    """
+
+    def token_class(self, token):
+        refresh = RefreshToken(token)
+        user = User.objects.filter(pk=refresh.get(api_settings.USER_ID_CLAIM)).first()
+        if user is not None:
+            stamp_claims(refresh, user)
+        return refresh
+
+
+def stamp_claims(token, user):
+    """store the `CLAIMS` of `user` in `token`, with the time they were read"""
+    for claim in CLAIMS:
+        token[claim] = getattr(user, claim)
+    token[CLAIMS_ISSUED_AT] = int(time.time())
+
+
+class ClaimsUser:
+    """
+    A user built from the token claims. Only the id and the flags in `CLAIMS`
+    are known up front, reading anything else (or saving, checking
+    permissions, ...) loads the `User` row once and delegates to it.
+    Attributes set on it are set on that `User`, so they are saved with it.
+    """
+    is_anonymous = False
+    is_authenticated = True
+
+    def __init__(self, token):
+        # simplejwt stores the id as a string
+        pk = User._meta.pk.to_python(token[api_settings.USER_ID_CLAIM])
+        self.__dict__.update({claim: token[claim] for claim in CLAIMS}, token=token, id=pk, pk=pk)
+
+    @cached_property
+    def db_user(self):
+        try:
+            return User.objects.get(pk=self.pk)
+        except User.DoesNotExist:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        return getattr(self.db_user, attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.db_user, attr, value)
+        if attr in CLAIMS:
+            # read from here, not from `db_user`
+            self.__dict__[attr] = value
+
+    def __eq__(self, other):
+        if isinstance(other, (ClaimsUser, User)):
+            return self.pk == other.pk
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __str__(self):
+        return self.email
+
+
+def resolve_user(user):
+    """the `User` instance behind `request.user`, for code that needs the model itself"""
+    if isinstance(user, ClaimsUser):
+        return user.db_user
+    return user
+
+
+class StatelessJWTCookieAuthentication(JWTCookieAuthentication):
+    """
+    Same as `JWTCookieAuthentication`, but the user comes from the token
+    claims rather than a database query. Tokens without the claims, or
+    whose claims are older than `JWT_CLAIMS_MAX_AGE` seconds, are
+    authenticated against the database as usual.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        claims_at = validated_token.get(CLAIMS_ISSUED_AT)
+        if (
+            claims_at is None
+            or any(claim not in validated_token for claim in CLAIMS)
+            or time.time() - claims_at > settings.JWT_CLAIMS_MAX_AGE
+        ):
+            return super().get_user(validated_token)
+
+        if not validated_token["is_active"]:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        return ClaimsUser(validated_token)
@@ -0,0 +1,16 @@
+"""
+Benchmarks for the accounts app, run them with `python manage.py benchmark <name>`.
+Every module listed in `BENCHMARKS` defines `add_arguments(parser)` and
+`run(stdout, **options)`.
+"""
+
+BENCHMARKS = [
+    "image_upload",
+    "password_hashing",
+    "load",
+    "signup",
+    "api",
+    "schema",
+    "search",
+    "email_templates",
+]
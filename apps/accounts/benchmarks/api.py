@@ -0,0 +1,272 @@
+"""
+Latency, queries and allocations per request of the accounts API.
+
+By default the requests go through the test client on a throwaway
+database seeded with `--users` users. With `--url` they are sent to a
+running server instead (e.g. `http://localhost:8000`). The users are then
+seeded in the configured database, which the server must share, and
+deleted at the end. Only latencies can be measured against a server.
+
+Every endpoint is timed `--iterations` times, then run `--profile-iterations`
+more times with the queries captured and tracemalloc on. The results can
+be saved with `--save-baseline` and later runs checked against them with
+`--baseline`, which fails when an endpoint got slower (p95), makes more
+queries or allocates more than `--tolerance` allows.
+"""
+import os
+import json
+import time
+import secrets
+import tempfile
+import tracemalloc
+from io import BytesIO
+from http.cookiejar import DefaultCookiePolicy
+import requests
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from apps.accounts import images
+from apps.accounts.models import User
+from apps.accounts.otp import get_otp_backend
+from .utils import percentile, test_database
+
+ENDPOINTS = ["register", "login", "user_get", "user_patch", "verify_email_code", "upload_image"]
+PASSWORD = "benchmark-password"
+LATENCY_NOISE_MS = 2.0 # smaller p95 increases are not reported, whatever the tolerance
+
+
+def add_arguments(parser):
+    parser.add_argument("--url", default=None, help="base url of a running server, the test client if not given")
+    parser.add_argument("--users", type=int, default=1000, help="users seeded before the run")
+    parser.add_argument("--iterations", type=int, default=100, help="timed requests per endpoint")
+    parser.add_argument("--profile-iterations", type=int, default=10, help="requests per endpoint with queries and allocations traced")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument("--save-baseline", default=None, help="write the results to this json file")
+    parser.add_argument("--baseline", default=None, help="compare the results with this json file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative increase over the baseline")
+
+
+class TestClientCaller:
+    """sends requests through the test client, in this process"""
+    in_process = True
+
+    def __init__(self):
+        self.client = Client()
+
+    def request(self, method, path, data=None, image=None, token=None):
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"} if token else {}
+        if image is not None:
+            upload = SimpleUploadedFile("image.jpg", image, content_type="image/jpeg")
+            response = self.client.post(path, {"image": upload}, **headers)
+        else:
+            body = "" if data is None else json.dumps(data)
+            response = self.client.generic(method, path, body, content_type="application/json", **headers)
+        # the jwt cookies would authenticate the next requests
+        self.client.cookies.clear()
+        is_json = response.get("Content-Type", "").startswith("application/json")
+        return response.status_code, response.json() if is_json else None
+
+
+class ServerCaller:
+    """sends requests to a running server over a keep-alive session"""
+    in_process = False
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+        # the jwt cookies would authenticate the next requests
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    def request(self, method, path, data=None, image=None, token=None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        if image is not None:
+            response = self.session.post(
+                self.url + path, files={"image": ("image.jpg", image, "image/jpeg")}, headers=headers,
+            )
+        else:
+            response = self.session.request(method, self.url + path, json=data, headers=headers)
+        is_json = response.headers.get("Content-Type", "").startswith("application/json")
+        return response.status_code, response.json() if is_json else None
+
+
+class Scenarios:
+    """builds the request for the i-th call of each endpoint, anything untimed is done here"""
+
+    def __init__(self, caller, prefix, users):
+        self.caller = caller
+        self.prefix = prefix
+        self.users = users
+        code, body = caller.request("POST", reverse("rest_login"), {"email": users[0].email, "password": PASSWORD})
+        if code != 200:
+            raise CommandError(f"Can't log in a seeded user: {code} {body}")
+        self.token = body["access"]
+        buffer = BytesIO()
+        Image.new("RGB", (800, 600), color=(200, 30, 30)).save(buffer, "JPEG")
+        self.image = buffer.getvalue()
+
+    def user(self, i):
+        return self.users[i % len(self.users)]
+
+    def register(self, i):
+        return "POST", reverse("rest_register"), {
+            "email": f"{self.prefix}new{i}@benchmark.test",
+            "password": PASSWORD,
+            "first_name": "bench",
+            "last_name": "mark",
+        }, {}
+
+    def login(self, i):
+        return "POST", reverse("rest_login"), {"email": self.user(i).email, "password": PASSWORD}, {}
+
+    def user_get(self, i):
+        return "GET", reverse("rest_user_details"), None, {"token": self.token}
+
+    def user_patch(self, i):
+        return "PATCH", reverse("rest_user_details"), {"first_name": f"bench{i}"}, {"token": self.token}
+
+    def verify_email_code(self, i):
+        user = self.user(i)
+        code = get_otp_backend().create(user, user.email)
+        return "POST", reverse("verify-email-code"), {"email": user.email, "code": code}, {}
+
+    def upload_image(self, i):
+        return "POST", reverse("upload-user-image"), None, {"token": self.token, "image": self.image}
+
+
+def seed(prefix, count):
+    """create `count` verified users, all with `PASSWORD`, hashed once"""
+    rows = (
+        {"email": f"{prefix}{i}@benchmark.test", "password": PASSWORD, "first_name": "bench", "last_name": "mark"}
+        for i in range(count)
+    )
+    with override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"]):
+        User.objects.bulk_create_users(rows, verified=True)
+    users = User.objects.filter(email__startswith=prefix)
+    users.update(password=make_password(PASSWORD))
+    return list(users.order_by("pk")[:10_000])
+
+
+def measure(caller, build, iterations, profile_iterations):
+    latencies, codes, queries, allocations = [], {}, [], []
+    for i in range(iterations):
+        method, path, data, extra = build(i)
+        before = time.perf_counter()
+        code, _ = caller.request(method, path, data, **extra)
+        latencies.append(time.perf_counter() - before)
+        codes[code] = codes.get(code, 0) + 1
+
+    if caller.in_process:
+        tracemalloc.start()
+        try:
+            for i in range(iterations, iterations + profile_iterations):
+                method, path, data, extra = build(i)
+                tracemalloc.reset_peak()
+                baseline, _ = tracemalloc.get_traced_memory()
+                with CaptureQueriesContext(connection) as context:
+                    caller.request(method, path, data, **extra)
+                _, peak = tracemalloc.get_traced_memory()
+                queries.append(len(context.captured_queries))
+                allocations.append((peak - baseline) / 1024)
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "p50": percentile(latencies, 50) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "queries": max(queries) if queries else None,
+        "alloc_kib": percentile(allocations, 50) if allocations else None,
+        "status": {str(code): count for code, count in codes.items()},
+    }
+
+
+def compare(results, baseline, tolerance):
+    """the list of regressions against a baseline"""
+    regressions = []
+    for endpoint, result in results.items():
+        old = baseline.get("endpoints", {}).get(endpoint)
+        if old is None:
+            continue
+        if result["p95"] > old["p95"] * (1 + tolerance) and result["p95"] - old["p95"] > LATENCY_NOISE_MS:
+            regressions.append(f"{endpoint}: p95 {old['p95']:.1f}ms -> {result['p95']:.1f}ms")
+        if None not in (result["queries"], old["queries"]) and result["queries"] > old["queries"]:
+            regressions.append(f"{endpoint}: queries {old['queries']} -> {result['queries']}")
+        if None not in (result["alloc_kib"], old["alloc_kib"]) and result["alloc_kib"] > old["alloc_kib"] * (1 + tolerance):
+            regressions.append(f"{endpoint}: allocations {old['alloc_kib']:.0f}KiB -> {result['alloc_kib']:.0f}KiB")
+    return regressions
+
+
+def run_endpoints(stdout, caller, prefix, users, endpoints, iterations, profile_iterations):
+    scenarios = Scenarios(caller, prefix, users)
+    results = {}
+    stdout.write(f"{'endpoint':<18} {'p50':>9} {'p95':>9} {'p99':>9} {'queries':>8} {'alloc':>10}  status")
+    for endpoint in endpoints:
+        result = measure(caller, getattr(scenarios, endpoint), iterations, profile_iterations)
+        results[endpoint] = result
+        queries = "-" if result["queries"] is None else str(result["queries"])
+        alloc = "-" if result["alloc_kib"] is None else f"{result['alloc_kib']:.0f}KiB"
+        status = ", ".join(f"{code}: {count}" for code, count in sorted(result["status"].items()))
+        stdout.write(
+            f"{endpoint:<18} {result['p50']:7.1f}ms {result['p95']:7.1f}ms {result['p99']:7.1f}ms "
+            f"{queries:>8} {alloc:>10}  {status}"
+        )
+    return results
+
+
+def run(stdout, url, users, iterations, profile_iterations, endpoints, save_baseline, baseline, tolerance, **options):
+    prefix = f"bench-{secrets.token_hex(4)}-"
+    overrides = {
+        # the limits would reject most of the benchmark requests
+        "ACCOUNT_RATE_LIMITS": False,
+        "REST_FRAMEWORK": {
+            **settings.REST_FRAMEWORK,
+            "DEFAULT_THROTTLE_RATES": {scope: "1000000/min" for scope in settings.REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"]},
+        },
+    }
+    image_directory = tempfile.TemporaryDirectory()
+    if url is None:
+        overrides.update({
+            "ALLOWED_HOSTS": ["testserver"],
+            "EMAIL_BACKEND": "django.core.mail.backends.locmem.EmailBackend",
+            "PROFILE_IMAGE_DIRECTORY": image_directory.name,
+            "PROFILE_IMAGE_UPLOAD_DIRECTORY": os.path.join(image_directory.name, "uploads"),
+        })
+
+    with image_directory, override_settings(**overrides):
+        if url is None:
+            with test_database(on_disk=False):
+                seeded = seed(prefix, users)
+                stdout.write(f"test client, {users} users")
+                results = run_endpoints(
+                    stdout, TestClientCaller(), prefix, seeded, endpoints, iterations, profile_iterations,
+                )
+                # the uploads still processing use the database and image directory
+                images.shutdown_executor()
+        else:
+            try:
+                seeded = seed(prefix, users)
+                stdout.write(f"{url}, {users} users")
+                results = run_endpoints(
+                    stdout, ServerCaller(url), prefix, seeded, endpoints, iterations, profile_iterations,
+                )
+            finally:
+                User.objects.filter(email__startswith=prefix).delete()
+
+    if save_baseline:
+        with open(save_baseline, "w") as f:
+            json.dump({"target": url or "test client", "users": users, "endpoints": results}, f, indent=2)
+        stdout.write(f"baseline saved to {save_baseline}")
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), tolerance)
+        if regressions:
+            raise CommandError("Regressions against the baseline:\n" + "\n".join(regressions))
+        stdout.write("no regressions against the baseline")
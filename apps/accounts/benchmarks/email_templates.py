@@ -0,0 +1,71 @@
+"""
+Email renders per second, `render_to_string` as allauth renders them
+against the compiled templates of `email_templates`, one at a time and
+in batches like a broadcast.
+
+Every render is a whole email: the subject and the text (and html when
+there is one) for the confirmation code and the welcome emails. No
+database is needed, the users are not saved.
+"""
+import time
+from django.contrib.auth.models import AnonymousUser
+from django.template import TemplateDoesNotExist
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+
+from apps.accounts import email_templates
+from apps.accounts.models import User
+
+EMAILS = {
+    "accounts/email/email_confirmation_code": lambda user, i: {"user": user, "code": f"{i % 1000000:06}"},
+    "accounts/email/welcome": lambda user, i: {"user": user},
+}
+
+
+def add_arguments(parser):
+    parser.add_argument("--renders", type=int, default=20000, help="emails rendered by every method")
+    parser.add_argument("--batch-size", type=int, default=500)
+
+
+def render_to_string_mail(prefix, contexts, request):
+    """what allauth's `render_mail` does, with the request and its context processors"""
+    for context in contexts:
+        " ".join(render_to_string(f"{prefix}_subject.txt", context).splitlines()).strip()
+        for ext in ["html", "txt"]:
+            try:
+                render_to_string(f"{prefix}_message.{ext}", context, request).strip()
+            except TemplateDoesNotExist:
+                pass
+
+
+def compiled_mail(prefix, contexts, request):
+    for context in contexts:
+        email_templates.render_mail(prefix, [context])
+
+
+def compiled_batches(batch_size):
+    def render(prefix, contexts, request):
+        for start in range(0, len(contexts), batch_size):
+            email_templates.render_mail(prefix, contexts[start:start + batch_size])
+    return render
+
+
+def run(stdout, renders, batch_size, **options):
+    request = RequestFactory().get("/")
+    request.user = AnonymousUser()
+    user = User(email="ada.lovelace@example.com", first_name="Ada", last_name="Lovelace")
+    methods = [
+        ("render_to_string", render_to_string_mail),
+        ("compiled", compiled_mail),
+        (f"compiled, batches of {batch_size}", compiled_batches(batch_size)),
+    ]
+    stdout.write(f"{renders} emails per method")
+    for prefix, make_context in EMAILS.items():
+        contexts = [make_context(user, i) for i in range(renders)]
+        for label, method in methods:
+            # compiles the templates and fills the loader cache
+            method(prefix, contexts[:1], request)
+            start = time.perf_counter()
+            method(prefix, contexts, request)
+            elapsed = time.perf_counter() - start
+            stdout.write(f"{prefix.rsplit('/', 1)[-1]:<24} {label:<28} {renders / elapsed:10.0f} renders/s")
@@ -0,0 +1,74 @@
+"""
+Peak memory and time of processing one large profile image upload.
+
+Each case runs in a forked child process, so the peak resident set
+size it reports belongs to that case alone.
+"""
+import os
+import time
+import resource
+import tempfile
+import multiprocessing
+from PIL import Image
+from django.conf import settings
+
+from apps.accounts import images
+
+
+def add_arguments(parser):
+    parser.add_argument("--width", type=int, default=6000)
+    parser.add_argument("--height", type=int, default=4000)
+    parser.add_argument("--runs", type=int, default=3)
+
+
+def make_photo(path, width, height):
+    """a noisy jpeg, so it compresses about as badly as a real photo"""
+    noise = Image.effect_noise((width, height), 64)
+    Image.merge("RGB", (noise, noise.rotate(90, expand=False), noise.transpose(Image.Transpose.FLIP_LEFT_RIGHT))).save(
+        path, "JPEG", quality=92
+    )
+
+
+def _current_rss_kb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() // 1024
+
+
+def _measure(queue, source, destination, draft):
+    baseline = _current_rss_kb()
+    start = time.perf_counter()
+    images.process_image(
+        source, destination, settings.PROFILE_IMAGE_SIZES,
+        settings.PROFILE_IMAGE_FORMAT, settings.PROFILE_IMAGE_QUALITY, draft=draft,
+    )
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((elapsed, peak - baseline))
+
+
+def run(stdout, width, height, runs, **options):
+    context = multiprocessing.get_context("fork")
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "photo.jpg")
+        make_photo(source, width, height)
+        stdout.write(
+            f"{width}x{height} jpeg, {os.path.getsize(source) / 1024 / 1024:.1f} MB, "
+            f"sizes {settings.PROFILE_IMAGE_SIZES}"
+        )
+
+        for label, draft in [("full decode", False), ("draft decode", True)]:
+            timings, peaks = [], []
+            for _ in range(runs):
+                queue = context.Queue()
+                process = context.Process(
+                    target=_measure, args=(queue, source, os.path.join(directory, "out"), draft)
+                )
+                process.start()
+                elapsed, peak = queue.get()
+                process.join()
+                timings.append(elapsed)
+                peaks.append(peak)
+            stdout.write(
+                f"{label:<14} time: {min(timings) * 1000:8.1f} ms   "
+                f"peak rss: {max(peaks) / 1024:8.1f} MB"
+            )
@@ -0,0 +1,79 @@
+"""
+Concurrent HTTP load against a running server.
+
+Use it to compare deployments, e.g. the same endpoint served by a WSGI
+and an ASGI server:
+
+    gunicorn users.wsgi -w 2 --threads 8 -b :8000
+    uvicorn users.asgi:application --workers 2 --port 8001
+    python manage.py benchmark load --url http://localhost:8000/api/v1/accounts/verify-email-code/ \
+        --method POST --json '{"email": "a@b.c", "code": "123456"}' --concurrency 64
+
+Measured that way (2000 requests of a wrong code, the throttle rates
+raised, SQLite, 2 workers and the load generator on one CPU), with the
+native async views this project used to have and with the sync ones:
+
+    server                           concurrency   req/s   p50      p95
+    gunicorn, 8 threads                        8     205    33ms     75ms
+    gunicorn, 8 threads                       64     254   223ms    548ms
+    uvicorn, async views                       8      83    89ms    160ms
+    uvicorn, async views                      64     128   477ms    713ms
+    uvicorn, sync views                        8      91    83ms    137ms
+    uvicorn, sync views                       64     134   449ms    807ms
+
+The async views were slower than the sync ones under the same server
+and were removed. They waited on the database through the thread hops
+of the async ORM, and on Google through `requests` in a thread, as no
+async HTTP client is a dependency. Nothing in them awaited real
+non-blocking I/O. Serve the project with gunicorn.
+"""
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+from .utils import latency_summary
+
+
+def add_arguments(parser):
+    parser.add_argument("--url", required=True)
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--json", dest="body", default=None, help="json request body")
+    parser.add_argument("--header", dest="headers", action="append", default=[], help="extra header as 'Name: value'")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight at once")
+    parser.add_argument("--requests", dest="total", type=int, default=1000, help="total number of requests")
+    parser.add_argument("--timeout", type=float, default=30)
+
+
+def run(stdout, url, method, body, headers, concurrency, total, timeout, **options):
+    body = None if body is None else json.loads(body)
+    headers = dict(
+        (name.strip(), value.strip()) for name, value in (header.split(":", 1) for header in headers)
+    )
+    local = threading.local()
+
+    def send(_):
+        # one keep-alive session per thread
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = local.session.request(method, url, json=body, headers=headers, timeout=timeout)
+            code = response.status_code
+        except requests.RequestException as e:
+            code = type(e).__name__
+        return time.perf_counter() - start, code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(send, range(total)))
+    elapsed = time.perf_counter() - start
+
+    codes = {}
+    for _, code in results:
+        codes[code] = codes.get(code, 0) + 1
+    stdout.write(f"{method} {url}, {total} requests, {concurrency} concurrent")
+    stdout.write(f"throughput: {total / elapsed:.1f} req/s in {elapsed:.2f}s")
+    stdout.write(f"latency  {latency_summary([latency for latency, _ in results])}")
+    stdout.write(f"status   {', '.join(f'{code}: {count}' for code, count in sorted(codes.items(), key=str))}")
@@ -0,0 +1,68 @@
+"""
+Logins per second for different hashing pool sizes and hasher settings.
+
+Every login is one password check. They are made from `--threads`
+threads, like the threads of a WSGI worker, or concurrently on one
+event loop with `--async`.
+"""
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.hashers import get_hasher
+from django.test import override_settings
+from django.utils.crypto import get_random_string
+
+from apps.accounts import hashing
+
+
+def add_arguments(parser):
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4], help="pool sizes to compare")
+    parser.add_argument("--hashers", nargs="+", default=["pbkdf2_sha256"], help="hasher algorithms to compare")
+    parser.add_argument(
+        "--iterations", type=int, nargs="+", default=[None],
+        help="work factors to compare for hashers that take one (default: the hasher's own)",
+    )
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--async", dest="use_async", action="store_true", help="check passwords from async code")
+
+
+def encode(algorithm, password, iterations):
+    hasher = get_hasher(algorithm)
+    if iterations is None:
+        return hasher.encode(password, hasher.salt())
+    return hasher.encode(password, hasher.salt(), iterations)
+
+
+def run_threads(encoded, password, logins, threads):
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(lambda _: hashing.check_password(password, encoded), range(logins)))
+    assert all(results)
+
+
+async def run_async(encoded, password, logins):
+    results = await asyncio.gather(*[hashing.acheck_password(password, encoded) for _ in range(logins)])
+    assert all(results)
+
+
+def run(stdout, workers, hashers, iterations, logins, threads, use_async, **options):
+    password = get_random_string(16)
+    mode = "async" if use_async else f"{threads} threads"
+    stdout.write(f"{logins} logins from {mode}")
+    for algorithm in hashers:
+        for work in iterations:
+            encoded = encode(algorithm, password, work)
+            label = algorithm if work is None else f"{algorithm} ({work})"
+            for size in workers:
+                with override_settings(PASSWORD_HASHING_WORKERS=size):
+                    hashing.shutdown_executor()
+                    # start the pool before timing
+                    hashing.check_password(password, encoded)
+                    start = time.perf_counter()
+                    if use_async:
+                        asyncio.run(run_async(encoded, password, logins))
+                    else:
+                        run_threads(encoded, password, logins, threads)
+                    elapsed = time.perf_counter() - start
+                    hashing.shutdown_executor()
+                stdout.write(f"{label:<28} workers: {size:<3} {logins / elapsed:8.1f} logins/s")
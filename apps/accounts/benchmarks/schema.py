@@ -0,0 +1,43 @@
+"""
+Cost of the schema endpoint, generated per request versus cached.
+
+Both views are called directly with the same requests, for the YAML and
+JSON formats, and the cached one also with a matching If-None-Match.
+"""
+import time
+from django.test import RequestFactory
+from drf_spectacular.views import SpectacularAPIView
+
+from apps.accounts import schema
+from apps.accounts.schema import CachedSpectacularAPIView
+from .utils import latency_summary
+
+
+def add_arguments(parser):
+    parser.add_argument("--requests", dest="total", type=int, default=50, help="requests per view and format")
+
+
+def time_view(view, total, **headers):
+    request_factory = RequestFactory()
+    latencies = []
+    for _ in range(total):
+        request = request_factory.get("/api/schema", **headers)
+        start = time.perf_counter()
+        response = view(request)
+        if hasattr(response, "render"):
+            # the generated schema is only serialized when rendered
+            response.render()
+        latencies.append(time.perf_counter() - start)
+    return latencies, response
+
+
+def run(stdout, total, **options):
+    schema.clear()
+    generated, cached = SpectacularAPIView.as_view(), CachedSpectacularAPIView.as_view()
+    for label, accept in [("yaml", "application/vnd.oai.openapi"), ("json", "application/vnd.oai.openapi+json")]:
+        latencies, _ = time_view(generated, total, HTTP_ACCEPT=accept)
+        stdout.write(f"{label} generated    {latency_summary(latencies)}")
+        latencies, response = time_view(cached, total, HTTP_ACCEPT=accept)
+        stdout.write(f"{label} cached       {latency_summary(latencies)}")
+        latencies, _ = time_view(cached, total, HTTP_ACCEPT=accept, HTTP_IF_NONE_MATCH=response["ETag"])
+        stdout.write(f"{label} not modified {latency_summary(latencies)}")
@@ -0,0 +1,95 @@
+"""
+User search, the indexed `search_text` (see `search.py`) against the
+`icontains` lookups the admin used on email, first and last name.
+
+Loads `--users` generated users with their profile in a throwaway
+database, then times the first page of the staff listing and its count
+for a few queries, from a rare name to a prefix most users match.
+"""
+import time
+import random
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from apps.accounts import search
+from apps.accounts.models import User, Profile
+from apps.accounts.pagination import estimate_count
+from .utils import database_profile, latency_summary, test_database
+
+FIRST_NAMES = ["maria", "john", "amara", "chen", "fatima", "james", "olu", "sofia", "ivan", "aisha", "lucas", "mei"]
+LAST_NAMES = ["garcia", "smith", "okafor", "wang", "hassan", "brown", "adeyemi", "rossi", "petrov", "khan"]
+DOMAINS = ["gmail.com", "yahoo.com", "example.org", "users.app"]
+CITIES = ["Lagos", "London", "Lima", "Berlin", "Nairobi", "Toronto", "Osaka", "Madrid"]
+QUERIES = [
+    "lovelace", # ten users
+    "user12345", # eleven emails
+    "okafor lagos", # a name and a city
+    "gmail", # a quarter of the users
+    "ma", # a prefix of most users
+]
+
+
+def add_arguments(parser):
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=10, help="runs of every query")
+
+
+def seed(users, batch_size=5000):
+    rng = random.Random(0)
+    for start in range(0, users, batch_size):
+        batch = []
+        for i in range(start, min(start + batch_size, users)):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            if i % (users // 10 or 1) == 0:
+                last = "lovelace"
+            user = User(
+                email=f"{first}.{last}.user{i}@{rng.choice(DOMAINS)}", password="!",
+                first_name=first.title(), last_name=last.title(),
+            )
+            profile = Profile(city=rng.choice(CITIES))
+            user.search_text = search.document(user, profile)
+            batch.append((user, profile))
+        with transaction.atomic():
+            User.objects.bulk_create([user for user, _ in batch])
+            for user, profile in batch:
+                profile.user = user
+            Profile.objects.bulk_create([profile for _, profile in batch])
+
+
+def icontains(queryset, query):
+    """what the admin `search_fields` did, on the user columns only"""
+    for word in query.split():
+        queryset = queryset.filter(
+            Q(email__icontains=word) | Q(first_name__icontains=word) | Q(last_name__icontains=word)
+        )
+    return queryset
+
+
+def listing_search(queryset, query):
+    """the search of the staff listing, capped like it"""
+    return search.search(queryset, query, settings.USER_SEARCH_MAX_RESULTS)
+
+
+def time_query(filtered, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        page = list(filtered.order_by("-created_at", "-pk")[:50])
+        count, _ = estimate_count(filtered)
+        latencies.append(time.perf_counter() - start)
+    return latencies, len(page), count
+
+
+def run(stdout, users, repeat, **options):
+    with test_database() as db:
+        stdout.write(database_profile(db))
+        start = time.perf_counter()
+        seed(users)
+        with db.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        stdout.write(f"{users} users loaded in {time.perf_counter() - start:.0f}s")
+        for query in QUERIES:
+            for label, method in [("icontains", icontains), ("search", listing_search)]:
+                latencies, rows, count = time_query(method(User.objects.all(), query), repeat)
+                stdout.write(f"{query!r:15} {label:10} {rows:3} rows, count {count:8}  {latency_summary(latencies)}")
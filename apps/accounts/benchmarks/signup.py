@@ -0,0 +1,87 @@
+"""
+Concurrent signups against the configured database profile.
+
+Threads post to the register endpoint through the test client, each with
+its own database connection, on a throwaway copy of the database (a file
+for SQLite, so the writers really contend for its lock). Run it once per
+profile to compare them:
+
+    DATABASE_SQLITE_WAL=false python manage.py benchmark signup
+    python manage.py benchmark signup
+    DATABASE_ENGINE=postgresql python manage.py benchmark signup
+    DATABASE_ENGINE=postgresql DATABASE_POOL_SIZE=8 python manage.py benchmark signup
+"""
+import time
+import threading
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from .utils import database_profile, latency_summary, test_database
+
+
+def add_arguments(parser):
+    parser.add_argument("--signups", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=8, help="concurrent signups")
+    parser.add_argument(
+        "--real-hasher", action="store_true",
+        help="hash passwords with the configured hasher, by default a fast one so the database is measured",
+    )
+
+
+def run(stdout, signups, threads, real_hasher, **options):
+    overrides = {
+        "EMAIL_BACKEND": "django.core.mail.backends.locmem.EmailBackend",
+        "EMAIL_SEND_MODE": "sync",
+        "ACCOUNT_RATE_LIMITS": False,
+        "ALLOWED_HOSTS": ["testserver"],
+    }
+    if not real_hasher:
+        overrides["PASSWORD_HASHERS"] = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+    with override_settings(**overrides), test_database() as db:
+        stdout.write(database_profile(db))
+        url = reverse("rest_register")
+        counter = iter(range(signups))
+        lock = threading.Lock()
+        results = []
+
+        def worker():
+            client = Client()
+            try:
+                while True:
+                    with lock:
+                        number = next(counter, None)
+                    if number is None:
+                        return
+                    start = time.perf_counter()
+                    try:
+                        code = client.post(url, {
+                            "email": f"signup{number}@benchmark.test",
+                            "password": "benchmark-password",
+                            "first_name": "bench",
+                            "last_name": "mark",
+                        }, content_type="application/json").status_code
+                    except Exception as e:
+                        # e.g. OperationalError: database is locked
+                        code = type(e).__name__
+                    with lock:
+                        results.append((time.perf_counter() - start, code))
+            finally:
+                connection.close()
+
+        start = time.perf_counter()
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+    codes = {}
+    for _, code in results:
+        codes[code] = codes.get(code, 0) + 1
+    stdout.write(f"{signups} signups from {threads} threads")
+    stdout.write(f"throughput: {codes.get(201, 0) / elapsed:.1f} signups/s in {elapsed:.2f}s")
+    stdout.write(f"latency  {latency_summary([latency for latency, _ in results])}")
+    stdout.write(f"status   {', '.join(f'{code}: {count}' for code, count in sorted(codes.items(), key=str))}")
@@ -0,0 +1,69 @@
+"""Helpers shared by the benchmarks"""
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+def percentile(samples, percent):
+    """the `percent` percentile of a list of numbers (nearest rank)"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def latency_summary(samples):
+    """p50/p95/p99 and max of latencies in seconds, formatted in milliseconds"""
+    return "  ".join(
+        f"{label}: {value * 1000:7.1f} ms" for label, value in [
+            ("p50", percentile(samples, 50)),
+            ("p95", percentile(samples, 95)),
+            ("p99", percentile(samples, 99)),
+            ("max", max(samples, default=0.0)),
+        ]
+    )
+
+
+@contextmanager
+def test_database(on_disk=True):
+    """
+    Run the block against a new, migrated test database, dropped at the end.
+    With `on_disk` a SQLite test database is a temporary file rather than
+    in memory, so it is shared by threads and locks like the real one.
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    settings_dict = connection.settings_dict
+    old_name = settings_dict["NAME"]
+    old_test_name = settings_dict["TEST"].get("NAME")
+    directory = None
+    if on_disk and connection.vendor == "sqlite":
+        directory = tempfile.mkdtemp()
+        settings_dict["TEST"]["NAME"] = os.path.join(directory, "benchmark.sqlite3")
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        settings_dict["TEST"]["NAME"] = old_test_name
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def database_profile(connection):
+    """a short description of the database settings in use"""
+    settings_dict = connection.settings_dict
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            journal_mode = cursor.fetchone()[0]
+        options = settings_dict["OPTIONS"]
+        return (
+            f"sqlite, journal_mode: {journal_mode}, "
+            f"transaction_mode: {options.get('transaction_mode')}, timeout: {options.get('timeout')}"
+        )
+    pool = settings_dict["OPTIONS"].get("pool")
+    return f"{connection.vendor}, CONN_MAX_AGE: {settings_dict['CONN_MAX_AGE']}, pool: {pool or 'off'}"
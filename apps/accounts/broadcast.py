@@ -0,0 +1,162 @@
+"""
+Emails sent to many users at once, see the `Broadcast` model.
+
+The users are read in primary key order, `BROADCAST_BATCH_SIZE` at a
+time, with their profile. The templates are compiled once (see
+`email_templates`), every batch is rendered in one go and sent over a
+single SMTP connection. Sending is paced to
+`BROADCAST_RATE_LIMIT` messages per second.
+
+`Broadcast.last_user_id` is saved after every batch, and also before giving up
+when the connection fails or the server answers with a temporary (4xx)
+error. A broadcast that is sent again resumes after it, so only a crash in
+the middle of a batch sends part of that batch twice. A message refused
+for good (5xx) is counted as failed and skipped.
+
+A process takes a broadcast with an atomic update of
+`Broadcast.leased_until`, renewed at every checkpoint, so two processes
+can't send the same one. The lease is given back when sending stops, and
+after a crash the broadcast can be resumed once `BROADCAST_LEASE` seconds
+have passed.
+"""
+import time
+import smtplib
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import F, Q
+from django.template import TemplateDoesNotExist
+from django.utils import timezone
+
+from . import email_templates
+from .models import Broadcast, User
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastBusy(Exception):
+    """the broadcast is taken by another process"""
+
+
+def refused(error):
+    """whether the server refused this message for good, the next ones can still go"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    # a 4xx answer is temporary, it would be the same for the next messages
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+def load_templates(name):
+    """the compiled text and html (or None) templates of a broadcast"""
+    text = email_templates.get(f"{name}.txt")
+    if text is None:
+        raise TemplateDoesNotExist(f"{name}.txt")
+    return text, email_templates.get(f"{name}.html")
+
+
+def recipients(broadcast):
+    """the users left to send `broadcast` to"""
+    return User.objects.filter(**broadcast.filters).filter(
+        pk__gt=broadcast.last_user_id
+    ).select_related("profile").order_by("pk")
+
+
+def build_messages(broadcast, templates, users, connection):
+    """the messages of a batch of users"""
+    text, html = templates
+    contexts = [{**broadcast.context, "user": user} for user in users]
+    texts = text.render_many(contexts)
+    htmls = [None] * len(users) if html is None else html.render_many(contexts)
+    messages = []
+    for user, body, html_body in zip(users, texts, htmls):
+        message = EmailMultiAlternatives(
+            broadcast.subject, body, broadcast.from_email or settings.DEFAULT_FROM_EMAIL,
+            [user.email], connection=connection,
+        )
+        if html_body is not None:
+            message.attach_alternative(html_body, "text/html")
+        messages.append(message)
+    return messages
+
+
+class Pacer:
+    """sleeps as needed to stay under `rate` messages per second, 0 for no limit"""
+
+    def __init__(self, rate, sleep=time.sleep):
+        self.rate = rate
+        self.sleep = sleep
+        self.start = time.monotonic()
+        self.count = 0
+
+    def wait(self):
+        self.count += 1
+        if self.rate:
+            delay = self.count / self.rate - (time.monotonic() - self.start)
+            if delay > 0:
+                self.sleep(delay)
+
+
+def lease_end():
+    return timezone.now() + timedelta(seconds=settings.BROADCAST_LEASE)
+
+
+def acquire(broadcast):
+    """takes `broadcast` for this process, raises `BroadcastBusy` if another one holds it"""
+    now = timezone.now()
+    taken = Broadcast.objects.filter(
+        Q(leased_until__isnull=True) | Q(leased_until__lt=now), pk=broadcast.pk,
+    ).exclude(status=Broadcast.DONE).update(status=Broadcast.SENDING, leased_until=lease_end(), updated_at=now)
+    if not taken:
+        raise BroadcastBusy(f"Broadcast {broadcast.pk} is being sent by another process")
+
+
+def checkpoint(broadcast, last_user_id, sent, failed, error, leased_until):
+    """records the progress of a batch, the counters are added in the database"""
+    Broadcast.objects.filter(pk=broadcast.pk).update(
+        last_user_id=last_user_id, sent=F("sent") + sent, failed=F("failed") + failed,
+        last_error=error or F("last_error"), leased_until=leased_until, updated_at=timezone.now(),
+    )
+    broadcast.refresh_from_db()
+
+
+def send(broadcast, batch_size=None, rate=None, sleep=time.sleep):
+    """sends `broadcast` to the users it has not reached yet, returns it up to date"""
+    batch_size = batch_size or settings.BROADCAST_BATCH_SIZE
+    rate = settings.BROADCAST_RATE_LIMIT if rate is None else rate
+    templates = load_templates(broadcast.template)
+    pacer = Pacer(rate, sleep)
+    acquire(broadcast)
+
+    while True:
+        batch = list(recipients(broadcast)[:batch_size])
+        if not batch:
+            break
+        sent = failed = 0
+        last_user_id, error = broadcast.last_user_id, ""
+        try:
+            with get_connection(fail_silently=False) as connection:
+                messages = build_messages(broadcast, templates, batch, connection)
+                for user, message in zip(batch, messages):
+                    try:
+                        sent += connection.send_messages([message])
+                    except smtplib.SMTPException as e:
+                        if not refused(e):
+                            raise
+                        failed += 1
+                        error = f"{user.email}: {e}"
+                        logger.warning(f"Broadcast {broadcast.pk} to {user.email} failed: {e}")
+                    last_user_id = user.pk
+                    pacer.wait()
+        except Exception as e:
+            # the connection is gone or the server can't take more for now, keep what
+            # was sent and give the broadcast back, it resumes from there next time
+            checkpoint(broadcast, last_user_id, sent, failed, str(e), None)
+            raise
+        checkpoint(broadcast, last_user_id, sent, failed, error, lease_end())
+
+    Broadcast.objects.filter(pk=broadcast.pk).update(
+        status=Broadcast.DONE, finished_at=timezone.now(), leased_until=None,
+    )
+    broadcast.refresh_from_db()
+    return broadcast
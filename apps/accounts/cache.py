@@ -0,0 +1,132 @@
+"""Read-through cache of the serialized user details"""
+import uuid
+import logging
+import threading
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.core.cache.backends.locmem import LocMemCache
+
+from . import timing
+
+logger = logging.getLogger(__name__)
+
+_local_cache = LocMemCache("accounts-user-details", {})
+_stats = {"hits": 0, "misses": 0, "invalidations": 0, "errors": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cache_stats():
+    """hit, miss, invalidation and error counters of this process"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def get_cache():
+    """
+    The `USER_DETAILS_CACHE_ALIAS` cache from `CACHES`, or a
+    local memory cache if that alias is not configured
+    """
+    if settings.USER_DETAILS_CACHE_ALIAS in settings.CACHES:
+        return caches[settings.USER_DETAILS_CACHE_ALIAS]
+    return _local_cache
+
+
+# user columns missing from the cached details, writing only these keeps the cache
+HIDDEN_FIELDS = {"password", "last_login", "search_text"}
+
+
+def cache_key(user_id):
+    return f"accounts:user-details:{user_id}"
+
+
+def version_key(user_id):
+    return f"accounts:user-details-version:{user_id}"
+
+
+def _new_version():
+    # never reused, so an entry written under an older version can't match
+    # again. A version lost from the cache only costs a miss.
+    return uuid.uuid4().hex
+
+
+def _current_version(cache, user_id, version):
+    """the version read with the entry, or a fresh one if the cache lost it"""
+    if version is None:
+        cache.add(version_key(user_id), _new_version(), settings.USER_DETAILS_CACHE_TIMEOUT)
+        version = cache.get(version_key(user_id))
+    return version
+
+
+def get_user_details(request, user_id, serialize):
+    """
+    Returns the serialized details of `user_id`, calling `serialize()` and
+    storing its result on a miss. The payload holds absolute urls, so one
+    entry per host is kept under the user's key.
+
+    Every entry carries the version of the user it was serialized at, and
+    `invalidate_user_details` replaces that version. A miss that serialized
+    the old row while the invalidation ran stores it under the old version,
+    where no later read matches it.
+    """
+    host = request.get_host()
+    cache = get_cache()
+    key = cache_key(user_id)
+    try:
+        found = cache.get_many([key, version_key(user_id)])
+        version = _current_version(cache, user_id, found.get(version_key(user_id)))
+    except Exception as e:
+        # an unreachable cache server shouldn't take the endpoint down
+        logger.warning(f"User details cache unavailable: {e}")
+        _count("errors")
+        return serialize()
+
+    entry = found.get(key)
+    if entry is None or entry.get("version") != version:
+        entry = {"version": version, "hosts": {}}
+    if host in entry["hosts"]:
+        _count("hits")
+        timing.record("cache_hit")
+        return entry["hosts"][host]
+
+    _count("misses")
+    timing.record("cache_miss")
+    payload = serialize()
+    entry["hosts"][host] = payload
+    try:
+        cache.set(key, entry, settings.USER_DETAILS_CACHE_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"User details cache unavailable: {e}")
+        _count("errors")
+    return payload
+
+
+def invalidate_user_details(*user_ids):
+    """drop the cached details of users, see `invalidate_on_commit`"""
+    try:
+        cache = get_cache()
+        cache.set_many(
+            {version_key(user_id): _new_version() for user_id in user_ids},
+            settings.USER_DETAILS_CACHE_TIMEOUT,
+        )
+        cache.delete_many([cache_key(user_id) for user_id in user_ids])
+    except Exception as e:
+        logger.warning(f"User details cache unavailable: {e}")
+        _count("errors")
+    else:
+        _count("invalidations")
+
+
+def invalidate_on_commit(*user_ids, using=None):
+    """
+    drop the cached details of users once the transaction commits, call this
+    whenever a user or profile changes. Dropped earlier, a concurrent read
+    could cache the old row again until the timeout.
+    """
+    if user_ids:
+        transaction.on_commit(lambda: invalidate_user_details(*user_ids), using=using)
@@ -0,0 +1,101 @@
+"""
+Compiled email templates, for the emails sent by the app and by allauth.
+
+`render_to_string` goes through the template loaders and builds a new
+context, with the context processors when given a request, for every
+email. Here every template is compiled once and kept for the life of the
+process: the ones of `EMAIL_TEMPLATES` at startup (see
+`AccountsConfig.ready`), the others the first time they are used, missing
+ones included. A template with nothing to render, like most subjects, is
+rendered once and its text returned as is. `render_many` renders a list
+of contexts through one `Context`, for the broadcasts.
+
+The emails are rendered without the context processors, they only get the
+context they are given. The cache is cleared when a template file changes
+under `runserver`.
+"""
+from django.template import Context, Engine, TemplateDoesNotExist
+from django.template.base import TextNode
+
+_templates = {}
+
+
+class CompiledTemplate:
+    """a compiled template, `static` is its text when it has no tag or variable"""
+
+    def __init__(self, template):
+        self.template = template
+        self.autoescape = template.engine.autoescape
+        nodes = template.nodelist
+        self.static = "".join(node.s for node in nodes) if all(isinstance(node, TextNode) for node in nodes) else None
+
+    def render_many(self, contexts):
+        if self.static is not None:
+            return [self.static for _ in contexts]
+        context = Context(autoescape=self.autoescape)
+        rendered = []
+        for values in contexts:
+            with context.push(values):
+                rendered.append(self.template.render(context))
+        return rendered
+
+
+def get(name):
+    """the compiled template `name`, None when it does not exist"""
+    try:
+        return _templates[name]
+    except KeyError:
+        pass
+    try:
+        template = CompiledTemplate(Engine.get_default().get_template(name))
+    except TemplateDoesNotExist:
+        template = None
+    _templates[name] = template
+    return template
+
+
+def clear():
+    _templates.clear()
+
+
+def render_many(name, contexts):
+    """`name` rendered with each of `contexts`"""
+    template = get(name)
+    if template is None:
+        raise TemplateDoesNotExist(name)
+    return template.render_many(contexts)
+
+
+def render(name, context):
+    return render_many(name, [context])[0]
+
+
+def mail_names(prefix, html_ext="html"):
+    """the subject, text and html templates of an email, allauth's naming"""
+    return f"{prefix}_subject.txt", f"{prefix}_message.txt", f"{prefix}_message.{html_ext}"
+
+
+def render_mail(prefix, contexts, html_ext="html"):
+    """
+    (subject, text, html) of the email `prefix` for each of `contexts`, like
+    allauth renders them. The text or the html is None without its template.
+    """
+    subject_name, text_name, html_name = mail_names(prefix, html_ext)
+    subjects = [" ".join(subject.splitlines()).strip() for subject in render_many(subject_name, contexts)]
+    bodies = []
+    for name in [text_name, html_name]:
+        template = get(name)
+        if template is None:
+            bodies.append([None] * len(contexts))
+        else:
+            bodies.append([body.strip() for body in template.render_many(contexts)])
+    if get(text_name) is None and get(html_name) is None:
+        raise TemplateDoesNotExist(text_name)
+    return list(zip(subjects, *bodies))
+
+
+def preload(prefixes, html_ext="html"):
+    """compiles the templates of the emails `prefixes`"""
+    for prefix in prefixes:
+        for name in mail_names(prefix, html_ext):
+            get(name)
@@ -0,0 +1,81 @@
+"""
+Password hashing on a bounded process pool.
+
+Hashing is CPU bound, with `PASSWORD_HASHING_WORKERS` set the hashes are
+computed in that many worker processes, so a burst of logins doesn't hold
+the GIL of the web workers and async views don't block their event loop.
+With 0 workers everything runs in the calling thread, as Django does.
+"""
+import asyncio
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import hashers
+
+from . import timing
+from .pools import process_pool
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """the hashing pool, or None when `PASSWORD_HASHING_WORKERS` is 0"""
+    global _executor
+    if not settings.PASSWORD_HASHING_WORKERS:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = process_pool(settings.PASSWORD_HASHING_WORKERS, ["PASSWORD_HASHERS"])
+    return _executor
+
+
+def shutdown_executor():
+    """stop the pool, a new one is started on next use"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+def _run(func, *args):
+    executor = get_executor()
+    if executor is None:
+        return func(*args)
+    return executor.submit(func, *args).result()
+
+
+async def _arun(func, *args):
+    executor = get_executor()
+    if executor is None:
+        return await sync_to_async(func, thread_sensitive=False)(*args)
+    return await asyncio.wrap_future(executor.submit(func, *args))
+
+
+def make_password(password):
+    """see `django.contrib.auth.hashers.make_password`"""
+    with timing.timed("hash"):
+        return _run(hashers.make_password, password)
+
+
+async def amake_password(password):
+    with timing.timed("hash"):
+        return await _arun(hashers.make_password, password)
+
+
+def check_password(password, encoded, setter=None):
+    """see `django.contrib.auth.hashers.check_password`"""
+    with timing.timed("hash"):
+        is_correct, must_update = _run(hashers.verify_password, password, encoded)
+    if setter and is_correct and must_update:
+        setter(password)
+    return is_correct
+
+
+async def acheck_password(password, encoded, setter=None):
+    with timing.timed("hash"):
+        is_correct, must_update = await _arun(hashers.verify_password, password, encoded)
+    if setter and is_correct and must_update:
+        await setter(password)
+    return is_correct
@@ -0,0 +1,253 @@
+"""
+Profile image processing pipeline
+
+Pillow is imported where the images are opened rather than at the top,
+it is slow to import and most workers never handle an upload.
+
+The pools only live in the memory of the worker, the tasks a restart
+leaves behind are picked up by `recover_image_tasks`.
+"""
+import os
+import re
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import ProfileImageTask
+from .pools import process_pool
+
+logger = logging.getLogger(__name__)
+
+FORMAT_EXTENSIONS = {
+    "JPEG": "jpg",
+    "WEBP": "webp",
+}
+
+# the only files served from `PROFILE_IMAGE_DIRECTORY`, see `variant_names`
+STORED_NAME = re.compile(r"[0-9a-f]+-\d+\.(%s)" % "|".join(FORMAT_EXTENSIONS.values()))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def variant_names(digest, sizes=None, image_format=None):
+    """
+    The file names of every size of an image, e.g. `<digest>-48.jpg`.
+    Names are derived from the content, so identical uploads share files
+    and a file never changes once written.
+    """
+    sizes = sizes or settings.PROFILE_IMAGE_SIZES
+    extension = FORMAT_EXTENSIONS[image_format or settings.PROFILE_IMAGE_FORMAT]
+    return {size: f"{digest}-{size}.{extension}" for size in sizes}
+
+
+def existing_variants(digest):
+    """the variant names of `digest` if every one of them is already stored"""
+    names = variant_names(digest)
+    for name in names.values():
+        if not os.path.exists(os.path.join(settings.PROFILE_IMAGE_DIRECTORY, name)):
+            return None
+    return names
+
+
+def process_image(source, destination, sizes, image_format="JPEG", quality=85, progress=None, draft=True):
+    """
+    Decode `source`, apply the EXIF orientation and write one re-encoded copy
+    per size in `sizes` (the longest side in pixels) next to `destination`.
+    Images are only ever downscaled.
+    Returns a dict of {size: file path}.
+
+    With `draft`, JPEGs are decoded straight at the smallest 1/2, 1/4 or 1/8
+    scale that is still larger than the biggest size, so a 20 MB photo is
+    never fully expanded in memory. The sizes are then made by shrinking the
+    same bitmap step by step instead of copying it.
+
+    This runs inside the worker pool, so it only deals with paths and
+    plain values, never with models.
+    """
+    from PIL import Image, ImageOps
+
+    def report(percent):
+        if progress:
+            progress(percent)
+
+    extension = FORMAT_EXTENSIONS[image_format]
+    stem = os.path.splitext(destination)[0]
+    sizes = sorted(sizes, reverse=True)
+    outputs = {}
+    with Image.open(source) as img:
+        if draft and img.format == "JPEG":
+            img.draft("RGB", (sizes[0], sizes[0]))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        report(20)
+
+        for i, size in enumerate(sizes, start=1):
+            img.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            path = f"{stem}-{size}.{extension}"
+            # write then rename, so a half written file is never served, the
+            # temporary name is unique as the same image can be processed twice at once
+            temporary = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+            img.save(temporary, image_format, quality=quality, optimize=True)
+            os.replace(temporary, path)
+            outputs[size] = path
+            report(20 + 80 * i // len(sizes))
+    return outputs
+
+
+def validate_upload(upload):
+    """
+    Check an uploaded file against `PROFILE_IMAGE_MAX_BYTES` and
+    `PROFILE_IMAGE_MAX_PIXELS`. Only the image header is read, the
+    bitmap is not decoded. Raises `ValueError` with the reason.
+    """
+    if upload.size > settings.PROFILE_IMAGE_MAX_BYTES:
+        raise ValueError(f"Image is larger than {settings.PROFILE_IMAGE_MAX_BYTES} bytes")
+    from PIL import Image
+
+    try:
+        # lazy: this parses the header only
+        with Image.open(upload) as img:
+            image_format = img.format
+            width, height = img.size
+    except (OSError, Image.DecompressionBombError):
+        raise ValueError("Upload a valid image. The file you uploaded was either not an image or a corrupted image.")
+    finally:
+        upload.seek(0)
+    if image_format not in settings.PROFILE_IMAGE_UPLOAD_FORMATS:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    if width * height > settings.PROFILE_IMAGE_MAX_PIXELS:
+        raise ValueError(f"Image is larger than {settings.PROFILE_IMAGE_MAX_PIXELS} pixels")
+
+
+def get_executor():
+    """returns the pool configured by `PROFILE_IMAGE_EXECUTOR`, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = settings.PROFILE_IMAGE_WORKERS
+            if settings.PROFILE_IMAGE_EXECUTOR == "process":
+                _executor = process_pool(workers)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="profile-image")
+    return _executor
+
+
+def shutdown_executor():
+    """wait for the queued images to be processed and stop the pool"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+def _task_kwargs(task):
+    return {
+        "source": task.source,
+        "destination": os.path.join(settings.PROFILE_IMAGE_DIRECTORY, task.content_hash),
+        "sizes": settings.PROFILE_IMAGE_SIZES,
+        "image_format": settings.PROFILE_IMAGE_FORMAT,
+        "quality": settings.PROFILE_IMAGE_QUALITY,
+    }
+
+
+def _update_progress(task_id, percent):
+    # `updated_at` tells `recover_image_tasks` the task is still moving
+    ProfileImageTask.objects.filter(pk=task_id).update(progress=percent, updated_at=timezone.now())
+
+
+def complete(task, variants):
+    """
+    mark a task as done with its {size: file name} variants, and make
+    the largest one the image of the user who uploaded it. There is no
+    request here, so `User.image` is the site relative path, the user
+    details serializer makes it absolute.
+    """
+    task.status = ProfileImageTask.DONE
+    task.progress = 100
+    task.image = variants[max(variants)]
+    task.variants = {str(size): name for size, name in variants.items()}
+    task.save(update_fields=["status", "progress", "image", "variants", "updated_at"])
+    if task.user is not None:
+        task.user.image = image_path(task.image)
+        task.user.image_variants = task.variants
+        task.user.save(update_fields=["image", "image_variants", "updated_at"])
+
+
+def _finish(task, outputs=None, error=None):
+    """store the result of a processed image on its task"""
+    if error is not None:
+        logger.error(f"Failed to process profile image {task.pk}: {error}")
+        task.status = ProfileImageTask.FAILED
+        task.error = str(error)
+        task.save(update_fields=["status", "error", "updated_at"])
+    else:
+        complete(task, {size: os.path.basename(path) for size, path in outputs.items()})
+    if os.path.exists(task.source):
+        os.remove(task.source)
+
+
+def run_task(task):
+    """process a task in the current thread, reporting progress as it goes"""
+    task.status = ProfileImageTask.PROCESSING
+    task.save(update_fields=["status", "updated_at"])
+    try:
+        outputs = process_image(
+            progress=lambda percent: _update_progress(task.pk, percent), **_task_kwargs(task)
+        )
+    except Exception as e:
+        _finish(task, error=e)
+    else:
+        _finish(task, outputs)
+
+
+def _run_in_thread(task):
+    try:
+        run_task(task)
+    finally:
+        close_old_connections()
+
+
+def _on_process_done(task, future):
+    try:
+        outputs = future.result()
+    except Exception as e:
+        _finish(task, error=e)
+    else:
+        _finish(task, outputs)
+    finally:
+        close_old_connections()
+
+
+def schedule(task):
+    """
+    Run a `ProfileImageTask` according to `PROFILE_IMAGE_EXECUTOR`:
+        - "inline": right away in the request
+        - "thread": in a thread pool, with progress updates
+        - "process": in a process pool, progress only at start and finish
+    """
+    mode = settings.PROFILE_IMAGE_EXECUTOR
+    if mode == "inline":
+        run_task(task)
+    elif mode == "process":
+        task.status = ProfileImageTask.PROCESSING
+        task.save(update_fields=["status", "updated_at"])
+        future = get_executor().submit(process_image, **_task_kwargs(task))
+        future.add_done_callback(lambda f: _on_process_done(task, f))
+    else:
+        get_executor().submit(_run_in_thread, task)
+
+
+def image_path(name):
+    """site relative url of a stored profile image file"""
+    return '/' + settings.PROFILE_IMAGE_URL + name
+
+
+def image_url(request, name):
+    """absolute url of a stored profile image file"""
+    return request.build_absolute_uri(image_path(name))
@@ -0,0 +1,148 @@
+"""Outbound email delivery and the database backed mail queue"""
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import timing
+from .models import QueuedEmail
+
+logger = logging.getLogger(__name__)
+
+
+class BaseMailQueue:
+    """
+    Interface for the outbound mail queue. Set `EMAIL_QUEUE_BACKEND`
+    to the dotted path of a subclass to plug in a different store.
+    """
+
+    def enqueue(self, message):
+        """store an `EmailMessage` for later delivery"""
+        raise NotImplementedError
+
+    def dispatch(self, batch_size=None):
+        """
+        deliver up to `batch_size` due messages and
+        return a tuple of (sent, failed) counts
+        """
+        raise NotImplementedError
+
+
+class DatabaseMailQueue(BaseMailQueue):
+    """Mail queue stored in the `QueuedEmail` table"""
+
+    def enqueue(self, message):
+        html_body = None
+        for content, mimetype in getattr(message, "alternatives", []):
+            if mimetype == "text/html":
+                html_body = content
+        return QueuedEmail.objects.create(
+            subject=message.subject,
+            body=message.body,
+            html_body=html_body,
+            content_subtype=message.content_subtype,
+            from_email=message.from_email or settings.DEFAULT_FROM_EMAIL,
+            # kept apart, so the bcc recipients are not shown to the others
+            to=list(message.to),
+            cc=list(message.cc),
+            bcc=list(message.bcc),
+            reply_to=list(message.reply_to),
+            headers=dict(message.extra_headers),
+        )
+
+    def claim(self, batch_size):
+        """
+        Lock the next due rows by moving their `scheduled_at` forward.
+        A worker that dies mid batch leaves its rows pending, so they
+        are picked up again once the lease runs out.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            queryset = QueuedEmail.objects.filter(
+                status=QueuedEmail.PENDING, scheduled_at__lte=now
+                ).order_by("scheduled_at")
+            if connection.features.has_select_for_update_skip_locked:
+                queryset = queryset.select_for_update(skip_locked=True)
+            batch = list(queryset[:batch_size])
+            QueuedEmail.objects.filter(pk__in=[email.pk for email in batch]).update(
+                scheduled_at=now + timedelta(seconds=settings.EMAIL_QUEUE_LEASE)
+            )
+        return batch
+
+    def dispatch(self, batch_size=None):
+        batch = self.claim(batch_size or settings.EMAIL_QUEUE_BATCH_SIZE)
+        if not batch:
+            return 0, 0
+
+        # one SMTP session for the whole batch
+        mail_connection = get_connection(fail_silently=False)
+        try:
+            mail_connection.open()
+        except Exception as e:
+            # the server can't be reached, try the whole batch again later
+            for email in batch:
+                self.retry_later(email, e)
+            return 0, len(batch)
+
+        sent = failed = 0
+        try:
+            for email in batch:
+                message = EmailMultiAlternatives(
+                    email.subject, email.body, email.from_email, email.to, bcc=email.bcc,
+                    connection=mail_connection, headers=email.headers, cc=email.cc, reply_to=email.reply_to,
+                )
+                message.content_subtype = email.content_subtype
+                if email.html_body:
+                    message.attach_alternative(email.html_body, "text/html")
+                try:
+                    message.send()
+                except Exception as e:
+                    self.retry_later(email, e)
+                    failed += 1
+                else:
+                    email.status = QueuedEmail.SENT
+                    email.sent_at = timezone.now()
+                    email.attempts += 1
+                    email.save(update_fields=["status", "sent_at", "attempts"])
+                    sent += 1
+        finally:
+            try:
+                mail_connection.close()
+            except Exception as e:
+                # everything was sent or rescheduled already
+                logger.warning(f"Closing the SMTP connection failed: {e}")
+        return sent, failed
+
+    def retry_later(self, email, error):
+        """reschedule a failed message with exponential backoff"""
+        email.attempts += 1
+        email.last_error = str(error)
+        if email.attempts >= settings.EMAIL_QUEUE_MAX_ATTEMPTS:
+            email.status = QueuedEmail.FAILED
+            logger.error(f"Giving up on queued email {email.pk} after {email.attempts} attempts: {error}")
+        else:
+            delay = settings.EMAIL_QUEUE_RETRY_BACKOFF * 2 ** (email.attempts - 1)
+            email.scheduled_at = timezone.now() + timedelta(seconds=delay)
+            logger.warning(f"Queued email {email.pk} failed, retrying in {delay}s: {error}")
+        email.save(update_fields=["attempts", "last_error", "status", "scheduled_at"])
+
+
+def get_mail_queue():
+    """returns an instance of the configured `EMAIL_QUEUE_BACKEND`"""
+    return import_string(settings.EMAIL_QUEUE_BACKEND)()
+
+
+def send_message(message, fail_silently=False):
+    """
+    Deliver an `EmailMessage` according to `EMAIL_SEND_MODE`:
+        - "sync": send it right away over SMTP
+        - "queue": only enqueue it, the `send_queued_mail` worker sends it
+    """
+    with timing.timed("mail"):
+        if settings.EMAIL_SEND_MODE == "queue":
+            get_mail_queue().enqueue(message)
+            return 1
+        return message.send(fail_silently=fail_silently)
@@ -0,0 +1,20 @@
+"""Runs one of the benchmarks in `apps.accounts.benchmarks`"""
+from importlib import import_module
+from django.core.management.base import BaseCommand
+
+from apps.accounts.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = "Run an accounts benchmark, see `benchmark <name> --help` for its options"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest="benchmark", required=True)
+        for name in BENCHMARKS:
+            module = import_module(f"apps.accounts.benchmarks.{name}")
+            subparser = subparsers.add_parser(name, help=module.__doc__.strip().splitlines()[0])
+            module.add_arguments(subparser)
+
+    def handle(self, *args, **options):
+        module = import_module(f"apps.accounts.benchmarks.{options['benchmark']}")
+        module.run(self.stdout, **options)
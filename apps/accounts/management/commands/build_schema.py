@@ -0,0 +1,15 @@
+"""Generate the OpenAPI schema served at `api/schema`"""
+import time
+from django.core.management.base import BaseCommand
+
+from apps.accounts import schema
+
+
+class Command(BaseCommand):
+    help = "Write the OpenAPI schema to OPENAPI_SCHEMA_DIRECTORY, run it on every deploy"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        path = schema.build()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f"Schema written to {path} in {elapsed:.2f}s"))
@@ -0,0 +1,54 @@
+"""Export the users and their profile to a CSV or JSON lines file"""
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounts import export
+from apps.accounts.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream the users and their profile to a CSV or JSON lines file, optionally gzipped, "
+        f"in constant memory. Columns: {', '.join(export.FIELDS)}"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="file to write, - for stdout")
+        parser.add_argument(
+            "--format", choices=list(export.FORMATS),
+            help="file format, guessed from the extension by default",
+        )
+        parser.add_argument("--gzip", action="store_true", help="compress the output, implied by a .gz extension")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="rows fetched from the database at once")
+        parser.add_argument("--active", action="store_true", help="only the active users")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        compress = options["gzip"] or path.endswith(".gz")
+        file_format = options["format"]
+        if file_format is None:
+            stem = path.removesuffix(".gz")
+            if stem.endswith(".csv"):
+                file_format = "csv"
+            elif stem.endswith((".jsonl", ".ndjson")):
+                file_format = "jsonl"
+            else:
+                raise CommandError("Can't guess the file format, use --format")
+
+        users = User.objects.all()
+        if options["active"]:
+            users = users.filter(is_active=True)
+        output = sys.stdout.buffer if path == "-" else open(path, "wb")
+        written = 0
+        start = time.perf_counter()
+        try:
+            for chunk in export.stream(users, file_format, compress, options["chunk_size"]):
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        elapsed = time.perf_counter() - start
+        # keep stdout for the data
+        self.stderr.write(f"Exported {written / 1024:.0f} KiB in {elapsed:.1f}s", style_func=self.style.SUCCESS)
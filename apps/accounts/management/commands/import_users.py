@@ -0,0 +1,87 @@
+"""Bulk import users from a CSV or JSON lines file"""
+import csv
+import sys
+import json
+import time
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounts.models import User
+
+FIELDS = ["email", "password", "first_name", "last_name", "city", "state", "country", "date_of_birth"]
+
+
+def read_rows(stream, file_format):
+    """yield one dict per user, without reading the whole file"""
+    if file_format == "csv":
+        for row in csv.DictReader(stream):
+            yield {field: row[field] for field in FIELDS if field in row}
+    else:
+        for line in stream:
+            if line.strip():
+                row = json.loads(line)
+                yield {field: row[field] for field in FIELDS if field in row}
+
+
+class Command(BaseCommand):
+    help = (
+        "Create users from a CSV file (with a header row) or a JSON lines file. "
+        f"Recognised columns: {', '.join(FIELDS)}"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="file to import, - for stdin")
+        parser.add_argument(
+            "--format", choices=["csv", "jsonl"],
+            help="file format, guessed from the extension by default",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000, help="users inserted per transaction")
+        parser.add_argument(
+            "--workers", type=int, default=None,
+            help="processes hashing passwords (default: one per cpu, 0 to hash in this process)",
+        )
+        parser.add_argument(
+            "--verified", action="store_true",
+            help="mark the imported email addresses as verified",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"]
+        if file_format is None:
+            if path.endswith(".csv"):
+                file_format = "csv"
+            elif path.endswith((".jsonl", ".ndjson")):
+                file_format = "jsonl"
+            else:
+                raise CommandError("Can't guess the file format, use --format")
+
+        stream = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        executor = ProcessPoolExecutor(options["workers"]) if options["workers"] != 0 else None
+        created = skipped = 0
+        start = time.perf_counter()
+        try:
+            rows = read_rows(stream, file_format)
+            while True:
+                chunk = list(islice(rows, options["batch_size"]))
+                if not chunk:
+                    break
+                count, skip = User.objects.bulk_create_users(
+                    chunk, batch_size=options["batch_size"], executor=executor, verified=options["verified"]
+                )
+                created += count
+                skipped += skip
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f"created: {created}, skipped: {skipped}, {created / elapsed:.0f} users/s")
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            if stream is not sys.stdin:
+                stream.close()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {created} users in {elapsed:.1f}s ({created / max(elapsed, 1e-9):.0f} users/s), "
+            f"skipped {skipped}"
+        ))
@@ -0,0 +1,104 @@
+"""Measure how long a worker takes to boot, and which imports it spends it on"""
+import os
+import sys
+import json
+import subprocess
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# what a worker does before it can answer its first request
+BOOT = """
+import sys, json, time
+start = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(json.dumps({"seconds": time.perf_counter() - start, "modules": sorted(sys.modules)}))
+"""
+
+
+def boot(profile):
+    """
+    boots a worker in a fresh interpreter with `RUNTIME_PROFILE=profile`,
+    returns its boot seconds, the modules it loaded and {module: self import microseconds}.
+
+    `-X importtime` only sees import statements, so the modules loaded with
+    `import_module` (the apps, urls and admin modules) are missing from
+    the timings, the modules they import are not.
+    """
+    env = dict(os.environ, RUNTIME_PROFILE=profile)
+    env.setdefault("DJANGO_SETTINGS_MODULE", "users.settings")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", BOOT],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode:
+        raise CommandError(f"{profile} worker failed to boot:\n{result.stderr[-2000:]}")
+    imports = {}
+    for line in result.stderr.splitlines():
+        # import time:       self [us] |  cumulative | imported package
+        if not line.startswith("import time:"):
+            continue
+        own, _, name = line[len("import time:"):].split("|")
+        if own.strip().isdigit():
+            imports[name.strip()] = int(own)
+    booted = json.loads(result.stdout.splitlines()[-1])
+    return booted["seconds"], booted["modules"], imports
+
+
+def app_of(module, apps):
+    """the installed app a module belongs to, or its top level package"""
+    owners = [app for app in apps if module == app or module.startswith(app + ".")]
+    return max(owners, key=len) if owners else module.split(".")[0]
+
+
+def by_app(imports, apps):
+    totals = {}
+    for module, micros in imports.items():
+        app = app_of(module, apps)
+        totals[app] = totals.get(app, 0) + micros
+    return totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Boot workers in fresh interpreters and report the boot time and the import "
+        "time per app and module, for a RUNTIME_PROFILE or comparing both"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profile", choices=["full", "api"], default=settings.RUNTIME_PROFILE)
+        parser.add_argument("--compare", action="store_true", help="profile both the full and api runtime profiles")
+        parser.add_argument("--runs", type=int, default=5, help="boots per profile, the median one is reported")
+        parser.add_argument("--top", type=int, default=15, help="apps and modules listed")
+
+    def handle(self, *args, **options):
+        profiles = ["full", "api"] if options["compare"] else [options["profile"]]
+        # every app either profile may load, so their modules are not lumped with their package
+        apps = [*settings.INSTALLED_APPS, "django.contrib.admin", "allauth.headless", "drf_spectacular"]
+        booted = {}
+        for profile in profiles:
+            runs = sorted((boot(profile) for _ in range(options["runs"])), key=lambda run: run[0])
+            seconds, modules, imports = runs[len(runs) // 2]
+            booted[profile] = seconds
+            self.report(profile, seconds, modules, imports, apps, options["top"])
+
+        if options["compare"]:
+            full, api = booted["full"], booted["api"]
+            self.stdout.write(self.style.SUCCESS(
+                f"api boots in {api * 1000:.0f}ms against {full * 1000:.0f}ms for full, "
+                f"{(full - api) * 1000:.0f}ms ({(full - api) / full:.0%}) faster"
+            ))
+
+    def report(self, profile, seconds, modules, imports, apps, top):
+        self.stdout.write(self.style.SUCCESS(
+            f"{profile}: boot {seconds * 1000:.0f}ms (median), {len(modules)} modules loaded, "
+            f"{sum(imports.values()) / 1000:.0f}ms of timed imports"
+        ))
+        self.stdout.write("  import ms by app")
+        for app, micros in sorted(by_app(imports, apps).items(), key=lambda item: -item[1])[:top]:
+            self.stdout.write(f"  {micros / 1000:8.1f}  {app}")
+        self.stdout.write("  slowest modules, own import ms")
+        for module, micros in sorted(imports.items(), key=lambda item: -item[1])[:top]:
+            self.stdout.write(f"  {micros / 1000:8.1f}  {module}")
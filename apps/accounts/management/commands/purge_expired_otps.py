@@ -0,0 +1,73 @@
+"""Delete the verification codes that can no longer be used"""
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from apps.accounts.models import OTPModel
+
+
+def table_size():
+    """bytes on disk of the `OTPModel` table and its indexes, None if the database can't tell"""
+    table = OTPModel._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT pg_total_relation_size(%s)", [table])
+            return cursor.fetchone()[0]
+        if connection.vendor == "sqlite":
+            try:
+                cursor.execute(
+                    "SELECT SUM(pgsize) FROM dbstat WHERE name = %s OR name IN "
+                    "(SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s)",
+                    [table, table],
+                )
+            except Exception:
+                # sqlite built without the dbstat table
+                return None
+            return cursor.fetchone()[0]
+    return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired and used email verification codes in small batches, "
+        "so it can run alongside live traffic"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="rows deleted per statement")
+        parser.add_argument(
+            "--sleep", type=float, default=0,
+            help="seconds to pause between batches, to leave room for other writes",
+        )
+
+    def purge(self, queryset, batch_size, sleep):
+        """deletes the rows of `queryset` a batch at a time, returns how many"""
+        purged = 0
+        while True:
+            # each delete is its own short transaction on a bounded set of rows
+            pks = list(queryset.values_list("pk", flat=True)[:batch_size])
+            if not pks:
+                return purged
+            deleted, _ = OTPModel.objects.filter(pk__in=pks).delete()
+            purged += deleted
+            self.stdout.write(f"purged: {purged}")
+            if sleep:
+                time.sleep(sleep)
+
+    def handle(self, *args, **options):
+        size = table_size()
+        start = time.perf_counter()
+        # one pass per index, `otpmodel_expires_idx` then `otpmodel_used_idx`, an OR
+        # of both conditions would scan the table for every batch
+        expired = self.purge(
+            OTPModel.objects.filter(expires_at__lt=timezone.now()), options["batch_size"], options["sleep"],
+        )
+        used = self.purge(OTPModel.objects.filter(is_used=True), options["batch_size"], options["sleep"])
+
+        elapsed = time.perf_counter() - start
+        size_text = "unknown" if size is None else f"{size / 1024:.0f} KiB"
+        self.stdout.write(self.style.SUCCESS(
+            f"Purged {expired + used} rows ({expired} expired, {used} used) in {elapsed:.1f}s, "
+            f"table size before purging: {size_text}"
+        ))
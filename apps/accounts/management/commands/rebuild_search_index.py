@@ -0,0 +1,25 @@
+"""Recompute the user search column and recreate its index, see `search.py`"""
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.accounts import search
+from apps.accounts.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute User.search_text and recreate the search index. Run it after loading users "
+        "outside of the ORM, or after a migration rebuilt the user table on SQLite"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="users updated per statement")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        changed = search.fill(User.objects.all(), options["batch_size"])
+        # creates what is missing, on SQLite it also refills the FTS table from the column
+        search.create_index(connection)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f"Updated {changed} users and rebuilt the index in {elapsed:.1f}s"))
@@ -0,0 +1,65 @@
+"""Pick up the profile images a restarted worker left behind, see `images.py`"""
+import os
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.accounts import images
+from apps.accounts.models import ProfileImageTask
+
+
+class Command(BaseCommand):
+    help = (
+        "The processing pool only lives in the worker memory, so a restart leaves its tasks pending. "
+        "Reschedule the stale tasks whose upload is still there, fail the others and delete the "
+        "uploads no task is waiting for. Run it after a deploy, or from cron"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--stale-after", type=int, default=settings.PROFILE_IMAGE_TASK_TIMEOUT,
+            help="seconds without progress after which a task or an upload is left behind",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options["stale_after"])
+        stale = ProfileImageTask.objects.filter(
+            status__in=[ProfileImageTask.PENDING, ProfileImageTask.PROCESSING], updated_at__lt=cutoff,
+        ).select_related("user")
+        rescheduled = failed = 0
+        for task in stale.iterator():
+            if os.path.exists(task.source):
+                task.status = ProfileImageTask.PENDING
+                task.progress = 0
+                task.save(update_fields=["status", "progress", "updated_at"])
+                images.schedule(task)
+                rescheduled += 1
+            else:
+                task.status = ProfileImageTask.FAILED
+                task.error = "The upload was lost before it was processed, upload the image again"
+                task.save(update_fields=["status", "error", "updated_at"])
+                failed += 1
+        # the pool of this process is gone when the command returns
+        images.shutdown_executor()
+
+        waiting = {
+            os.path.abspath(source) for source in ProfileImageTask.objects.filter(
+                status__in=[ProfileImageTask.PENDING, ProfileImageTask.PROCESSING],
+            ).values_list("source", flat=True)
+        }
+        removed = 0
+        directory = settings.PROFILE_IMAGE_UPLOAD_DIRECTORY
+        names = os.listdir(directory) if os.path.isdir(directory) else []
+        for name in names:
+            path = os.path.abspath(os.path.join(directory, name))
+            # a recent file may belong to an upload whose task is not committed yet
+            if path in waiting or os.path.getmtime(path) > time.time() - options["stale_after"]:
+                continue
+            os.remove(path)
+            removed += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rescheduled {rescheduled} tasks, failed {failed}, removed {removed} orphaned uploads"
+        ))
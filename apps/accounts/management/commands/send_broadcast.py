@@ -0,0 +1,97 @@
+"""Send an email to every user matching a filter, see `broadcast.py`"""
+import json
+import time
+from django.core.exceptions import FieldError, ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.template import TemplateDoesNotExist
+
+from apps.accounts import broadcast
+from apps.accounts.models import Broadcast, User
+
+
+def key_values(pairs, option):
+    """{key: value} of `key=value` arguments, the values are read as JSON when they can be"""
+    values = {}
+    for pair in pairs:
+        key, sep, value = pair.partition("=")
+        if not sep:
+            raise CommandError(f"{option} takes key=value, got {pair!r}")
+        try:
+            values[key] = json.loads(value)
+        except ValueError:
+            values[key] = value
+    return values
+
+
+class Command(BaseCommand):
+    help = (
+        "Email every user matching the filters, in batches over one SMTP connection each, "
+        "paced to BROADCAST_RATE_LIMIT. Run it again with --resume after a crash, "
+        "once BROADCAST_LEASE seconds have passed"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--subject")
+        parser.add_argument(
+            "--template", default="accounts/email/broadcast_message",
+            help="template name without extension, <template>.txt and the optional <template>.html are rendered",
+        )
+        parser.add_argument(
+            "--filter", action="append", default=[],
+            help="a User.objects.filter() argument, e.g. is_active=true or profile__country=Nigeria",
+        )
+        parser.add_argument(
+            "--context", action="append", default=[],
+            help="template context next to `user`, e.g. body=\"Our terms changed\"",
+        )
+        parser.add_argument("--from-email", default="")
+        parser.add_argument("--resume", type=int, metavar="ID", help="continue a broadcast that did not finish")
+        parser.add_argument("--batch-size", type=int, help="users per SMTP connection and checkpoint")
+        parser.add_argument("--rate", type=float, help="messages per second, 0 for no limit")
+        parser.add_argument("--dry-run", action="store_true", help="only count the recipients")
+
+    def handle(self, *args, **options):
+        if options["resume"]:
+            try:
+                item = Broadcast.objects.get(pk=options["resume"])
+            except Broadcast.DoesNotExist:
+                raise CommandError(f"No broadcast {options['resume']}")
+            if item.status == Broadcast.DONE:
+                raise CommandError(f"Broadcast {item.pk} is done")
+        else:
+            if not options["subject"]:
+                raise CommandError("--subject is required for a new broadcast")
+            item = Broadcast(
+                subject=options["subject"], template=options["template"], from_email=options["from_email"],
+                filters=key_values(options["filter"], "--filter"), context=key_values(options["context"], "--context"),
+            )
+
+        try:
+            count = broadcast.recipients(item).count()
+            broadcast.load_templates(item.template)
+        except (FieldError, ValidationError, ValueError) as e:
+            raise CommandError(f"Invalid filter: {e}")
+        except TemplateDoesNotExist as e:
+            raise CommandError(f"Template not found: {e}")
+        if options["dry_run"]:
+            self.stdout.write(f"{count} recipients")
+            return
+
+        if item.pk is None:
+            item.save()
+        self.stdout.write(f"Broadcast {item.pk}: {count} recipients left")
+        start = time.perf_counter()
+        try:
+            item = broadcast.send(item, options["batch_size"], options["rate"])
+        except broadcast.BroadcastBusy as e:
+            raise CommandError(f"{e}. After a crash it can be resumed BROADCAST_LEASE seconds after its last batch")
+        except Exception as e:
+            item.refresh_from_db()
+            raise CommandError(
+                f"Broadcast {item.pk} stopped after {item.sent} messages: {e}. "
+                f"Continue it with --resume {item.pk}"
+            )
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Broadcast {item.pk} done in {elapsed:.1f}s. sent: {item.sent}, failed: {item.failed}"
+        ))
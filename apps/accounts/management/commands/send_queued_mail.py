@@ -0,0 +1,42 @@
+"""Worker that delivers the emails queued when `EMAIL_SEND_MODE` is "queue" """
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.accounts.mail import get_mail_queue
+
+
+class Command(BaseCommand):
+    help = "Send the emails waiting in the outbound mail queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.EMAIL_QUEUE_BATCH_SIZE,
+            help="number of messages sent over a single SMTP connection",
+        )
+        parser.add_argument(
+            "--loop", action="store_true",
+            help="keep polling the queue instead of exiting once it is drained",
+        )
+        parser.add_argument(
+            "--interval", type=float, default=5,
+            help="seconds to sleep when the queue is empty (with --loop)",
+        )
+
+    def handle(self, *args, **options):
+        queue = get_mail_queue()
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = queue.dispatch(options["batch_size"])
+            total_sent += sent
+            total_failed += failed
+            if sent or failed:
+                self.stdout.write(f"sent: {sent}, failed: {failed}")
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. sent: {total_sent}, failed: {total_failed}"
+        ))
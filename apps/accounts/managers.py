@@ -1,8 +1,26 @@
 """Contains the custom user manager"""
+from itertools import islice
 from django.contrib.auth.base_user import BaseUserManager
+from django.contrib.auth.hashers import make_password
+from django.db import models, transaction
 
+from . import search
+from .cache import HIDDEN_FIELDS, invalidate_on_commit
 
-class UserManager(BaseUserManager):
+
+class UserQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """like the signals do for `save()`, drops the cached details of the updated users"""
+        if set(kwargs) <= HIDDEN_FIELDS:
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            ids = list(self.values_list("pk", flat=True))
+            count = super().update(**kwargs)
+            invalidate_on_commit(*ids, using=self.db)
+        return count
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     """custom User manager class"""
 
     def create_user(
@@ -37,3 +55,82 @@ class UserManager(BaseUserManager):
             raise ValueError("Superuser must have is_staff=True.")
 
         return self.create_user(email, password, first_name, last_name, **extra_fields)
+
+    def bulk_create_users(self, rows, batch_size=1000, executor=None, verified=False):
+        """
+        Create many users at once from an iterable of dicts with the
+        `create_user` fields (email, password, first_name, last_name, ...).
+        Profile fields (city, state, ...) can be given in the same dict.
+        Users, their profiles and allauth `EmailAddress` rows are inserted
+        with `bulk_create`, one transaction per `batch_size` rows, so the
+        `post_save` signals are not sent. Passwords are hashed on `executor`
+        (e.g. a `ProcessPoolExecutor`) when one is given.
+        Rows whose email already exists are skipped.
+        Returns a tuple of (created, skipped) counts.
+        """
+        created = skipped = 0
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, batch_size))
+            if not chunk:
+                break
+            count = self._bulk_create_chunk(chunk, executor, verified)
+            created += count
+            skipped += len(chunk) - count
+        return created, skipped
+
+    def _bulk_create_chunk(self, chunk, executor, verified):
+        from allauth.account.models import EmailAddress
+        from .models import Profile
+
+        profile_fields = [field.name for field in Profile._meta.concrete_fields if field.name not in ("id", "user")]
+        users = {}
+        profiles = {}
+        for row in chunk:
+            row = dict(row)
+            profile = {field: row.pop(field) or None for field in profile_fields if field in row}
+            email = self.normalize_email(row.pop("email", None))
+            first_name = row.pop("first_name", "")
+            last_name = row.pop("last_name", "")
+            if not email or (not first_name and not last_name) or email in users:
+                continue
+            row.setdefault("is_superuser", False)
+            password = row.pop("password", None) or None
+            users[email] = (password, self.model(
+                email=email, first_name=first_name, last_name=last_name, **row
+            ))
+            profiles[email] = profile
+
+        existing = self.filter(email__in=list(users)).values_list("email", flat=True)
+        for email in existing:
+            del users[email]
+        if not users:
+            return 0
+
+        passwords = [password for password, _ in users.values()]
+        if executor is not None:
+            hashes = executor.map(make_password, passwords, chunksize=max(1, len(passwords) // 64))
+        else:
+            hashes = map(make_password, passwords)
+        objs = []
+        for (_, user), password in zip(users.values(), hashes):
+            user.password = password
+            # bulk_create skips `User.save()`
+            user.search_text = search.document(user, Profile(**profiles[user.email]))
+            objs.append(user)
+
+        with transaction.atomic(using=self._db):
+            objs = self.bulk_create(objs)
+            if any(user.pk is None for user in objs):
+                # the backend can't return the new ids
+                ids = dict(self.filter(email__in=list(users)).values_list("email", "id"))
+                for user in objs:
+                    user.pk = ids[user.email]
+            Profile.objects.using(self._db).bulk_create([
+                Profile(user=user, **profiles[user.email]) for user in objs
+            ])
+            EmailAddress.objects.using(self._db).bulk_create([
+                EmailAddress(user=user, email=user.email.lower(), primary=True, verified=verified)
+                for user in objs
+            ])
+        return len(objs)
@@ -0,0 +1,88 @@
+"""
+Request metrics of this process, rendered in the Prometheus text format.
+
+Every request is counted and its duration observed, the steps (queries,
+password hashing, mail, outbound http, ...) only for the requests
+`PerformanceMiddleware` samples. Each worker process keeps its own
+numbers, so scrape every worker or aggregate them.
+"""
+import threading
+
+from .cache import cache_stats
+from .throttling import throttle_stats
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_requests = {} # (route, method, status) -> count
+_durations = {} # route -> [count per bucket..., sum, count]
+_steps = {} # step -> [seconds, count]
+_sampled = {"requests": 0}
+
+
+def observe_request(route, method, status, seconds):
+    with _lock:
+        key = (route, method, status)
+        _requests[key] = _requests.get(key, 0) + 1
+        histogram = _durations.setdefault(route, [0] * len(BUCKETS) + [0.0, 0])
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[i] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+
+def observe_steps(summary):
+    """add the `timing.summarize()` of a sampled request"""
+    with _lock:
+        _sampled["requests"] += 1
+        for name, (milliseconds, count) in summary.items():
+            step = _steps.setdefault(name, [0.0, 0])
+            step[0] += milliseconds / 1000
+            step[1] += count
+
+
+def reset():
+    with _lock:
+        _requests.clear()
+        _durations.clear()
+        _steps.clear()
+        _sampled["requests"] = 0
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+def render():
+    """all the metrics in the Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        lines.append("# TYPE accounts_requests_total counter")
+        for (route, method, status), count in sorted(_requests.items()):
+            lines.append(f"accounts_requests_total{_labels(route=route, method=method, status=status)} {count}")
+
+        lines.append("# TYPE accounts_request_duration_seconds histogram")
+        for route, histogram in sorted(_durations.items()):
+            for bound, count in zip(BUCKETS, histogram):
+                lines.append(f"accounts_request_duration_seconds_bucket{_labels(route=route, le=bound)} {count}")
+            lines.append(f"accounts_request_duration_seconds_bucket{_labels(route=route, le='+Inf')} {histogram[-1]}")
+            lines.append(f"accounts_request_duration_seconds_sum{_labels(route=route)} {histogram[-2]:.6f}")
+            lines.append(f"accounts_request_duration_seconds_count{_labels(route=route)} {histogram[-1]}")
+
+        lines.append("# TYPE accounts_sampled_requests_total counter")
+        lines.append(f"accounts_sampled_requests_total {_sampled['requests']}")
+        lines.append("# TYPE accounts_step_seconds_total counter")
+        lines.append("# TYPE accounts_step_total counter")
+        for name, (seconds, count) in sorted(_steps.items()):
+            lines.append(f"accounts_step_seconds_total{_labels(step=name)} {seconds:.6f}")
+            lines.append(f"accounts_step_total{_labels(step=name)} {count}")
+
+    lines.append("# TYPE accounts_user_details_cache_total counter")
+    for name, count in sorted(cache_stats().items()):
+        lines.append(f"accounts_user_details_cache_total{_labels(result=name)} {count}")
+    lines.append("# TYPE accounts_throttle_total counter")
+    for scope, counters in sorted(throttle_stats().items()):
+        for name, count in sorted(counters.items()):
+            lines.append(f"accounts_throttle_total{_labels(scope=scope, result=name)} {count}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,68 @@
+"""Request timing, see `timing.py` and `metrics.py`"""
+import time
+import random
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics, timing
+
+
+def query_wrapper(execute, sql, params, many, context):
+    """times the queries of sampled requests, installed on every connection (see `signals.py`)"""
+    if not timing.active():
+        return execute(sql, params, many, context)
+    with timing.timed("db"):
+        return execute(sql, params, many, context)
+
+
+class PerformanceMiddleware:
+    """
+    Counts every request and its duration in `metrics`. For a share of
+    them (`PERFORMANCE_SAMPLE_RATE`) it also collects the time spent in
+    each step, the queries, password hashing, mail, outbound http and
+    user details cache hits, and sends them back in a `Server-Timing`
+    header when `PERFORMANCE_SERVER_TIMING` is on.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        if not self.sample():
+            response = self.get_response(request)
+            return self.finish(request, response, start, None)
+        with timing.collect() as timings:
+            response = self.get_response(request)
+        return self.finish(request, response, start, timings)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        if not self.sample():
+            response = await self.get_response(request)
+            return self.finish(request, response, start, None)
+        with timing.collect() as timings:
+            response = await self.get_response(request)
+        return self.finish(request, response, start, timings)
+
+    def sample(self):
+        rate = settings.PERFORMANCE_SAMPLE_RATE
+        return rate >= 1 or random.random() < rate
+
+    def finish(self, request, response, start, timings):
+        seconds = time.perf_counter() - start
+        match = request.resolver_match
+        route = match.view_name if match else "unmatched"
+        metrics.observe_request(route, request.method, response.status_code, seconds)
+        if timings is not None:
+            timings.append(("total", seconds * 1000))
+            metrics.observe_steps(timing.summarize(timings))
+            if settings.PERFORMANCE_SERVER_TIMING:
+                response["Server-Timing"] = timing.server_timing(timings)
+        return response
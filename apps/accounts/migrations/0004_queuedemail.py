@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:21
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_otpmodel'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='image',
+            field=models.URLField(blank=True, default=None, null=True),
+        ),
+        migrations.CreateModel(
+            name='QueuedEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255)),
+                ('body', models.TextField(blank=True)),
+                ('html_body', models.TextField(blank=True, null=True)),
+                ('from_email', models.CharField(max_length=254)),
+                ('to', models.JSONField(default=list)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('scheduled_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['scheduled_at'],
+                'indexes': [models.Index(fields=['status', 'scheduled_at'], name='queuedemail_status_sched_idx')],
+            },
+        ),
+    ]
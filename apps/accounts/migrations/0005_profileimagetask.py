@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:22
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_queuedemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileImageTask',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('progress', models.PositiveSmallIntegerField(default=0)),
+                ('source', models.CharField(max_length=255)),
+                ('image', models.CharField(blank=True, max_length=255)),
+                ('variants', models.JSONField(blank=True, default=dict)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='image_tasks', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
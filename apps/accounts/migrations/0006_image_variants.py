@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_profileimagetask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profileimagetask',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
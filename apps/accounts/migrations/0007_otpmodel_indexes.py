@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='otpmodel',
+            index=models.Index(fields=['user', 'code'], name='otpmodel_user_code_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='otpmodel',
+            index=models.Index(fields=['expires_at'], name='otpmodel_expires_idx'),
+        ),
+    ]
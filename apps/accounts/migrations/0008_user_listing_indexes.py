@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_otpmodel_indexes'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['created_at', 'id'], name='user_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['is_active', 'created_at', 'id'], name='user_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['is_staff', 'created_at', 'id'], name='user_staff_created_idx'),
+        ),
+    ]
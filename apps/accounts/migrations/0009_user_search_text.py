@@ -0,0 +1,101 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:56
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+# a copy of search.py as it was when this migration was written, the
+# migration must keep doing the same whatever that module becomes
+USER_FIELDS = ("first_name", "last_name", "email")
+PROFILE_FIELDS = ("city", "state", "country")
+
+USER_TABLE = "accounts_user"
+FTS_TABLE = "accounts_user_search"
+TRIGRAM_INDEX = "user_search_trgm_idx"
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+def fill_search_text(apps, schema_editor):
+    User = apps.get_model("accounts", "User")
+    users = User.objects.using(schema_editor.connection.alias).select_related("profile").only(
+        "search_text", *USER_FIELDS, *(f"profile__{field}" for field in PROFILE_FIELDS)
+    ).order_by("pk")
+    last = 0
+    while True:
+        batch = list(users.filter(pk__gt=last)[:1000])
+        if not batch:
+            return
+        last = batch[-1].pk
+        for user in batch:
+            values = [getattr(user, field) for field in USER_FIELDS]
+            profile = getattr(user, "profile", None)
+            if profile is not None:
+                values += [getattr(profile, field) for field in PROFILE_FIELDS]
+            user.search_text = " ".join(filter(None, map(normalize, values)))
+        User.objects.using(schema_editor.connection.alias).bulk_update(batch, ["search_text"])
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"search_text, content='{USER_TABLE}', content_rowid='id')"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON {USER_TABLE} BEGIN "
+                f"INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON {USER_TABLE} BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF search_text ON {USER_TABLE} BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text); "
+                f"INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END"
+            )
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    elif connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX} ON {USER_TABLE} USING gin (search_text gin_trgm_ops)"
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            for trigger in ("insert", "delete", "update"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{trigger}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP INDEX IF EXISTS {TRIGRAM_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_user_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+        # a trigram index on PostgreSQL, an FTS5 table on SQLite
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_user_search_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255)),
+                ('template', models.CharField(max_length=255)),
+                ('context', models.JSONField(blank=True, default=dict)),
+                ('filters', models.JSONField(blank=True, default=dict)),
+                ('from_email', models.CharField(blank=True, max_length=254)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('done', 'Done')], default='pending', max_length=10)),
+                ('last_user_id', models.BigIntegerField(default=0)),
+                ('sent', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:25
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_broadcast'),
+    ]
+
+    # nothing changes in the table, and SQLite would rebuild it (and drop
+    # the search triggers of the user table) for this
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='user',
+                name='date_joined',
+                field=models.DateTimeField(default=django.utils.timezone.now),
+            ),
+        ]),
+    ]
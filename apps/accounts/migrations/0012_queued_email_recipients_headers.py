@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_lazy_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuedemail',
+            name='bcc',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='queuedemail',
+            name='cc',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='queuedemail',
+            name='content_subtype',
+            field=models.CharField(default='plain', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='queuedemail',
+            name='headers',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='queuedemail',
+            name='reply_to',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
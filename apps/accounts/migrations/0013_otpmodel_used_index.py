@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0012_queued_email_recipients_headers'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='otpmodel',
+            index=models.Index(condition=models.Q(('is_used', True)), fields=['id'], name='otpmodel_used_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0013_otpmodel_used_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='broadcast',
+            name='leased_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:16
+
+import apps.accounts.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0014_broadcast_lease'),
+    ]
+
+    # only the python side of the field changes, SQLite would rebuild the table for it
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='profile',
+                name='user',
+                field=apps.accounts.models.ProfileField(on_delete=django.db.models.deletion.CASCADE, related_name='profile', to=settings.AUTH_USER_MODEL),
+            ),
+        ]),
+    ]
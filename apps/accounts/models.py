@@ -1,12 +1,14 @@
 """The user model"""
-from django.db import models
+import uuid
+from django.db import IntegrityError, models, transaction
+from django.db.models.fields.related_descriptors import ReverseOneToOneDescriptor
 from django.utils import timezone
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
+from django.core.mail import EmailMultiAlternatives
 from django.contrib.auth.models import PermissionsMixin
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.conf import settings
 
+from . import email_templates, hashing, search, timing
 from .managers import UserManager
 
 
@@ -17,12 +19,14 @@ class User(AbstractBaseUser, PermissionsMixin):
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
     image = models.URLField(null=True, blank=True, default=settings.DEFAULT_AVATER_URL)
+    image_variants = models.JSONField(default=dict, blank=True) # {size: file name} of the uploaded image
+    search_text = models.TextField(default="", blank=True, editable=False) # see search.py
 
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     is_superuser = models.BooleanField(default=False)
 
-    date_joined = models.DateTimeField(auto_now=True)
+    date_joined = models.DateTimeField(default=timezone.now)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -36,6 +40,92 @@ class User(AbstractBaseUser, PermissionsMixin):
         verbose_name = "user"
         verbose_name_plural = "users"
         ordering = ["-created_at"]
+        indexes = [
+            # the keyset pages of the staff user listing, see pagination.py
+            models.Index(fields=["created_at", "id"], name="user_created_id_idx"),
+            models.Index(fields=["is_active", "created_at", "id"], name="user_active_created_idx"),
+            models.Index(fields=["is_staff", "created_at", "id"], name="user_staff_created_idx"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_search_values = instance._search_values()
+        return instance
+
+    def _search_values(self):
+        # deferred fields are left out, unless they are set they are as saved
+        return {field: self.__dict__[field] for field in search.USER_FIELDS if field in self.__dict__}
+
+    def save(self, *args, **kwargs):
+        """
+        keeps `search_text` up to date when a searched field changed since
+        the user was loaded, the profile is only read then. The profile is
+        not created with the user, see `ProfileField`.
+        """
+        update_fields = kwargs.get("update_fields")
+        searched = update_fields is None or not set(update_fields).isdisjoint(search.USER_FIELDS)
+        values = self._search_values()
+        if searched and values != getattr(self, "_saved_search_values", None):
+            profile = None if self._state.adding else self.existing_profile()
+            self.search_text = search.document(self, profile)
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "search_text"}
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if searched:
+            self._saved_search_values = values
+        if adding:
+            # a new user has no profile, reading it needs no query
+            self._meta.get_field("profile").set_cached_value(self, None)
+
+    def existing_profile(self):
+        """the profile, or None when it was not created yet"""
+        related = self._meta.get_field("profile")
+        if not related.is_cached(self):
+            related.set_cached_value(self, related.related_model.objects.filter(user=self).first())
+        return related.get_cached_value(self)
+
+    def get_or_create_profile(self):
+        """the profile, created if the user has none yet, for the writes"""
+        profile = self.existing_profile()
+        if profile is not None:
+            return profile
+        related = self._meta.get_field("profile")
+        # known to be missing, so no select first like get_or_create
+        manager = related.related_model._default_manager.db_manager(self._state.db)
+        try:
+            with transaction.atomic(using=manager.db):
+                profile = manager.create(user=self)
+        except IntegrityError:
+            # created meanwhile by another request
+            profile = manager.get(user=self)
+        related.set_cached_value(self, profile)
+        return profile
+
+    def set_password(self, raw_password):
+        """hashed on the `PASSWORD_HASHING_WORKERS` pool if there is one"""
+        self.password = hashing.make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """verified on the `PASSWORD_HASHING_WORKERS` pool if there is one"""
+        def setter(raw_password):
+            self.set_password(raw_password)
+            # Password hash upgrades shouldn't be considered password changes.
+            self._password = None
+            self.save(update_fields=["password"])
+
+        return hashing.check_password(raw_password, self.password, setter)
+
+    async def acheck_password(self, raw_password):
+        """See check_password()."""
+        async def setter(raw_password):
+            self.password = await hashing.amake_password(raw_password)
+            self._password = None
+            await self.asave(update_fields=["password"])
+
+        return await hashing.acheck_password(raw_password, self.password, setter)
 
     def get_full_name(self):
         """returns the user first name and last name"""
@@ -69,32 +159,62 @@ class User(AbstractBaseUser, PermissionsMixin):
         if not body and not text_template:
             raise ValueError("Must set either body or text_template parameter")
         
+        from .mail import send_message
+
         from_email = from_email if from_email else settings.DEFAULT_FROM_EMAIL
-        if text_template:
-            body = render_to_string(text_template, text_context)
+        with timing.timed("mail_render"):
+            if text_template:
+                body = email_templates.render(text_template, text_context)
+            if html_template:
+                html_template = email_templates.render(html_template, html_context)
+
+        message = EmailMultiAlternatives(subject, body, from_email, [self.email])
         if html_template:
-            html_template = render_to_string(html_template, html_context)
-
-        return send_mail(subject,
-                  body,
-                  from_email,
-                  [self.email],
-                  fail_silently=settings.DEBUG, # fail silently in production
-                  html_message=html_template,
-                  )
+            message.attach_alternative(html_template, "text/html")
+
+        # queued or sent right away depending on `EMAIL_SEND_MODE`
+        return send_message(message, fail_silently=settings.DEBUG) # fail silently in production
     
     def __str__(self):
         """return the str representation"""
         return f"{self.first_name} {self.last_name}"
 
 
+class ProfileDescriptor(ReverseOneToOneDescriptor):
+    """
+    `user.profile` of a user that has none is an empty, unsaved `Profile`.
+    Reading it never writes, changes go through `User.get_or_create_profile()`.
+    """
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        try:
+            return super().__get__(instance, cls)
+        except self.RelatedObjectDoesNotExist:
+            pass
+        # not through the `user` descriptor, it would cache the placeholder on the user
+        profile = self.related.related_model(user_id=instance.pk)
+        self.related.field.set_cached_value(profile, instance)
+        return profile
+
+
+class ProfileField(models.OneToOneField):
+    """
+    The user of a profile. Users are created without one, instead of an
+    extra INSERT on every signup, and the profile is created by its first
+    change, see `User.get_or_create_profile()`.
+    """
+    related_accessor_class = ProfileDescriptor
+
+
 class Profile(models.Model):
     city = models.CharField(max_length=100, null=True, blank=True)
     state = models.CharField(max_length=100, null=True, blank=True)
     country = models.CharField(max_length=100, null=True, blank=True)
     date_of_birth = models.DateField(null=True, blank=True)
 
-    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
+    user = ProfileField(User, on_delete=models.CASCADE, related_name='profile')
 
     def __str__(self):
         return f"[User Profile] {self.user.get_full_name()}"
@@ -108,6 +228,125 @@ class OTPModel(models.Model):
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="otp")
 
+    class Meta:
+        """meta class"""
+        indexes = [
+            # the verify lookup, the user comes from the unique email index
+            models.Index(fields=["user", "code"], name="otpmodel_user_code_idx"),
+            # `purge_expired_otps`, the used codes are few so only they are indexed
+            models.Index(fields=["expires_at"], name="otpmodel_expires_idx"),
+            models.Index(fields=["id"], condition=models.Q(is_used=True), name="otpmodel_used_idx"),
+        ]
+
     def __str__(self):
         return f"OTP for user: {self.user.email}"
 
+
+
+class QueuedEmail(models.Model):
+    """An outbound email waiting to be delivered by the `send_queued_mail` worker"""
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField(blank=True)
+    html_body = models.TextField(null=True, blank=True)
+    content_subtype = models.CharField(max_length=20, default="plain") # "html" when the body is html
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list, blank=True)
+    bcc = models.JSONField(default=list, blank=True)
+    reply_to = models.JSONField(default=list, blank=True)
+    headers = models.JSONField(default=dict, blank=True)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    scheduled_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        """meta class"""
+        ordering = ["scheduled_at"]
+        indexes = [
+            models.Index(fields=["status", "scheduled_at"], name="queuedemail_status_sched_idx"),
+        ]
+
+    def __str__(self):
+        return f"[{self.status}] {self.subject} -> {', '.join(self.to)}"
+
+
+class ProfileImageTask(models.Model):
+    """Tracks an uploaded profile image while it is processed in the background"""
+    PENDING = "pending"
+    PROCESSING = "processing"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (PROCESSING, "Processing"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    progress = models.PositiveSmallIntegerField(default=0)
+    source = models.CharField(max_length=255)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    image = models.CharField(max_length=255, blank=True)
+    variants = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, blank=True, related_name="image_tasks"
+        )
+
+    def __str__(self):
+        return f"Profile image task {self.pk} ({self.status})"
+
+
+class Broadcast(models.Model):
+    """
+    An email sent to every user matching `filters`, see `broadcast.py`.
+    `last_user_id` is the checkpoint, a broadcast resumes after it.
+    """
+    PENDING = "pending"
+    SENDING = "sending"
+    DONE = "done"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (SENDING, "Sending"),
+        (DONE, "Done"),
+    ]
+
+    subject = models.CharField(max_length=255)
+    template = models.CharField(max_length=255) # rendered as `<template>.txt`, and `<template>.html` if it exists
+    context = models.JSONField(default=dict, blank=True) # extra template context, next to `user`
+    filters = models.JSONField(default=dict, blank=True) # `User.objects.filter()` keyword arguments
+    from_email = models.CharField(max_length=254, blank=True)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    last_user_id = models.BigIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    leased_until = models.DateTimeField(null=True, blank=True) # held by the process sending it until then
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"[{self.status}] {self.subject}"
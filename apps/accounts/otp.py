@@ -0,0 +1,96 @@
+"""Storage of the email verification codes"""
+import secrets
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.module_loading import import_string
+
+from .models import OTPModel
+
+
+def generate_code():
+    """a random 6 digit code"""
+    return str(100000 + secrets.randbelow(900000))
+
+
+class BaseOTPBackend:
+    """
+    Interface for the verification code store. Set `OTP_BACKEND`
+    to the dotted path of a subclass to plug in a different store.
+    """
+
+    def create(self, user, email):
+        """issue a code for `email` that expires after `VERIFICATION_CODE_EXPIRATION_TIME` minutes"""
+        raise NotImplementedError
+
+    def verify(self, email, code):
+        """
+        use up the code if it is valid for `email` and return
+        the id of its user, or None for a wrong or expired code
+        """
+        raise NotImplementedError
+
+
+class DatabaseOTPBackend(BaseOTPBackend):
+    """Codes stored in the `OTPModel` table"""
+
+    def create(self, user, email):
+        code = generate_code()
+        OTPModel.objects.create(
+            user=user,
+            code=code,
+            expires_at=timezone.now() + timedelta(minutes=settings.VERIFICATION_CODE_EXPIRATION_TIME),
+        )
+        return code
+
+    def verify(self, email, code):
+        otp = OTPModel.objects.filter(
+            user__email=email, code=code, is_used=False, expires_at__gte=timezone.now()
+            ).values_list("pk", "user_id").first()
+        if otp is None:
+            return None
+        pk, user_id = otp
+        # only the request that deletes the row gets to use it
+        deleted, _ = OTPModel.objects.filter(pk=pk).delete()
+        return user_id if deleted else None
+
+
+class CacheOTPBackend(BaseOTPBackend):
+    """
+    One code per email in the `OTP_CACHE_ALIAS` cache, expired by the
+    cache itself. A new code replaces the previous one, and verifying is
+    a single get by key, so any number of outstanding codes costs the
+    same. Use a shared cache (e.g. Redis) when running several processes.
+    """
+
+    def get_cache(self):
+        return caches[settings.OTP_CACHE_ALIAS]
+
+    def key(self, email):
+        return f"accounts:otp:{email.lower()}"
+
+    def create(self, user, email):
+        code = generate_code()
+        self.get_cache().set(
+            self.key(email), {"code": code, "user_id": user.pk},
+            timeout=settings.VERIFICATION_CODE_EXPIRATION_TIME * 60,
+        )
+        return code
+
+    def verify(self, email, code):
+        cache = self.get_cache()
+        key = self.key(email)
+        otp = cache.get(key)
+        if otp is None or not constant_time_compare(otp["code"], code):
+            return None
+        # only the request that deletes the key gets to use it
+        if not cache.delete(key):
+            return None
+        return otp["user_id"]
+
+
+def get_otp_backend():
+    """returns an instance of the configured `OTP_BACKEND`"""
+    return import_string(settings.OTP_BACKEND)()
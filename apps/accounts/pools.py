@@ -0,0 +1,34 @@
+"""
+Process pools for CPU bound work.
+
+The workers are spawned rather than forked: the web process runs threads
+(the server's, the image pool's, the cache clients') and a fork copies
+the locks they hold, which can deadlock the child. A spawned worker
+starts a fresh interpreter and sets Django up before its first task.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+
+
+def _setup_worker(overrides):
+    import django
+
+    django.setup()
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+
+
+def process_pool(max_workers, setting_names=()):
+    """
+    A `ProcessPoolExecutor` of spawned workers. The settings in
+    `setting_names` are copied from this process, the workers read
+    the others from `DJANGO_SETTINGS_MODULE` like any process.
+    """
+    overrides = {name: getattr(settings, name) for name in setting_names}
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_setup_worker,
+        initargs=(overrides,),
+    )
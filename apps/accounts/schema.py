@@ -0,0 +1,105 @@
+"""
+The OpenAPI schema, generated once instead of on every request.
+
+`build_schema` writes it to `OPENAPI_SCHEMA_DIRECTORY`, in a file named
+after the API version. Outside of DEBUG that file is served if it exists,
+otherwise the schema is generated on the first request. Each format is
+rendered once and kept in memory with its ETag.
+
+Only imported by the urls of the "full" `RUNTIME_PROFILE`, drf_spectacular
+is slow to import and not installed in the "api" one.
+"""
+import os
+import json
+import hashlib
+import threading
+from django.conf import settings
+from django.http import HttpResponse
+from drf_spectacular.contrib.rest_auth import SimpleJWTCookieScheme
+from drf_spectacular.settings import spectacular_settings
+from drf_spectacular.utils import extend_schema
+from drf_spectacular.views import SpectacularAPIView, SCHEMA_KWARGS
+from rest_framework import status
+
+class StatelessJWTCookieScheme(SimpleJWTCookieScheme):
+    """the same security schemes as the dj-rest-auth authentication it extends"""
+    target_class = "apps.accounts.authentication.StatelessJWTCookieAuthentication"
+
+
+_schema = None
+_rendered = {} # media type -> (content, etag)
+_lock = threading.Lock()
+
+
+def schema_path():
+    return os.path.join(settings.OPENAPI_SCHEMA_DIRECTORY, f"openapi-{spectacular_settings.VERSION}.json")
+
+
+def generate():
+    """introspect the views and return the schema as a dict"""
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    return generator.get_schema(request=None, public=spectacular_settings.SERVE_PUBLIC)
+
+
+def build():
+    """generate the schema into `schema_path()`, returns the path"""
+    path = schema_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = json.dumps(generate(), indent=2, sort_keys=True, default=str)
+    # write then rename, so a server never reads half a file
+    with open(path + ".tmp", "w") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def get_schema():
+    global _schema
+    with _lock:
+        if _schema is None:
+            path = schema_path()
+            if not settings.DEBUG and os.path.exists(path):
+                with open(path) as f:
+                    _schema = json.load(f)
+            else:
+                _schema = generate()
+        return _schema
+
+
+def render(renderer):
+    """the schema rendered by a DRF `renderer` and its ETag"""
+    schema = get_schema()
+    with _lock:
+        if renderer.media_type not in _rendered:
+            content = renderer.render(schema, renderer_context={})
+            etag = '"' + hashlib.sha256(content).hexdigest()[:32] + '"'
+            _rendered[renderer.media_type] = (content, etag)
+        return _rendered[renderer.media_type]
+
+
+def clear():
+    """forget the schema, it is loaded or generated again on next use"""
+    global _schema
+    with _lock:
+        _schema = None
+        _rendered.clear()
+
+
+class CachedSpectacularAPIView(SpectacularAPIView):
+    """
+    The drf_spectacular schema view, answering from the schema built or
+    rendered once rather than introspecting every view per request, with
+    an ETag so clients can revalidate it for free.
+    """
+
+    @extend_schema(**SCHEMA_KWARGS)
+    def get(self, request, *args, **kwargs):
+        content, etag = render(request.accepted_renderer)
+        if request.headers.get("If-None-Match") == etag:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(content, content_type=request.accepted_renderer.media_type)
+            response["Content-Disposition"] = f'inline; filename="{self._get_filename(request, None)}"'
+        response["ETag"] = etag
+        response["Cache-Control"] = "no-cache"
+        return response
@@ -0,0 +1,191 @@
+"""
+User search on a precomputed, normalized `User.search_text` column.
+
+The column holds the lowercased, accent free words of the user names,
+email and profile location. `User.save()` and the `Profile` save signal
+keep it up to date. It is indexed with the best the database offers:
+
+- PostgreSQL: a trigram GIN index, so `LIKE '%word%'` does not scan the table
+- SQLite: an FTS5 table kept in sync by triggers, searched by word prefix,
+  the listing keeps the `USER_SEARCH_MAX_RESULTS` newest users that match
+  its filters
+- anything else: no index, the single column is scanned
+
+The indexes are created by the migrations. A migration that makes SQLite
+rebuild the user table drops the triggers, they are recreated after every
+`migrate` (see the `post_migrate` receiver in `signals.py`).
+`rebuild_search_index` fills the column and recreates the indexes, e.g.
+after users were loaded outside of the ORM.
+"""
+import re
+import unicodedata
+from django.conf import settings
+from django.db import connections
+from django.db.models.expressions import RawSQL
+
+USER_FIELDS = ("first_name", "last_name", "email")
+PROFILE_FIELDS = ("city", "state", "country")
+MAX_TERMS = 5 # words of a query used, the rest is ignored
+
+USER_TABLE = "accounts_user"
+FTS_TABLE = "accounts_user_search"
+TRIGRAM_INDEX = "user_search_trgm_idx"
+
+
+def normalize(text):
+    """lowercase words without accents, joined by spaces"""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+def document(user, profile=None):
+    """the `search_text` of a user and its profile"""
+    values = [getattr(user, field) for field in USER_FIELDS]
+    if profile is not None:
+        values += [getattr(profile, field) for field in PROFILE_FIELDS]
+    return " ".join(filter(None, map(normalize, values)))
+
+
+def terms(query):
+    return normalize(query).split()[:MAX_TERMS]
+
+
+def fts_match(words):
+    """an FTS5 query for the rows with every word as a prefix"""
+    return " AND ".join(f'"{word}"*' for word in words)
+
+
+def _fts_rowids(queryset, words, limit):
+    """the sql of the ids of the `limit` newest users of `queryset` with every word"""
+    sql = f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+    params = [fts_match(words)]
+    if queryset.query.has_filters():
+        # filtered in the capped query, or the newest matches could all be filtered out after it
+        filtered, filter_params = queryset.values("pk").order_by().query.sql_with_params()
+        sql += f" AND rowid IN ({filtered})"
+        params += filter_params
+    if limit is not None:
+        sql += " ORDER BY rowid DESC LIMIT %s"
+        params.append(limit)
+    return sql, params
+
+
+def search(queryset, query, limit=None):
+    """
+    the users of `queryset` matching every word of `query`. On SQLite a
+    `limit` keeps only that many of the newest of them, see `is_capped`.
+    """
+    words = terms(query)
+    if not words:
+        return queryset
+    connection = connections[queryset.db]
+    if connection.vendor == "sqlite":
+        # FTS5 streams the newest matches cheaply, but decoding all of them for a
+        # common word costs more than a scan, so only the newest are kept
+        sql, params = _fts_rowids(queryset, words, limit)
+        return queryset.filter(pk__in=RawSQL(sql, params))
+    for word in words:
+        queryset = queryset.filter(search_text__contains=word)
+    return queryset
+
+
+def is_capped(queryset, query, limit):
+    """whether `search(queryset, query, limit)` left out some of the matching users"""
+    words = terms(query)
+    connection = connections[queryset.db]
+    if not words or connection.vendor != "sqlite":
+        return False
+    sql, params = _fts_rowids(queryset, words, limit + 1)
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM ({sql})", params)
+        return cursor.fetchone()[0] > limit
+
+
+def create_index(connection):
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"search_text, content='{USER_TABLE}', content_rowid='id')"
+            )
+            # the external content table is only updated by these triggers
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON {USER_TABLE} BEGIN "
+                f"INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON {USER_TABLE} BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF search_text ON {USER_TABLE} BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text); "
+                f"INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END"
+            )
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    elif connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX} ON {USER_TABLE} USING gin (search_text gin_trgm_ops)"
+            )
+
+
+def index_missing(connection):
+    """
+    whether the search index or, on SQLite, one of its triggers is missing.
+    False until the migrations added the column.
+    """
+    with connection.cursor() as cursor:
+        if USER_TABLE not in connection.introspection.table_names(cursor):
+            return False
+        columns = [column.name for column in connection.introspection.get_table_description(cursor, USER_TABLE)]
+        if "search_text" not in columns:
+            return False
+        if connection.vendor == "sqlite":
+            names = [FTS_TABLE] + [f"{FTS_TABLE}_{trigger}" for trigger in ("insert", "delete", "update")]
+            cursor.execute(
+                f"SELECT count(*) FROM sqlite_master WHERE name IN ({', '.join(['%s'] * len(names))})", names,
+            )
+            return cursor.fetchone()[0] < len(names)
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT count(*) FROM pg_indexes WHERE indexname = %s", [TRIGRAM_INDEX])
+            return not cursor.fetchone()[0]
+    return False
+
+
+def drop_index(connection):
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            for trigger in ("insert", "delete", "update"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{trigger}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP INDEX IF EXISTS {TRIGRAM_INDEX}")
+
+
+def fill(users, batch_size=1000):
+    """
+    recompute the `search_text` of a `User` queryset, in batches of
+    `batch_size` users, returns the number of users changed
+    """
+    users = users.select_related("profile").only(
+        "search_text", *USER_FIELDS, *(f"profile__{field}" for field in PROFILE_FIELDS)
+    ).order_by("pk")
+    changed = last = 0
+    while True:
+        batch = list(users.filter(pk__gt=last)[:batch_size])
+        if not batch:
+            return changed
+        last = batch[-1].pk
+        stale = []
+        for user in batch:
+            # loaded by select_related, None without a profile, and never created here
+            text = document(user, user._meta.get_field("profile").get_cached_value(user))
+            if text != user.search_text:
+                user.search_text = text
+                stale.append(user)
+        if stale:
+            changed += users.model.objects.bulk_update(stale, ["search_text"])
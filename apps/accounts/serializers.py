@@ -1,12 +1,15 @@
 import os
 import uuid
-from PIL import Image
+import shutil
+import hashlib
 from rest_framework import serializers
 from dj_rest_auth.registration.serializers import RegisterSerializer
 from dj_rest_auth.serializers import LoginSerializer
 from django.conf import settings
+from django.db import transaction
 
-from .models import User, Profile
+from . import images
+from .models import User, Profile, ProfileImageTask
 
 
 class UserRegisterSerializer(RegisterSerializer):
@@ -50,19 +53,12 @@ class UserRegisterSerializer(RegisterSerializer):
         data.update({
             'first_name': self.validated_data.get('first_name', ''),
             'last_name': self.validated_data.get('last_name', ''),
-            'password1': self.validated_data.get('password', None)
+            'password1': self.validated_data.get('password', None),
+            # set by `CustomAccountAdapter.save_user`, before the user is inserted
+            'image': self.validated_data.get('image', None),
         })
         return data
 
-    def custom_signup(self, request, user: User):
-        """
-        perform some custom action on the user model signup.
-        If a profile model is linked to the user model, you can
-        create that here.
-        """
-        user.image = self.validated_data.get('image', None)
-        user.save()
-
 
 class ProfileSerializer(serializers.ModelSerializer):
     class Meta:
@@ -78,6 +74,7 @@ class ProfileSerializer(serializers.ModelSerializer):
 class UserDetailSerializer(serializers.ModelSerializer):
     """user detail serializer"""
     profile = ProfileSerializer()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -86,6 +83,7 @@ class UserDetailSerializer(serializers.ModelSerializer):
             "first_name",
             "last_name",
             "image",
+            "image_variants",
             "profile",
             "is_active",
             "date_joined",
@@ -93,8 +91,27 @@ class UserDetailSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ["email", "is_active", "date_joined", "updated_at"]
 
+    def to_representation(self, instance):
+        """an uploaded `image` is stored as a path, made absolute like the variants"""
+        data = super().to_representation(instance)
+        request = self.context.get("request")
+        if request is not None and (data.get("image") or "").startswith("/"):
+            data["image"] = request.build_absolute_uri(data["image"])
+        return data
+
+    def get_image_variants(self, obj) -> dict:
+        """urls of the uploaded image by size, use the small ones for lists and avatars"""
+        request = self.context.get("request")
+        if request is None:
+            return {}
+        return {size: images.image_url(request, name) for size, name in obj.image_variants.items()}
+
     def update(self, instance, validated_data):
-        """update user profile"""
+        """
+        update user profile.
+        The profile data is already validated by the nested serializer, and
+        only the columns that actually changed are written.
+        """
         method = self.context["request"].method
         if (method != 'PATCH'):
             raise serializers.ValidationError(f"Method not allowed: {method}. Only `PATCH`")
@@ -102,18 +119,26 @@ class UserDetailSerializer(serializers.ModelSerializer):
 
         profile_data = validated_data.pop('profile', {})
 
+        changed = []
         for i, j in validated_data.items():
             if i in self.Meta.read_only_fields:
                 continue
-            setattr(instance, i, j)
-        instance.save()
-
-        profile = Profile.objects.get(user=instance)
-        serializer = ProfileSerializer(profile, data=profile_data, partial=True)
-        if serializer.is_valid():
-            serializer.save()
-        else:
-            raise serializers.ValidationError(f"Invalid profile data: {serializer.errors}")
+            if getattr(instance, i) != j:
+                setattr(instance, i, j)
+                changed.append(i)
+        if changed:
+            instance.save(update_fields=changed + ["updated_at"])
+
+        if not profile_data:
+            return instance
+        profile = instance.get_or_create_profile()
+        changed = []
+        for i, j in profile_data.items():
+            if getattr(profile, i) != j:
+                setattr(profile, i, j)
+                changed.append(i)
+        if changed:
+            profile.save(update_fields=changed)
         
         return instance
 
@@ -124,20 +149,66 @@ class VerifyEmailSerialzer(serializers.Serializer):
 
 
 class ProfileImageUploadSerializer(serializers.Serializer):
-    image = serializers.ImageField()
+    image = serializers.FileField()
+
+    def validate_image(self, upload):
+        """size limits are checked from the header, without decoding the image"""
+        try:
+            images.validate_upload(upload)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return upload
 
     def create(self, validated_data):
-        file_location = os.path.join(settings.PROFILE_IMAGE_DIRECTORY,
-                                     'profile-' + str(uuid.uuid4().hex)[:7] + '.jpg')
+        """
+        Only store the raw upload here, the decoding, resizing and
+        re-encoding is done by the processing pipeline (see `images.py`).
+        An image that was uploaded before is not processed again.
+        """
+        upload = validated_data.get("image")
+        # the raw upload still has its EXIF data, it is kept where it is not served
+        os.makedirs(settings.PROFILE_IMAGE_UPLOAD_DIRECTORY, exist_ok=True)
+        source = os.path.join(settings.PROFILE_IMAGE_UPLOAD_DIRECTORY, 'upload-' + uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        if hasattr(upload, "temporary_file_path"):
+            # large uploads are already spooled to disk, move rather than copy
+            for chunk in upload.chunks():
+                digest.update(chunk)
+            shutil.move(upload.temporary_file_path(), source)
+            upload.close()
+        else:
+            with open(source, "wb") as f:
+                for chunk in upload.chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+
+        task = ProfileImageTask.objects.create(
+            source=source,
+            content_hash=digest.hexdigest()[:20],
+            user=validated_data.get("user"),
+        )
+        variants = images.existing_variants(task.content_hash)
+        if variants:
+            os.remove(source)
+            images.complete(task, variants)
+        elif settings.PROFILE_IMAGE_EXECUTOR == "inline":
+            images.schedule(task)
+        else:
+            transaction.on_commit(lambda: images.schedule(task))
+        return task
 
-        img = Image.open(validated_data.get("image"))
-        img.save(file_location)
-        validated_data["image"] = file_location
-        return validated_data
 
-    def to_representation(self, instance):
-        """the instance is a dict as set in the create method"""
-        return instance
+class UserListSerializer(serializers.ModelSerializer):
+    """a row of the staff user listing"""
+    class Meta:
+        model = User
+        fields = ["id", "email", "first_name", "last_name", "is_active", "is_staff", "created_at"]
+
+
+class ProfileImageTaskSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProfileImageTask
+        fields = ["id", "status", "progress", "image", "variants", "error"]
 
 
 class CustomLoginSerializer(LoginSerializer):
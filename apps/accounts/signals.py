@@ -1,30 +1,68 @@
 import logging
-from django.db.models.signals import post_save
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, post_migrate
 from django.conf import settings
 from django.dispatch import receiver
+from django.utils.autoreload import file_changed
 from allauth.account.signals import email_confirmed
 
+from .cache import HIDDEN_FIELDS, invalidate_on_commit
+from . import email_templates, search
+from .middleware import query_wrapper
 from .models import User, Profile
 
 logger = logging.getLogger(__name__)
 
-@receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    if created:
-        Profile.objects.create(user=instance)
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, using, update_fields=None, **kwargs):
+    # e.g. the login only writes `last_login`, which the cached details don't show
+    if update_fields is not None and set(update_fields) <= HIDDEN_FIELDS:
+        return
+    invalidate_on_commit(instance.pk, using=using)
+
+@receiver([post_save, post_delete], sender=Profile)
+def invalidate_cached_profile(sender, instance, using, **kwargs):
+    invalidate_on_commit(instance.user_id, using=using)
+
+@receiver(post_save, sender=Profile)
+def update_search_text(sender, instance, update_fields, **kwargs):
+    """the profile location is part of the user `search_text`"""
+    if update_fields is not None and set(update_fields).isdisjoint(search.PROFILE_FIELDS):
+        return
+    user = instance.user
+    text = search.document(user, instance)
+    if text != user.search_text:
+        User.objects.filter(pk=user.pk).update(search_text=text)
+        user.search_text = text
+
+@receiver(post_migrate)
+def recreate_search_index(sender, using, **kwargs):
+    """SQLite drops the search triggers when a migration rebuilds the user table"""
+    if sender.label != "accounts":
+        return
+    connection = connections[using]
+    if search.index_missing(connection):
+        logger.warning("recreating the user search index")
+        search.create_index(connection)
+
+@receiver(file_changed)
+def reload_email_templates(sender, file_path, **kwargs):
+    # returns None, Django's own template receiver still decides whether to restart
+    if file_path.suffix in (".txt", ".html"):
+        email_templates.clear()
 
 @receiver(email_confirmed)
 def send_welcome_email(request, email_address, **kwargs):
     try:
-        user = User.objects.get(email=email_address)
-        user.send_mail(
-            "Welcome to our app",
-            f"""Hello {user.get_full_name()},\
-            \nIts good to have you in our midst, feel at home.
-            """,
-        )
-    except User.DoesNotExist:
-        # log and fail silently
-        logger.debug(f"Trying to send welcome email to non existent user. Email: {email_address}")
+        # the verify views load the user with the email address
+        user = email_address.user
+        [(subject, body, _)] = email_templates.render_mail("accounts/email/welcome", [{"user": user}])
+        user.send_mail(subject, body)
     except Exception as e:
         logger.error(f"Error while trying to send welcome email: {e}")
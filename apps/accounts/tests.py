@@ -1,13 +1,45 @@
 from django.test import TestCase, override_settings
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from rest_framework import status
 from rest_framework.test import APIClient
 from django.contrib.auth import get_user_model
 from django.conf import settings
 from django.core import mail
+from django.contrib.sites.models import Site
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.utils import timezone
+from django.template import Engine, TemplateDoesNotExist
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from PIL import Image
+import os
+import csv
+import smtplib
+import gzip
+import json
+import asyncio
+import tempfile
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from allauth.account.models import EmailAddress
+from allauth.account.signals import email_confirmed
 
-from .models import User, OTPModel
+from . import broadcast, email_templates, hashing, images, metrics, schema, search, throttling
+from .adapters import CustomAccountAdapter
+from .authentication import ClaimsUser, StatelessJWTCookieAuthentication
+from .cache import cache_stats, get_cache, get_user_details, invalidate_user_details
+from .mail import send_message
+from .otp import CacheOTPBackend, DatabaseOTPBackend
+from .throttling import throttle_stats
+from .models import User, Profile, OTPModel, QueuedEmail, ProfileImageTask, Broadcast
+from .management.commands import profile_startup
 
 
 @override_settings(PASSWORD_HASHERS=("django.contrib.auth.hashers.MD5PasswordHasher",))
@@ -24,9 +56,49 @@ class UserModelTests(TestCase):
     def test_user_model(self):
         self.assertEqual(self.user.email, 'testemail@gmail.com')
         self.assertTrue(self.user.check_password('testpassword'))
-        self.assertIsNotNone(self.user.profile, msg='Test that the profile was created automatically')
+        self.assertIsNotNone(self.user.get_or_create_profile(), msg='Test that the profile is created on demand')
         self.assertEqual(self.user.get_full_name(), 'Test User')
 
+    def test_profile_created_on_demand(self):
+        user = User.objects.get(pk=self.user.pk)
+        self.assertFalse(Profile.objects.filter(user=user).exists())
+        self.assertIsNone(user.existing_profile())
+        # an empty profile, reading it never writes
+        with self.assertNumQueries(0):
+            self.assertIsNone(user.profile.pk)
+            self.assertIsNone(user.profile.city)
+            self.assertIs(user.profile.user, user)
+        self.assertIsNone(user.existing_profile(), "the placeholder is not cached as the profile")
+        self.assertFalse(Profile.objects.filter(user=user).exists())
+        # savepoint, insert, release
+        with self.assertNumQueries(3):
+            profile = user.get_or_create_profile()
+        self.assertEqual(Profile.objects.get(user=user), profile)
+        self.assertIs(user.profile, profile)
+        with self.assertNumQueries(2):
+            self.assertEqual(User.objects.get(pk=user.pk).get_or_create_profile(), profile)
+
+    def test_profile_of_a_new_user(self):
+        user = User.objects.create_user(
+            email='new@gmail.com', password='testpassword', first_name='new', last_name='user',
+        )
+        with self.assertNumQueries(0):
+            self.assertIsNone(user.profile.country)
+        self.assertIsNone(User(email="unsaved@gmail.com").profile.pk)
+
+    def test_profile_created_meanwhile(self):
+        user = User.objects.select_related("profile").get(pk=self.user.pk)
+        Profile.objects.create(user=User.objects.get(pk=user.pk), city="Lagos")
+        # the cached "no profile" is stale, the insert fails and the profile is read
+        self.assertEqual(user.get_or_create_profile().city, "Lagos")
+
+    def test_date_joined_is_kept(self):
+        date_joined = self.user.date_joined
+        self.user.first_name = "changed"
+        self.user.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.date_joined, date_joined)
+
     def test_default_fields(self):
         self.assertEqual(self.user.is_active, True)
         self.assertEqual(self.user.is_superuser, False)
@@ -50,6 +122,7 @@ class UserAPITest(TestCase):
         )
 
     def setUp(self) -> None:
+        get_cache().clear()
         self.client = APIClient()
         self.client.force_authenticate(user=self.user)
     
@@ -72,6 +145,17 @@ class UserAPITest(TestCase):
         self.assertEqual(data["first_name"], "string")
         self.assertEqual(data["last_name"], "last")
         self.assertEqual(data["email"], "testuser@test.com")
+
+    def test_create_user_with_image(self):
+        response = self.client.post(reverse_lazy('rest_register'), {
+            "email": "withimage@test.com",
+            "password": "testpassword123",
+            "first_name": "string",
+            "last_name": "last",
+            "image": "https://example.com/me.png",
+        }, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(User.objects.get(email="withimage@test.com").image, "https://example.com/me.png")
     
     def test_verification_email_was_sent(self):
         """test that an email was sent"""
@@ -256,3 +340,1464 @@ class UserAPITest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(user_data['email'], "testemail@gmail.com")
 
+
+
+@override_settings(PASSWORD_HASHERS=("django.contrib.auth.hashers.MD5PasswordHasher",),
+                   ACCOUNT_EMAIL_VERIFICATION="optional",
+                   EMAIL_VERIFICATION_BY_CODE=True,
+                   EMAIL_SEND_MODE="queue")
+class MailQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = get_user_model().objects.create_user(
+            email='testemail@gmail.com',
+            password='testpassword',
+            first_name='test',
+            last_name='user',
+        )
+
+    def test_signup_only_enqueues(self):
+        """the verification email is queued, not sent, during signup"""
+        url = reverse_lazy('rest_register')
+        data = {
+            "email": "queued@test.com",
+            "password": "testpassword123",
+            "first_name": "string",
+            "last_name": "last",
+        }
+        response = APIClient().post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(mail.outbox), 0)
+        queued = QueuedEmail.objects.get()
+        self.assertEqual(queued.to, ["queued@test.com"])
+
+        call_command("send_queued_mail", stdout=StringIO())
+        otp = OTPModel.objects.get(user__email="queued@test.com")
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(otp.code, mail.outbox[0].body)
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, QueuedEmail.SENT)
+        self.assertIsNotNone(queued.sent_at)
+
+    def test_user_send_mail_with_html(self):
+        self.user.send_mail("Hello", "plain body", html_template="accounts/email/email_confirmation_code_message.txt")
+        queued = QueuedEmail.objects.get()
+        self.assertEqual(queued.body, "plain body")
+        self.assertIsNotNone(queued.html_body)
+
+        call_command("send_queued_mail", stdout=StringIO())
+        self.assertEqual(mail.outbox[0].alternatives[0][1], "text/html")
+
+    @override_settings(EMAIL_QUEUE_MAX_ATTEMPTS=2, EMAIL_QUEUE_RETRY_BACKOFF=60)
+    def test_failed_delivery_is_retried_with_backoff(self):
+        self.user.send_mail("Hello", "plain body")
+        queued = QueuedEmail.objects.get()
+        with mock.patch("django.core.mail.EmailMessage.send", side_effect=ConnectionError("smtp down")), \
+                self.assertLogs("apps.accounts.mail", "WARNING"):
+            call_command("send_queued_mail", stdout=StringIO())
+            queued.refresh_from_db()
+            self.assertEqual(queued.status, QueuedEmail.PENDING)
+            self.assertEqual(queued.attempts, 1)
+            self.assertEqual(queued.last_error, "smtp down")
+            self.assertGreater(queued.scheduled_at, timezone.now())
+
+            # not due yet, so nothing is picked up
+            call_command("send_queued_mail", stdout=StringIO())
+            queued.refresh_from_db()
+            self.assertEqual(queued.attempts, 1)
+
+            QueuedEmail.objects.update(scheduled_at=timezone.now())
+            call_command("send_queued_mail", stdout=StringIO())
+            queued.refresh_from_db()
+            self.assertEqual(queued.status, QueuedEmail.FAILED)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_unreachable_server_reschedules_the_batch(self):
+        self.user.send_mail("Hello", "plain body")
+        self.user.send_mail("Hello again", "plain body")
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.open", side_effect=OSError("refused")), \
+                self.assertLogs("apps.accounts.mail", "WARNING"):
+            call_command("send_queued_mail", stdout=StringIO())
+        for queued in QueuedEmail.objects.all():
+            self.assertEqual((queued.status, queued.attempts, queued.last_error), (QueuedEmail.PENDING, 1, "refused"))
+            self.assertGreater(queued.scheduled_at, timezone.now())
+
+    def test_recipients_headers_and_subtype_are_kept(self):
+        message = mail.EmailMessage(
+            "Hi", "<p>html only</p>", "from@test.com", ["to@test.com"],
+            cc=["cc@test.com"], bcc=["hidden@test.com"], headers={"X-Tag": "welcome"},
+        )
+        message.content_subtype = "html"
+        send_message(message)
+        call_command("send_queued_mail", stdout=StringIO())
+        sent = mail.outbox[0]
+        self.assertEqual((sent.to, sent.cc, sent.bcc), (["to@test.com"], ["cc@test.com"], ["hidden@test.com"]))
+        self.assertNotIn("hidden@test.com", sent.message().as_string())
+        self.assertEqual(sent.extra_headers, {"X-Tag": "welcome"})
+        self.assertEqual(sent.message().get_content_type(), "text/html")
+
+
+def make_image(size=(1200, 800), image_format="JPEG", exif=None):
+    """an in-memory image upload"""
+    buffer = BytesIO()
+    img = Image.new("RGB", size, color=(200, 30, 30))
+    if exif is not None:
+        img.save(buffer, image_format, exif=exif)
+    else:
+        img.save(buffer, image_format)
+    return SimpleUploadedFile("photo.jpg", buffer.getvalue(), content_type="image/jpeg")
+
+
+class ProfileImageTests(TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.upload_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.upload_directory.cleanup)
+        settings_override = override_settings(
+            PROFILE_IMAGE_DIRECTORY=self.directory.name,
+            PROFILE_IMAGE_UPLOAD_DIRECTORY=self.upload_directory.name,
+            PROFILE_IMAGE_EXECUTOR="inline",
+            PROFILE_IMAGE_SIZES=[512, 128],
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = APIClient()
+
+    def test_upload_is_resized(self):
+        url = reverse_lazy("upload-user-image")
+        response = self.client.post(url, {"image": make_image()}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["status"], ProfileImageTask.DONE)
+        self.assertEqual(response.data["progress"], 100)
+        self.assertEqual(set(response.data["variants"]), {"512", "128"})
+
+        task = ProfileImageTask.objects.get()
+        with Image.open(os.path.join(self.directory.name, task.variants["512"])) as img:
+            self.assertEqual(img.size, (512, 341))
+        with Image.open(os.path.join(self.directory.name, task.variants["128"])) as img:
+            self.assertEqual(img.size, (128, 85))
+        self.assertEqual(task.variants["128"], task.content_hash + "-128.jpg")
+        self.assertFalse(os.path.exists(task.source), "the raw upload is removed")
+
+    def test_same_image_is_stored_once(self):
+        url = reverse_lazy("upload-user-image")
+        first = self.client.post(url, {"image": make_image()}, format="multipart")
+        with mock.patch("apps.accounts.images.process_image") as process_image:
+            second = self.client.post(url, {"image": make_image()}, format="multipart")
+        process_image.assert_not_called()
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.data["variants"], second.data["variants"])
+        self.assertEqual(len(os.listdir(self.directory.name)), 2)
+
+    def test_variants_are_served_with_immutable_cache_headers(self):
+        url = reverse_lazy("upload-user-image")
+        response = self.client.post(url, {"image": make_image()}, format="multipart")
+        response = self.client.get(response.data["variants"]["128"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("immutable", response["Cache-Control"])
+        etag = response["ETag"]
+        response = self.client.get(response.wsgi_request.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(PROFILE_IMAGE_EXECUTOR="thread")
+    def test_only_processed_variants_are_served(self):
+        with mock.patch("apps.accounts.images.schedule"):
+            self.client.post(reverse_lazy("upload-user-image"), {"image": make_image()}, format="multipart")
+        task = ProfileImageTask.objects.get()
+        self.assertTrue(task.source.startswith(self.upload_directory.name))
+        self.assertEqual(os.listdir(self.directory.name), [])
+        for name in ["variant.jpg.tmp", "notes.txt"]:
+            with open(os.path.join(self.directory.name, name), "w") as f:
+                f.write("private")
+        for name in ["variant.jpg.tmp", "notes.txt", os.path.basename(task.source)]:
+            response = self.client.get("/" + settings.PROFILE_IMAGE_URL + name)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(PROFILE_IMAGE_EXECUTOR="thread")
+    def test_tasks_left_by_a_restart_are_recovered(self):
+        with mock.patch("apps.accounts.images.schedule"):
+            self.client.post(reverse_lazy("upload-user-image"), {"image": make_image()}, format="multipart")
+            self.client.post(
+                reverse_lazy("upload-user-image"), {"image": make_image(size=(600, 600))}, format="multipart",
+            )
+        waiting, lost = ProfileImageTask.objects.order_by("created_at")
+        os.remove(lost.source)
+        fresh = ProfileImageTask.objects.create(source=os.path.join(self.upload_directory.name, "fresh"))
+        orphan = os.path.join(self.upload_directory.name, "orphan")
+        recent = os.path.join(self.upload_directory.name, "recent")
+        for path in [orphan, recent]:
+            with open(path, "wb") as f:
+                f.write(b"raw")
+        an_hour_ago = time.time() - 3600
+        os.utime(orphan, (an_hour_ago, an_hour_ago))
+        os.utime(waiting.source, (an_hour_ago, an_hour_ago))
+        ProfileImageTask.objects.filter(pk__in=[waiting.pk, lost.pk]).update(
+            updated_at=timezone.now() - timezone.timedelta(hours=1),
+        )
+
+        with override_settings(PROFILE_IMAGE_EXECUTOR="inline"):
+            out = StringIO()
+            call_command("recover_image_tasks", stdout=out)
+        self.assertIn("Rescheduled 1 tasks, failed 1, removed 1", out.getvalue())
+        waiting.refresh_from_db()
+        self.assertEqual(waiting.status, ProfileImageTask.DONE)
+        self.assertFalse(os.path.exists(waiting.source))
+        lost.refresh_from_db()
+        self.assertEqual(lost.status, ProfileImageTask.FAILED)
+        fresh.refresh_from_db()
+        self.assertEqual(fresh.status, ProfileImageTask.PENDING, "a task still moving is left alone")
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(recent), "a recent upload may not have its task committed yet")
+
+    @override_settings(PASSWORD_HASHERS=("django.contrib.auth.hashers.MD5PasswordHasher",))
+    def test_user_details_expose_variants(self):
+        user = get_user_model().objects.create_user(
+            email='testemail@gmail.com',
+            password='testpassword',
+            first_name='test',
+            last_name='user',
+        )
+        self.client.force_authenticate(user=user)
+        self.client.post(reverse_lazy("upload-user-image"), {"image": make_image()}, format="multipart")
+        response = self.client.get(reverse_lazy("rest_user_details"))
+        variants = response.data["image_variants"]
+        self.assertEqual(set(variants), {"512", "128"})
+        self.assertTrue(variants["128"].startswith("http://testserver/profile/"))
+        self.assertEqual(response.data["image"], variants["512"])
+
+    @override_settings(PASSWORD_HASHERS=("django.contrib.auth.hashers.MD5PasswordHasher",))
+    def test_task_is_only_shown_to_its_user(self):
+        owner, other = [
+            get_user_model().objects.create_user(email=f'{name}@gmail.com', password='testpassword', first_name=name, last_name='user')
+            for name in ["owner", "other"]
+        ]
+        self.client.force_authenticate(user=owner)
+        status_url = reverse("upload-user-image-status", args=[
+            self.client.post(reverse_lazy("upload-user-image"), {"image": make_image()}, format="multipart").data["id"]
+        ])
+        self.assertEqual(self.client.get(status_url).status_code, status.HTTP_200_OK)
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get(status_url).status_code, status.HTTP_404_NOT_FOUND)
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get(status_url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_exif_orientation_is_applied(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6 # rotated 90 degrees
+        upload = make_image(size=(600, 300), exif=exif.tobytes())
+        source = os.path.join(self.directory.name, "source.jpg")
+        with open(source, "wb") as f:
+            f.write(upload.read())
+        outputs = images.process_image(source, os.path.join(self.directory.name, "out"), [512])
+        with Image.open(outputs[512]) as img:
+            self.assertEqual(img.size, (256, 512))
+
+    @override_settings(PROFILE_IMAGE_EXECUTOR="thread")
+    def test_upload_returns_before_processing(self):
+        url = reverse_lazy("upload-user-image")
+        with mock.patch("apps.accounts.images.schedule") as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(url, {"image": make_image()}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["status"], ProfileImageTask.PENDING)
+        task = ProfileImageTask.objects.get()
+        schedule.assert_called_once_with(task)
+
+        # the client polls the task until it is done
+        images.run_task(task)
+        response = self.client.get(response.data["status_url"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data["image"].endswith("-512.jpg"))
+
+    @override_settings(PROFILE_IMAGE_MAX_BYTES=1024)
+    def test_upload_over_byte_limit_is_rejected(self):
+        url = reverse_lazy("upload-user-image")
+        response = self.client.post(url, {"image": make_image()}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ProfileImageTask.objects.exists())
+
+    @override_settings(PROFILE_IMAGE_MAX_PIXELS=100 * 100)
+    def test_upload_over_pixel_limit_is_rejected_without_decoding(self):
+        url = reverse_lazy("upload-user-image")
+        with mock.patch("PIL.ImageFile.ImageFile.load") as load:
+            response = self.client.post(url, {"image": make_image(size=(101, 100))}, format="multipart")
+        load.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_non_image_upload_is_rejected(self):
+        url = reverse_lazy("upload-user-image")
+        upload = SimpleUploadedFile("photo.jpg", b"not an image", content_type="image/jpeg")
+        response = self.client.post(url, {"image": upload}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0)
+    def test_upload_spooled_to_disk_is_moved(self):
+        url = reverse_lazy("upload-user-image")
+        response = self.client.post(url, {"image": make_image()}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(os.listdir(self.directory.name)), 2)
+
+
+@override_settings(PASSWORD_HASHERS=("django.contrib.auth.hashers.MD5PasswordHasher",))
+class UserDetailsCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = get_user_model().objects.create_user(
+            email='testemail@gmail.com',
+            password='testpassword',
+            first_name='test',
+            last_name='user',
+        )
+
+    def setUp(self) -> None:
+        get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse_lazy("rest_user_details")
+
+    def test_second_read_is_served_from_cache(self):
+        before = cache_stats()
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        after = cache_stats()
+        self.assertEqual(response.data["email"], "testemail@gmail.com")
+        self.assertEqual(after["misses"] - before["misses"], 1)
+        self.assertEqual(after["hits"] - before["hits"], 1)
+
+    def test_update_invalidates_cache(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(self.url, {"last_name": "changed", "profile": {"city": "Lagos"}}, format="json")
+        response = self.client.get(self.url)
+        self.assertEqual(response.data["last_name"], "changed")
+        self.assertEqual(response.data["profile"]["city"], "Lagos")
+
+    def test_profile_save_invalidates_cache(self):
+        self.client.get(self.url)
+        profile = self.user.get_or_create_profile()
+        profile.country = "Ghana"
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.data["profile"]["country"], "Ghana")
+
+    def test_invalidated_after_commit(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks() as callbacks:
+            User.objects.filter(pk=self.user.pk).update(last_name="changed")
+            # a read before the commit still gets the cached details
+            self.assertEqual(self.client.get(self.url).data["last_name"], "user")
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get(self.url).data["last_name"], "changed")
+
+    def test_fill_racing_an_invalidation_is_not_served(self):
+        request = APIClient().get(self.url).wsgi_request
+
+        def serialize_then_invalidate():
+            # the row changes and its invalidation runs while the old row is serialized
+            invalidate_user_details(self.user.pk)
+            return {"last_name": "old"}
+
+        get_user_details(request, self.user.pk, serialize_then_invalidate)
+        details = get_user_details(request, self.user.pk, lambda: {"last_name": "changed"})
+        self.assertEqual(details["last_name"], "changed")
+
+    def test_hidden_fields_keep_the_cache(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            User.objects.filter(pk=self.user.pk).update(search_text="x")
+            self.user.save(update_fields=["last_login"])
+        self.assertEqual(callbacks, [])
+
+    @override_settings(USER_DETAILS_CACHE_ALIAS="missing")
+    def test_local_memory_fallback(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+
+@override_settings(PASSWORD_HASHERS=("django.contrib.auth.hashers.MD5PasswordHasher",),
+                   ACCOUNT_EMAIL_VERIFICATION="optional")
+class StatelessJWTAuthenticationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = get_user_model().objects.create_user(
+            email='testemail@gmail.com',
+            password='testpassword',
+            first_name='test',
+            last_name='user',
+        )
+
+    def setUp(self) -> None:
+        get_cache().clear()
+        self.client = APIClient()
+        response = self.client.post(reverse_lazy("rest_login"), {
+            "email": "testemail@gmail.com",
+            "password": "testpassword",
+        }, format="json")
+        self.token = response.data["access"]
+        self.refresh = response.data["refresh"]
+        # only authenticate through the header
+        self.client.cookies.clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+
+    def authenticate(self):
+        request = mock.Mock(META={"HTTP_AUTHORIZATION": f"Bearer {self.token}"}, COOKIES={})
+        user, _ = StatelessJWTCookieAuthentication().authenticate(request)
+        return user
+
+    def test_user_is_built_from_claims(self):
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+            self.assertIsInstance(user, ClaimsUser)
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertEqual(user.email, "testemail@gmail.com")
+            self.assertTrue(user.is_active)
+            self.assertFalse(user.is_staff)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.first_name, "test")
+            self.assertEqual(user.last_name, "user")
+
+    @override_settings(JWT_CLAIMS_MAX_AGE=-1)
+    def test_stale_claims_are_read_from_db(self):
+        with self.assertNumQueries(1):
+            user = self.authenticate()
+        self.assertIsInstance(user, User)
+
+    @override_settings(JWT_CLAIMS_MAX_AGE=60)
+    def test_refreshed_token_has_fresh_claims(self):
+        later = time.time() + 120
+        with mock.patch("time.time", return_value=later):
+            response = self.client.post(reverse_lazy("token_refresh"), {"refresh": self.refresh}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.token = response.data["access"]
+            with self.assertNumQueries(0):
+                user = self.authenticate()
+        self.assertIsInstance(user, ClaimsUser)
+
+    def test_cached_user_details_need_no_query(self):
+        url = reverse_lazy("rest_user_details")
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["email"], "testemail@gmail.com")
+
+    def test_writes_go_to_the_user_row(self):
+        response = self.client.post(reverse_lazy("rest_password_change"), {
+            'new_password1': 'testpassword2',
+            'new_password2': 'testpassword2',
+        }, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('testpassword2'))
+
+        response = self.client.patch(reverse_lazy("rest_user_details"), {"first_name": "Changed"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "Changed")
+
+    def test_attributes_set_on_the_proxy_are_saved(self):
+        user = self.authenticate()
+        user.last_name = "changed"
+        user.is_staff = True
+        self.assertTrue(user.is_staff)
+        user.save()
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.last_name, self.user.is_staff), ("changed", True))
+
+
+@override_settings(PASSWORD_HASHERS=("django.contrib.auth.hashers.MD5PasswordHasher",),
+                   ACCOUNT_EMAIL_VERIFICATION="optional",
+                   EMAIL_VERIFICATION_BY_CODE=True)
+class QueryCountTests(TestCase):
+    """
+    Pins the number of queries per endpoint. If one of these fails,
+    check the new queries are really needed before updating the number.
+    """
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = get_user_model().objects.create_user(
+            email='testemail@gmail.com',
+            password='testpassword',
+            first_name='test',
+            last_name='user',
+        )
+        # users get their profile on first use, most of these tests have one
+        Profile.objects.create(user=cls.user)
+        cls.new_user = get_user_model().objects.create_user(
+            email='new_user@gmail.com', password='testpassword', first_name='new', last_name='user',
+        )
+
+    def setUp(self) -> None:
+        get_cache().clear()
+        # the current site is cached per process, start every test without it
+        Site.objects.clear_cache()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse_lazy("rest_user_details")
+
+    def jwt_client(self):
+        client = APIClient()
+        response = client.post(reverse_lazy("rest_login"), {
+            "email": "testemail@gmail.com",
+            "password": "testpassword",
+        }, format="json")
+        client.cookies.clear()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        return client
+
+    def test_get_user_details(self):
+        # user and profile in one query
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data["profile"]["city"], None)
+
+    def test_get_user_details_without_profile(self):
+        self.client.force_authenticate(user=self.new_user)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data["profile"]["city"], None)
+        # reading it does not create it
+        self.assertFalse(Profile.objects.filter(user=self.new_user).exists())
+
+    def test_get_user_details_with_jwt(self):
+        client = self.jwt_client()
+        with self.assertNumQueries(1):
+            client.get(self.url)
+        with self.assertNumQueries(0):
+            client.get(self.url)
+
+    def test_patch_user_and_profile(self):
+        # select, update user, update profile, update the user search_text with the city
+        with self.assertNumQueries(4):
+            response = self.client.patch(self.url, {
+                "first_name": "Changed",
+                "profile": {"city": "Lagos"},
+            }, format="json")
+        self.assertEqual(response.data["first_name"], "Changed")
+        self.assertEqual(response.data["profile"]["city"], "Lagos")
+
+    def test_patch_profile_only(self):
+        # select, update profile, update the user search_text
+        with self.assertNumQueries(3):
+            self.client.patch(self.url, {"profile": {"city": "Lagos"}}, format="json")
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.city, "Lagos")
+
+    def test_first_profile_change_creates_it(self):
+        self.client.force_authenticate(user=self.new_user)
+        # select, savepoint, insert, release, update profile, update the user search_text
+        with self.assertNumQueries(6):
+            self.client.patch(self.url, {"profile": {"city": "Lagos"}}, format="json")
+        self.assertEqual(Profile.objects.get(user=self.new_user).city, "Lagos")
+
+    def test_patch_without_changes(self):
+        with self.assertNumQueries(1):
+            self.client.patch(self.url, {"first_name": "test"}, format="json")
+
+    def test_patch_user_only_leaves_the_profile(self):
+        self.client.force_authenticate(user=self.new_user)
+        # select, update user
+        with self.assertNumQueries(2):
+            self.client.patch(self.url, {"first_name": "Changed"}, format="json")
+        self.assertFalse(Profile.objects.filter(user=self.new_user).exists())
+
+    def test_patch_only_writes_changed_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.patch(self.url, {"last_name": "Changed"}, format="json")
+        update = [q["sql"] for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(update), 1)
+        self.assertIn('"last_name"', update[0])
+        self.assertNotIn('"first_name"', update[0])
+        self.assertNotIn('"password"', update[0])
+
+    def test_register(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().post(reverse_lazy('rest_register'), {
+                "email": "new@test.com",
+                "password": "testpassword123",
+                "first_name": "string",
+                "last_name": "last",
+            }, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(queries), 18)
+        # the user is inserted with its image, then only its last_login is set,
+        # and its profile waits for the first use
+        user_writes = [q["sql"] for q in queries if q["sql"].startswith(('INSERT INTO "accounts_user"', 'UPDATE "accounts_user"'))]
+        self.assertEqual(len(user_writes), 2)
+        self.assertIn('SET "last_login"', user_writes[1])
+        self.assertFalse(any(q["sql"].startswith('INSERT INTO "accounts_profile"') for q in queries))
+
+    def test_login(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().post(reverse_lazy('rest_login'), {
+                "email": "testemail@gmail.com",
+                "password": "testpassword",
+            }, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 10)
+        user_writes = [q["sql"] for q in queries if q["sql"].startswith('UPDATE "accounts_user"')]
+        self.assertEqual(len(user_writes), 1)
+        self.assertIn('SET "last_login"', user_writes[0])
+
+    def test_login_keeps_the_cached_details(self):
+        client = self.jwt_client()
+        client.get(self.url)
+        self.jwt_client()
+        # last_login is not in the details
+        with self.assertNumQueries(0):
+            client.get(self.url)
+
+
+@override_settings(PASSWORD_HASHERS=("django.contrib.auth.hashers.MD5PasswordHasher",))
+class BulkCreateUsersTests(TestCase):
+    def test_bulk_create_users(self):
+        get_user_model().objects.create_user(
+            email='existing@test.com', password='testpassword', first_name='test', last_name='user',
+        )
+        rows = [
+            {"email": f"user{i}@test.com", "password": "testpassword", "first_name": "bulk", "last_name": str(i)}
+            for i in range(5)
+        ]
+        rows.append({"email": "existing@test.com", "password": "x", "first_name": "dup", "last_name": "dup"})
+        rows.append({"email": "user0@test.com", "password": "x", "first_name": "dup", "last_name": "dup"})
+        rows[0]["city"] = "Lagos"
+
+        # one chunk: existing emails, users, profiles, email addresses
+        with self.assertNumQueries(4 + 2):  # + savepoint
+            created, skipped = User.objects.bulk_create_users(rows, batch_size=10)
+        self.assertEqual((created, skipped), (5, 2))
+
+        user = User.objects.get(email="user0@test.com")
+        self.assertTrue(user.check_password("testpassword"))
+        self.assertEqual(user.profile.city, "Lagos")
+        self.assertTrue(EmailAddress.objects.filter(user=user, email="user0@test.com", primary=True).exists())
+
+    def test_import_users_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "users.csv")
+            with open(path, "w") as f:
+                f.write("email,password,first_name,last_name,country\n")
+                for i in range(25):
+                    f.write(f"user{i}@test.com,testpassword,bulk,{i},Ghana\n")
+            out = StringIO()
+            call_command("import_users", path, "--batch-size", "10", "--workers", "0", "--verified", stdout=out)
+        self.assertIn("Imported 25 users", out.getvalue())
+        self.assertEqual(User.objects.count(), 25)
+        self.assertEqual(Profile.objects.filter(country="Ghana").count(), 25)
+        self.assertEqual(EmailAddress.objects.filter(verified=True).count(), 25)
+
+    def test_import_jsonl_with_process_pool(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "users.jsonl")
+            with open(path, "w") as f:
+                for i in range(4):
+                    f.write(json.dumps({"email": f"user{i}@test.com", "password": "pw", "first_name": "bulk", "last_name": str(i)}) + "\n")
+            call_command("import_users", path, "--workers", "2", stdout=StringIO())
+        self.assertTrue(User.objects.get(email="user3@test.com").check_password("pw"))
+
+
+@override_settings(PASSWORD_HASHERS=("django.contrib.auth.hashers.MD5PasswordHasher",),
+                   PASSWORD_HASHING_WORKERS=1)
+class PasswordHashingPoolTests(TestCase):
+    def setUp(self) -> None:
+        self.addCleanup(hashing.shutdown_executor)
+
+    def test_hashes_are_made_on_the_pool(self):
+        user = get_user_model().objects.create_user(
+            email='testemail@gmail.com', password='testpassword', first_name='test', last_name='user',
+        )
+        self.assertIsNotNone(hashing.get_executor())
+        self.assertTrue(user.password.startswith("md5$"))
+        self.assertTrue(user.check_password("testpassword"))
+        self.assertFalse(user.check_password("wrong"))
+        self.assertTrue(asyncio.run(user.acheck_password("testpassword")))
+
+    @override_settings(PASSWORD_HASHERS=(
+        "django.contrib.auth.hashers.MD5PasswordHasher",
+        "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    ))
+    def test_outdated_hash_is_upgraded(self):
+        user = get_user_model().objects.create_user(
+            email='testemail@gmail.com', password='testpassword', first_name='test', last_name='user',
+        )
+        outdated = hashing.hashers.PBKDF2PasswordHasher().encode("testpassword", "salt", iterations=1)
+        User.objects.filter(pk=user.pk).update(password=outdated)
+        user.refresh_from_db()
+        self.assertTrue(user.check_password("testpassword"))
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith("md5$"))
+
+    @override_settings(PASSWORD_HASHING_WORKERS=0)
+    def test_no_pool(self):
+        self.assertIsNone(hashing.get_executor())
+        encoded = hashing.make_password("testpassword")
+        self.assertTrue(hashing.check_password("testpassword", encoded))
+        self.assertTrue(asyncio.run(hashing.acheck_password("testpassword", encoded)))
+
+
+@override_settings(PASSWORD_HASHERS=("django.contrib.auth.hashers.MD5PasswordHasher",))
+@mock.patch("apps.accounts.views.GoogleLogin.callback_url", "http://testserver/google/login/callback/")
+class GoogleLoginCallbackTests(TestCase):
+    def google_session(self):
+        """a requests session answering the token and userinfo calls like google"""
+        session = mock.Mock()
+        session.request.return_value = mock.Mock(
+            status_code=200, headers={"content-type": "application/json"},
+            json=lambda: {"access_token": "google-token", "expires_in": 3600},
+        )
+        session.get.return_value = mock.Mock(ok=True, json=lambda: {
+            "id": "1234", "email": "google@test.com", "verified_email": True,
+            "given_name": "google", "family_name": "user",
+        })
+        return session
+
+    def test_callback_logs_in_without_a_loopback_request(self):
+        session = self.google_session()
+        with mock.patch("apps.accounts.adapters.CustomSocialAdapter.get_requests_session", return_value=session), \
+                mock.patch("requests.post") as loopback:
+            response = APIClient().get("/google/login/callback/", {"code": "google-code"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("access", response.data)
+        self.assertEqual(response.data["user"]["email"], "google@test.com")
+        self.assertTrue(User.objects.filter(email="google@test.com").exists())
+        loopback.assert_not_called()
+        session.request.assert_called_once()
+        for step in ("oauth_token", "oauth_profile", "social_login", "jwt", "google_login"):
+            self.assertIn(f"{step};dur=", response["Server-Timing"])
+
+    def test_callback_with_rejected_code(self):
+        session = self.google_session()
+        session.request.return_value = mock.Mock(
+            status_code=400, headers={"content-type": "application/json"}, content=b"{}",
+        )
+        with mock.patch("apps.accounts.adapters.CustomSocialAdapter.get_requests_session", return_value=session):
+            response = APIClient().get("/google/login/callback/", {"code": "bad-code"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_requests_session_is_shared(self):
+        from allauth.socialaccount.adapter import get_adapter as get_social_adapter
+        session = get_social_adapter().get_requests_session()
+        self.assertIs(session, get_social_adapter().get_requests_session())
+        self.assertEqual(session.get_adapter("https://oauth2.googleapis.com")._pool_maxsize,
+                         settings.SOCIALACCOUNT_REQUESTS_POOL_SIZE)
+
+
+@override_settings(PASSWORD_HASHERS=("django.contrib.auth.hashers.MD5PasswordHasher",),
+                   ACCOUNT_EMAIL_VERIFICATION="optional",
+                   EMAIL_VERIFICATION_BY_CODE=True)
+class OTPBackendTests(TestCase):
+    def setUp(self) -> None:
+        get_cache().clear()
+        self.user = get_user_model().objects.create_user(
+            email='otp@test.com',
+            password='testpassword',
+            first_name='test',
+            last_name='user',
+        )
+
+    def test_database_code_is_single_use(self):
+        backend = DatabaseOTPBackend()
+        code = backend.create(self.user, self.user.email)
+        self.assertEqual(backend.verify(self.user.email, code), self.user.pk)
+        self.assertIsNone(backend.verify(self.user.email, code))
+        self.assertFalse(OTPModel.objects.exists())
+
+    def test_database_code_expires(self):
+        backend = DatabaseOTPBackend()
+        code = backend.create(self.user, self.user.email)
+        OTPModel.objects.update(expires_at=timezone.now() - timezone.timedelta(seconds=1))
+        self.assertIsNone(backend.verify(self.user.email, code))
+
+    @override_settings(OTP_BACKEND="apps.accounts.otp.CacheOTPBackend")
+    def test_cache_backend_verifies_email(self):
+        APIClient().post(reverse_lazy('rest_register'), {
+            "email": "cached@test.com",
+            "password": "testpassword123",
+            "first_name": "string",
+            "last_name": "last",
+        }, format="json")
+        self.assertFalse(OTPModel.objects.exists())
+        code = get_cache().get(CacheOTPBackend().key("cached@test.com"))["code"]
+        self.assertIn(code, mail.outbox[0].body)
+
+        url = reverse_lazy("verify-email-code")
+        response = APIClient().post(url, {"email": "cached@test.com", "code": code}, format="json")
+        self.assertEqual(response.data["detail"], "Email verified successfully")
+        self.assertTrue(EmailAddress.objects.get(email="cached@test.com").verified)
+        response = APIClient().post(url, {"email": "cached@test.com", "code": code}, format="json")
+        self.assertEqual(response.data["detail"], "Invalid or expired code")
+
+    def test_cache_code_is_replaced_and_checked(self):
+        backend = CacheOTPBackend()
+        first = backend.create(self.user, self.user.email)
+        second = backend.create(self.user, self.user.email)
+        if first != second:
+            self.assertIsNone(backend.verify(self.user.email, first))
+        self.assertIsNone(backend.verify(self.user.email, "000000"))
+        self.assertEqual(backend.verify("OTP@test.com", second), self.user.pk)
+
+    @override_settings(VERIFICATION_CODE_EXPIRATION_TIME=0)
+    def test_cache_code_expires(self):
+        backend = CacheOTPBackend()
+        code = backend.create(self.user, self.user.email)
+        self.assertIsNone(backend.verify(self.user.email, code))
+
+    def test_purge_expired_otps(self):
+        now = timezone.now()
+        for minutes in (-10, -1, 5):
+            OTPModel.objects.create(user=self.user, code="123456", expires_at=now + timezone.timedelta(minutes=minutes))
+        OTPModel.objects.create(
+            user=self.user, code="654321", expires_at=now + timezone.timedelta(minutes=5), is_used=True,
+        )
+        out = StringIO()
+        call_command("purge_expired_otps", batch_size=2, stdout=out)
+        self.assertEqual(list(OTPModel.objects.values_list("code", flat=True)), ["123456"])
+        self.assertIn("Purged 3 rows (2 expired, 1 used)", out.getvalue())
+
+    def test_purge_expired_otps_uses_the_indexes(self):
+        expired = OTPModel.objects.filter(expires_at__lt=timezone.now()).values_list("pk", flat=True)[:10]
+        used = OTPModel.objects.filter(is_used=True).values_list("pk", flat=True)[:10]
+        self.assertIn("otpmodel_expires_idx", expired.explain())
+        self.assertIn("otpmodel_used_idx", used.explain())
+
+
+@override_settings(PASSWORD_HASHERS=("django.contrib.auth.hashers.MD5PasswordHasher",),
+                   ACCOUNT_EMAIL_VERIFICATION="optional",
+                   EMAIL_VERIFICATION_BY_CODE=True)
+class ThrottlingTests(TestCase):
+    def setUp(self) -> None:
+        get_cache().clear()
+        self.client = APIClient()
+        self.url = reverse_lazy("verify-email-code")
+
+    def guess(self, email="guess@test.com", ip="10.0.0.1"):
+        return self.client.post(self.url, {"email": email, "code": "000000"}, format="json", REMOTE_ADDR=ip)
+
+    def test_verify_is_throttled_per_email(self):
+        for i in range(5):
+            self.assertEqual(self.guess(ip=f"10.0.0.{i}").status_code, status.HTTP_400_BAD_REQUEST)
+        before = throttle_stats().get("otp_verify", {}).get("rejected", 0)
+        self.assertEqual(self.guess(ip="10.0.1.1").status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(throttle_stats()["otp_verify"]["rejected"], before + 1)
+
+    def test_verify_is_throttled_per_ip(self):
+        for i in range(5):
+            self.guess(email=f"guess{i}@test.com")
+        self.assertEqual(self.guess(email="other@test.com").status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.guess(email="other@test.com", ip="10.0.0.2").status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_sliding_window(self):
+        with mock.patch("apps.accounts.throttling.time.time", return_value=1000 * 60 + 30):
+            self.assertTrue(throttling.hit("test", ["a"], 2, 60))
+            self.assertTrue(throttling.hit("test", ["a"], 2, 60))
+            self.assertFalse(throttling.hit("test", ["a"], 2, 60))
+        # half way into the next window half of the previous one still counts
+        with mock.patch("apps.accounts.throttling.time.time", return_value=1001 * 60 + 30):
+            self.assertTrue(throttling.hit("test", ["a"], 2, 60))
+            self.assertFalse(throttling.hit("test", ["a"], 2, 60))
+        with mock.patch("apps.accounts.throttling.time.time", return_value=1002 * 60 + 59):
+            self.assertTrue(throttling.hit("test", ["a"], 2, 60))
+
+    def test_concurrent_requests_are_counted(self):
+        cache = throttling.get_cache()
+        barrier = threading.Barrier(8)
+        get_many = type(cache).get_many
+
+        def get_many_together(backend, keys):
+            # every request reads the counts before any of them is counted
+            counts = get_many(backend, keys)
+            barrier.wait(timeout=5)
+            return counts
+
+        with mock.patch("apps.accounts.throttling.time.time", return_value=1000 * 60), \
+                mock.patch.object(type(cache), "get_many", get_many_together), \
+                ThreadPoolExecutor(8) as pool:
+            allowed = list(pool.map(lambda _: throttling.hit("test", ["a", "b"], 3, 60), range(8)))
+            # the rejected requests gave their count back
+            self.assertEqual(cache.get("accounts:throttle:test:a:1000"), 3)
+            self.assertEqual(cache.get("accounts:throttle:test:b:1000"), 3)
+        self.assertEqual(allowed.count(True), 3)
+
+    def test_confirmation_emails_are_throttled(self):
+        user = get_user_model().objects.create_user(
+            email='resend@test.com', password='testpassword', first_name='test', last_name='user',
+        )
+        EmailAddress.objects.create(user=user, email=user.email, primary=True, verified=False)
+        url = reverse_lazy("rest_resend_email")
+        responses = [self.client.post(url, {"email": user.email}, format="json") for _ in range(4)]
+        self.assertEqual([r.status_code for r in responses], [200, 200, 200, 429])
+        self.assertEqual(OTPModel.objects.count(), 3)
+
+        # the emails sent are limited on their own, whatever path sends them
+        get_cache().clear()
+        rates = {**settings.REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"], "otp_resend": "100/min"}
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "DEFAULT_THROTTLE_RATES": rates}):
+            responses = [self.client.post(url, {"email": user.email}, format="json") for _ in range(4)]
+        self.assertEqual([r.status_code for r in responses], [200, 200, 200, 429])
+        self.assertEqual(OTPModel.objects.count(), 6)
+
+    def test_signups_behind_one_ip_get_their_email(self):
+        for i in range(5):
+            response = self.client.post(reverse_lazy("rest_register"), {
+                "email": f"signup{i}@test.com",
+                "password": "testpassword123",
+                "first_name": "string",
+                "last_name": "last",
+            }, format="json", REMOTE_ADDR="10.0.0.1")
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(OTPModel.objects.count(), 5)
+
+    def test_non_mapping_body_is_not_an_error(self):
+        response = self.client.post(self.url, [{"email": "guess@test.com"}], format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(PASSWORD_HASHERS=("django.contrib.auth.hashers.MD5PasswordHasher",),
+                   ACCOUNT_EMAIL_VERIFICATION="optional",
+                   PERFORMANCE_SAMPLE_RATE=1)
+class PerformanceMiddlewareTests(TestCase):
+    def setUp(self) -> None:
+        get_cache().clear()
+        metrics.reset()
+        get_user_model().objects.create_user(
+            email='timed@test.com', password='testpassword', first_name='test', last_name='user',
+        )
+
+    def login(self):
+        return APIClient().post(reverse_lazy("rest_login"), {
+            "email": "timed@test.com",
+            "password": "testpassword",
+        }, format="json")
+
+    def test_server_timing_header(self):
+        response = self.login()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        steps = dict(part.split(";", 1)[0:2] for part in response["Server-Timing"].split(", "))
+        for step in ("db", "hash", "total"):
+            self.assertIn(step, steps)
+        rendered = metrics.render()
+        self.assertIn('accounts_requests_total{route="rest_login",method="POST",status="200"} 1', rendered)
+        self.assertIn('accounts_step_total{step="hash"} 1', rendered)
+
+    @override_settings(PERFORMANCE_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_only_counted(self):
+        response = self.login()
+        self.assertNotIn("Server-Timing", response)
+        rendered = metrics.render()
+        self.assertIn('accounts_requests_total{route="rest_login",method="POST",status="200"} 1', rendered)
+        self.assertIn("accounts_sampled_requests_total 0", rendered)
+
+    def test_metrics_endpoint(self):
+        self.login()
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'accounts_request_duration_seconds_count{route="rest_login"} 1', response.content)
+        self.assertEqual(self.client.get(reverse("metrics"), REMOTE_ADDR="10.0.0.1").status_code,
+                         status.HTTP_403_FORBIDDEN)
+        with override_settings(METRICS_TOKEN="secret"):
+            response = self.client.get(reverse("metrics"), REMOTE_ADDR="10.0.0.1",
+                                       HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # with a token set, the internal IPs need it too
+        with override_settings(METRICS_TOKEN="secret"):
+            self.assertEqual(self.client.get(reverse("metrics")).status_code, status.HTTP_403_FORBIDDEN)
+
+    async def test_async_requests_are_timed(self):
+        response = await self.async_client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("total;dur=", response["Server-Timing"])
+
+
+class SchemaTests(TestCase):
+    def setUp(self) -> None:
+        schema.clear()
+        self.addCleanup(schema.clear)
+
+    def test_schema_is_generated_once(self):
+        with mock.patch("apps.accounts.schema.generate", wraps=schema.generate) as generate:
+            first = self.client.get(reverse("schema"), HTTP_ACCEPT="application/vnd.oai.openapi+json")
+            second = self.client.get(reverse("schema"), HTTP_ACCEPT="application/vnd.oai.openapi+json")
+        self.assertEqual(generate.call_count, 1)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertIn("/api/v1/accounts/verify-email-code/", json.loads(first.content)["paths"])
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first["ETag"], second["ETag"])
+
+    def test_stateless_jwt_security_scheme(self):
+        generated = schema.generate()
+        self.assertIn("jwtHeaderAuth", generated["components"]["securitySchemes"])
+
+    def test_conditional_get(self):
+        etag = self.client.get(reverse("schema"))["ETag"]
+        response = self.client.get(reverse("schema"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b"")
+
+    def test_built_schema_is_served(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(OPENAPI_SCHEMA_DIRECTORY=directory):
+                call_command("build_schema", stdout=StringIO())
+                self.assertTrue(os.path.exists(schema.schema_path()))
+                schema.clear()
+                with mock.patch("apps.accounts.schema.generate") as generate:
+                    response = self.client.get(reverse("schema"), HTTP_ACCEPT="application/vnd.oai.openapi+json")
+                generate.assert_not_called()
+        self.assertIn("/api/v1/accounts/verify-email-code/", json.loads(response.content)["paths"])
+
+
+class BenchmarkTests(TestCase):
+    def test_api_benchmark_runs(self):
+        # in a fresh interpreter, the benchmark creates a test database of its own
+        result = subprocess.run(
+            [sys.executable, "manage.py", "benchmark", "api", "--users", "5", "--iterations", "1",
+             "--profile-iterations", "1"],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        for endpoint in ("register", "user_get", "upload_image"):
+            self.assertIn(endpoint, result.stdout)
+
+
+class StartupProfileTests(TestCase):
+    @skipUnless(os.getenv("ACCOUNTS_SLOW_TESTS"), "boots two workers, set ACCOUNTS_SLOW_TESTS to run it")
+    def test_api_profile_leaves_out_docs_and_admin(self):
+        _, full, _ = profile_startup.boot("full")
+        _, api, _ = profile_startup.boot("api")
+        self.assertIn("drf_spectacular.views", full)
+        self.assertIn("allauth.account.admin", full)
+        self.assertNotIn("drf_spectacular.views", api)
+        # the admin modules are not discovered, though DRF imports django.contrib.admin itself
+        self.assertNotIn("allauth.account.admin", api)
+        self.assertNotIn("allauth.headless", api)
+        # pillow waits for the first upload
+        self.assertNotIn("PIL.Image", full)
+
+    def test_imports_are_grouped_by_app(self):
+        apps = ["allauth", "allauth.account", "apps.accounts"]
+        totals = profile_startup.by_app(
+            {"allauth.account.views": 5, "allauth.core": 2, "apps.accounts.views": 3, "requests.adapters": 4},
+            apps,
+        )
+        self.assertEqual(totals, {"allauth.account": 5, "allauth": 2, "apps.accounts": 3, "requests": 4})
+
+
+class UserListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.staff = User.objects.create_user(
+            email="staff@gmail.com", password="testpassword", first_name="staff", last_name="user", is_staff=True,
+        )
+        for i in range(6):
+            User.objects.create_user(
+                email=f"user{i}@gmail.com", password="testpassword", first_name="test", last_name=f"user{i}",
+                is_active=i % 2 == 0,
+            )
+        # ties on created_at are broken by id
+        User.objects.exclude(pk=cls.staff.pk).update(created_at=timezone.now() - timezone.timedelta(days=1))
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.staff)
+        self.url = reverse("user-list")
+
+    def test_staff_only(self):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.get(email="user0@gmail.com"))
+        self.assertEqual(client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(APIClient().get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_pages_follow_created_at_and_id(self):
+        expected = list(User.objects.order_by("-created_at", "-id").values_list("email", flat=True))
+        emails, url = [], f"{self.url}?page_size=3"
+        while url:
+            with self.assertNumQueries(2): # count, page
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data["count"], 7)
+            self.assertTrue(response.data["count_exact"])
+            emails += [row["email"] for row in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(emails, expected)
+
+    def test_filters(self):
+        response = self.client.get(self.url, {"is_active": "false"})
+        self.assertEqual(response.data["count"], 3)
+        self.assertTrue(all(not row["is_active"] for row in response.data["results"]))
+        response = self.client.get(self.url, {"is_staff": "true", "is_active": "true"})
+        self.assertEqual([row["email"] for row in response.data["results"]], ["staff@gmail.com"])
+        response = self.client.get(self.url, {"is_staff": "maybe"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("is_staff", response.data)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(USER_LIST_COUNT_LIMIT=4)
+    def test_count_is_capped(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.data["count"], 4)
+        self.assertFalse(response.data["count_exact"])
+
+
+class UserSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.staff = User.objects.create_user(
+            email="staff@gmail.com", password="testpassword", first_name="staff", last_name="user", is_staff=True,
+        )
+        cls.user = User.objects.create_user(
+            email="ada.lovelace@example.com", password="testpassword", first_name="Ada", last_name="Lovelace",
+        )
+        User.objects.create_user(
+            email="chloe@example.com", password="testpassword", first_name="Chloé", last_name="Okafor",
+        )
+
+    def emails(self, query):
+        return sorted(search.search(User.objects.all(), query).values_list("email", flat=True))
+
+    def test_search_text_follows_user_and_profile(self):
+        self.assertEqual(self.user.search_text, "ada lovelace ada lovelace example com")
+        profile = self.user.get_or_create_profile()
+        profile.city = "Lagos"
+        profile.save(update_fields=["city"])
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.search_text.endswith("lagos"))
+        self.user.first_name = "Augusta"
+        self.user.save(update_fields=["first_name"])
+        self.assertEqual(self.emails("augusta lagos"), ["ada.lovelace@example.com"])
+        self.assertEqual(self.emails("ada lov"), ["ada.lovelace@example.com"]) # still in the email
+
+    def test_prefix_accent_and_case_insensitive(self):
+        self.assertEqual(self.emails("CHLO"), ["chloe@example.com"])
+        self.assertEqual(self.emails("chloé oka"), ["chloe@example.com"])
+        self.assertEqual(self.emails("example"), ["ada.lovelace@example.com", "chloe@example.com"])
+        self.assertEqual(self.emails("nobody"), [])
+        self.assertEqual(len(self.emails('"*')), 3) # nothing to search for
+
+    @override_settings(USER_SEARCH_MAX_RESULTS=1)
+    def test_broad_searches_keep_the_newest_matches(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("only SQLite caps the matches")
+        self.assertEqual(self.emails("example"), ["ada.lovelace@example.com", "chloe@example.com"])
+        capped = search.search(User.objects.all(), "example", limit=1)
+        self.assertEqual(list(capped.values_list("email", flat=True)), ["chloe@example.com"])
+        self.assertTrue(search.is_capped(User.objects.all(), "example", 1))
+        self.assertFalse(search.is_capped(User.objects.all(), "lovelace", 1))
+        client = APIClient()
+        client.force_authenticate(user=self.staff)
+        response = client.get(reverse("user-list"), {"search": "example"})
+        self.assertEqual((response.data["count"], response.data["count_exact"]), (1, False))
+        response = client.get(reverse("user-list"), {"search": "lovelace"})
+        self.assertEqual((response.data["count"], response.data["count_exact"]), (1, True))
+        # the export has every match
+        response = client.get(reverse("user-export"), {"search": "example"})
+        rows = list(csv.DictReader(StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 2)
+
+    @override_settings(USER_SEARCH_MAX_RESULTS=1)
+    def test_filters_apply_before_the_cap(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("only SQLite caps the matches")
+        User.objects.filter(email="chloe@example.com").update(is_active=False)
+        active = User.objects.filter(is_active=True)
+        self.assertEqual(list(search.search(active, "example", 1).values_list("email", flat=True)),
+                         ["ada.lovelace@example.com"])
+        self.assertFalse(search.is_capped(active, "example", 1))
+        client = APIClient()
+        client.force_authenticate(user=self.staff)
+        response = client.get(reverse("user-list"), {"search": "example", "is_active": "true"})
+        self.assertEqual([row["email"] for row in response.data["results"]], ["ada.lovelace@example.com"])
+        self.assertTrue(response.data["count_exact"])
+
+    def test_unchanged_user_save_skips_the_profile(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.is_active = False
+        with self.assertNumQueries(1):
+            user.save()
+        user.last_name = "King"
+        user.save()
+        self.assertEqual(self.emails("king"), ["ada.lovelace@example.com"])
+
+    def test_missing_triggers_are_recreated_after_migrate(self):
+        self.assertFalse(search.index_missing(connection))
+        if connection.vendor != "sqlite":
+            self.skipTest("only SQLite drops the triggers")
+        with connection.cursor() as cursor:
+            # what a table rebuild does
+            cursor.execute(f"DROP TRIGGER {search.FTS_TABLE}_update")
+        self.assertTrue(search.index_missing(connection))
+        emit_post_migrate_signal(verbosity=0, interactive=False, db=connection.alias)
+        self.assertFalse(search.index_missing(connection))
+        self.user.last_name = "Byron"
+        self.user.save(update_fields=["last_name"])
+        self.assertEqual(self.emails("byron"), ["ada.lovelace@example.com"])
+
+    def test_bulk_created_users_are_searchable(self):
+        User.objects.bulk_create_users([{
+            "email": "grace@example.com", "password": "testpassword",
+            "first_name": "Grace", "last_name": "Hopper", "city": "Arlington",
+        }])
+        self.assertEqual(self.emails("hopper arl"), ["grace@example.com"])
+
+    def test_rebuild_search_index(self):
+        User.objects.filter(pk=self.user.pk).update(search_text="")
+        out = StringIO()
+        call_command("rebuild_search_index", stdout=out)
+        self.assertIn("Updated 1 users", out.getvalue())
+        self.assertEqual(self.emails("lovelace"), ["ada.lovelace@example.com"])
+
+    def test_listing_and_admin_search(self):
+        client = APIClient()
+        client.force_authenticate(user=self.staff)
+        response = client.get(reverse("user-list"), {"search": "lovel"})
+        self.assertEqual([row["email"] for row in response.data["results"]], ["ada.lovelace@example.com"])
+        self.client.force_login(self.staff)
+        User.objects.filter(pk=self.staff.pk).update(is_superuser=True)
+        response = self.client.get(reverse("admin:accounts_user_changelist"), {"q": "okaf"})
+        self.assertContains(response, "chloe@example.com")
+        self.assertNotContains(response, "ada.lovelace@example.com")
+
+
+class UserExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.staff = User.objects.create_user(
+            email="staff@gmail.com", password="testpassword", first_name="staff", last_name="user", is_staff=True,
+        )
+        for i in range(5):
+            user = User.objects.create_user(
+                email=f"user{i}@gmail.com", password="testpassword", first_name="test", last_name=f"user{i}",
+                is_active=i != 0,
+            )
+        profile = user.get_or_create_profile()
+        profile.city = "Lagos"
+        profile.save()
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.staff)
+        self.url = reverse("user-export")
+
+    def test_csv(self):
+        response = self.client.get(self.url, HTTP_ACCEPT="text/csv")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertIn('filename="users.csv"', response["Content-Disposition"])
+        with self.assertNumQueries(1): # users and profiles joined
+            content = b"".join(response.streaming_content).decode()
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual([row["email"] for row in rows], ["staff@gmail.com"] + [f"user{i}@gmail.com" for i in range(5)])
+        self.assertEqual(rows[-1]["city"], "Lagos")
+        self.assertEqual(rows[1]["is_active"], "False")
+
+    def test_gzipped_jsonl_with_filters(self):
+        response = self.client.get(self.url, {"file_format": "jsonl", "gzip": "true", "is_active": "false"})
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertIn('filename="users.jsonl.gz"', response["Content-Disposition"])
+        lines = gzip.decompress(b"".join(response.streaming_content)).decode().splitlines()
+        self.assertEqual([json.loads(line)["email"] for line in lines], ["user0@gmail.com"])
+
+    def test_staff_only_and_format(self):
+        self.assertEqual(APIClient().get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get(self.url, {"file_format": "xml"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_command_round_trips_through_import(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "users.csv.gz")
+            call_command("export_users", path, "--chunk-size", "2", stderr=StringIO())
+            with gzip.open(path, "rt") as f:
+                rows = list(csv.DictReader(f))
+            self.assertEqual(len(rows), 6)
+            self.assertEqual(rows[0]["email"], "staff@gmail.com")
+            plain = os.path.join(directory, "users.csv")
+            with open(plain, "w") as f:
+                f.write(gzip.open(path, "rt").read())
+            User.objects.filter(email__startswith="user").delete()
+            call_command("import_users", plain, "--workers", "0", stdout=StringIO())
+        self.assertEqual(User.objects.get(email="user4@gmail.com").profile.city, "Lagos")
+
+
+class BroadcastTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        for i in range(5):
+            User.objects.create_user(
+                email=f"user{i}@gmail.com", password="testpassword", first_name=f"name{i}", last_name="user",
+                is_active=i != 4,
+            )
+
+    def send(self, *args):
+        out = StringIO()
+        call_command(
+            "send_broadcast", "--subject", "Policy update", "--filter", "is_active=true",
+            "--context", "body=Our terms changed", "--batch-size", "2", "--rate", "0", *args, stdout=out,
+        )
+        return out.getvalue()
+
+    def test_sends_to_the_filtered_users(self):
+        mail.outbox = []
+        self.assertIn("4 recipients", self.send("--dry-run"))
+        self.assertEqual(Broadcast.objects.count(), 0)
+        self.send()
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [f"user{i}@gmail.com" for i in range(4)])
+        self.assertIn("Hello name0,", mail.outbox[0].body)
+        self.assertIn("Our terms changed", mail.outbox[0].body)
+        item = Broadcast.objects.get()
+        self.assertEqual((item.status, item.sent, item.failed), (Broadcast.DONE, 4, 0))
+        self.assertEqual(item.last_user_id, User.objects.get(email="user3@gmail.com").pk)
+
+    def test_queries_per_batch(self):
+        item = Broadcast.objects.create(subject="Hi", template="accounts/email/broadcast_message")
+        # status, then per batch of 5 users: select with the profile, checkpoint, refresh,
+        # then the empty select, done and refresh
+        with self.assertNumQueries(7):
+            broadcast.send(item, batch_size=5, rate=0)
+        self.assertEqual(item.sent, 5)
+
+    def test_resumes_after_the_connection_fails(self):
+        mail.outbox = []
+        send_messages = mail.backends.locmem.EmailBackend.send_messages
+        calls = []
+
+        def flaky(backend, messages):
+            calls.append(messages)
+            if len(calls) == 3:
+                raise smtplib.SMTPServerDisconnected("gone")
+            return send_messages(backend, messages)
+
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages", flaky):
+            with self.assertRaisesMessage(CommandError, "stopped after 2 messages"):
+                self.send()
+        item = Broadcast.objects.get()
+        self.assertEqual((item.status, item.sent), (Broadcast.SENDING, 2))
+        self.assertIn("gone", item.last_error)
+        self.send("--resume", str(item.pk))
+        # nobody got it twice
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [f"user{i}@gmail.com" for i in range(4)])
+        item.refresh_from_db()
+        self.assertEqual((item.status, item.sent), (Broadcast.DONE, 4))
+
+    def test_refused_recipient_is_skipped(self):
+        mail.outbox = []
+        send_messages = mail.backends.locmem.EmailBackend.send_messages
+
+        def refuse(backend, messages):
+            if messages[0].to == ["user1@gmail.com"]:
+                raise smtplib.SMTPRecipientsRefused({"user1@gmail.com": (550, b"no such user")})
+            return send_messages(backend, messages)
+
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages", refuse):
+            with self.assertLogs("apps.accounts.broadcast", "WARNING"):
+                self.send()
+        item = Broadcast.objects.get()
+        self.assertEqual((item.sent, item.failed), (3, 1))
+        self.assertIn("user1@gmail.com", item.last_error)
+
+    def test_temporary_errors_stop_the_broadcast(self):
+        mail.outbox = []
+        send_messages = mail.backends.locmem.EmailBackend.send_messages
+        answers = {
+            "user1@gmail.com": smtplib.SMTPDataError(554, b"message rejected"),
+            "user2@gmail.com": smtplib.SMTPSenderRefused(451, b"try again later", "webmaster@localhost"),
+        }
+
+        def answer(backend, messages):
+            error = answers.get(messages[0].to[0])
+            if error is not None:
+                raise error
+            return send_messages(backend, messages)
+
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages", answer), \
+                self.assertLogs("apps.accounts.broadcast", "WARNING"):
+            with self.assertRaisesMessage(CommandError, "stopped after 1 messages"):
+                self.send()
+        item = Broadcast.objects.get()
+        # the 5xx is skipped, the 4xx is tried again on resume
+        self.assertEqual((item.status, item.sent, item.failed), (Broadcast.SENDING, 1, 1))
+        self.assertEqual(item.last_user_id, User.objects.get(email="user1@gmail.com").pk)
+        self.assertIsNone(item.leased_until)
+        self.send("--resume", str(item.pk))
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox), ["user0@gmail.com", "user2@gmail.com", "user3@gmail.com"],
+        )
+
+    def test_one_process_sends_a_broadcast(self):
+        mail.outbox = []
+        item = Broadcast.objects.create(subject="Hi", template="accounts/email/broadcast_message")
+        # taken by a process that is still sending
+        Broadcast.objects.filter(pk=item.pk).update(
+            status=Broadcast.SENDING, leased_until=timezone.now() + timezone.timedelta(seconds=60),
+        )
+        with self.assertRaisesMessage(CommandError, "being sent by another process"):
+            self.send("--resume", str(item.pk))
+        self.assertEqual(mail.outbox, [])
+        # the process crashed and its lease ran out
+        Broadcast.objects.filter(pk=item.pk).update(leased_until=timezone.now() - timezone.timedelta(seconds=1))
+        self.send("--resume", str(item.pk))
+        item.refresh_from_db()
+        self.assertEqual((item.status, item.sent, item.leased_until), (Broadcast.DONE, 5, None))
+
+    def test_pacer(self):
+        sleep = mock.Mock()
+        pacer = broadcast.Pacer(10, sleep)
+        for _ in range(5):
+            pacer.wait()
+        # the clock is not moved by the mock, so the 5th message waits until 0.5s
+        self.assertAlmostEqual(sleep.call_args.args[0], 0.5, delta=0.05)
+
+
+class EmailTemplatesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create_user(
+            email="ada@gmail.com", password="testpassword", first_name="Ada", last_name="Lovelace",
+        )
+
+    def test_compiled_once(self):
+        email_templates.clear()
+        with mock.patch.object(Engine, "get_template", autospec=True, side_effect=Engine.get_template) as get_template:
+            for i in range(3):
+                email_templates.render_mail("accounts/email/welcome", [{"user": self.user}])
+        # subject, text and the missing html
+        self.assertEqual(get_template.call_count, 3)
+        self.assertEqual(email_templates.get("accounts/email/welcome_subject.txt").static, "Welcome to our app\n")
+        self.assertIsNone(email_templates.get("accounts/email/welcome_message.html"))
+
+    def test_render_many(self):
+        users = [User(first_name="Ada"), User(first_name="Alan")]
+        rendered = email_templates.render_mail(
+            "accounts/email/email_confirmation_code", [{"user": user, "code": "123456"} for user in users],
+        )
+        self.assertEqual([subject for subject, _, _ in rendered], ["[USER APP] Verify your email"] * 2)
+        self.assertTrue(rendered[0][1].startswith("Hello Ada,"))
+        self.assertTrue(rendered[1][1].startswith("Hello Alan,"))
+        self.assertIn("123456", rendered[1][1])
+        self.assertIsNone(rendered[0][2])
+        # escaped like render_to_string does
+        self.assertIn("&lt;b&gt;", email_templates.render(
+            "accounts/email/broadcast_message.txt", {"user": self.user, "body": "<b>"}
+        ))
+        with self.assertRaises(TemplateDoesNotExist):
+            email_templates.render_mail("accounts/email/missing", [{}])
+
+    def test_adapter_renders_the_confirmation_code(self):
+        message = CustomAccountAdapter().render_mail(
+            "accounts/email/email_confirmation_code", "ada@gmail.com", {"user": self.user, "code": "654321"},
+        )
+        self.assertEqual(message.subject, f"{settings.ACCOUNT_EMAIL_SUBJECT_PREFIX}[USER APP] Verify your email")
+        self.assertIn("Hello Ada,", message.body)
+        self.assertIn("654321", message.body)
+        self.assertEqual(message.to, ["ada@gmail.com"])
+
+    def test_welcome_email(self):
+        mail.outbox = []
+        email_confirmed.send(sender=None, request=None, email_address=EmailAddress(user=self.user, email=self.user.email))
+        self.assertEqual(mail.outbox[0].subject, "Welcome to our app")
+        self.assertIn("Hello Ada Lovelace,", mail.outbox[0].body)
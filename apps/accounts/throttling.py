@@ -0,0 +1,117 @@
+"""
+Sliding window throttling of the email verification endpoints.
+
+Each request is counted against the email it is for and against the
+client IP. A window is two fixed-window counters in the cache, the
+previous one weighted by how much of it still overlaps the sliding
+window, so a check is one `get_many` and an `incr` per ident however
+many requests were made. The count is incremented before it is compared
+and given back when the request is rejected, so concurrent requests
+can't all pass the check on the same count.
+"""
+import time
+import logging
+import threading
+from collections.abc import Mapping
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+logger = logging.getLogger(__name__)
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _count(scope, name):
+    with _stats_lock:
+        counters = _stats.setdefault(scope, {"allowed": 0, "rejected": 0})
+        counters[name] += 1
+
+
+def throttle_stats():
+    """allowed and rejected counters per scope of this process"""
+    with _stats_lock:
+        return {scope: dict(counters) for scope, counters in _stats.items()}
+
+
+def get_cache():
+    return caches[settings.THROTTLE_CACHE_ALIAS]
+
+
+def hit(scope, idents, limit, window):
+    """
+    Count a request for each of `idents` (e.g. an email and an IP).
+    Returns False, without counting it, if any of them already made
+    `limit` requests in the last `window` seconds.
+    """
+    now = time.time()
+    current = int(now // window)
+    overlap = 1 - (now % window) / window
+    keys = {
+        ident: (f"accounts:throttle:{scope}:{ident}:{current - 1}", f"accounts:throttle:{scope}:{ident}:{current}")
+        for ident in idents
+    }
+    cache = get_cache()
+    counts = cache.get_many([previous for previous, _ in keys.values()])
+    counted = []
+    for ident, (previous, latest) in keys.items():
+        # counted before it is compared, concurrent requests each see their own count,
+        # the counter must outlive the window after it, where it is the previous one
+        cache.add(latest, 0, timeout=2 * window)
+        count = cache.incr(latest)
+        counted.append(latest)
+        if counts.get(previous, 0) * overlap + count > limit:
+            for key in counted:
+                cache.decr(key)
+            _count(scope, "rejected")
+            logger.info("throttled %s for %s", scope, ident)
+            return False
+    _count(scope, "allowed")
+    return True
+
+
+class EmailIPRateThrottle(SimpleRateThrottle):
+    """
+    DRF throttle limiting requests per email (from the request body) and
+    per client IP to the rate of its `scope` in `DEFAULT_THROTTLE_RATES`.
+    """
+    scope = None
+
+    def get_rate(self):
+        # read at call time so the rates follow settings changes
+        return api_settings.DEFAULT_THROTTLE_RATES[self.scope]
+
+    def allow(self, request, email, per_ip=True):
+        """
+        the throttle check, for views that don't run DRF throttles.
+        With `per_ip` False only the email is counted.
+        """
+        idents = [f"ip:{self.get_ident(request)}"] if per_ip else []
+        if email:
+            idents.append(f"email:{str(email).lower()}")
+        return hit(self.scope, idents, self.num_requests, self.duration)
+
+    def allow_request(self, request, view):
+        # the body may be any json, e.g. a list
+        email = request.data.get("email") if isinstance(request.data, Mapping) else None
+        return self.allow(request, email)
+
+    def wait(self):
+        return self.duration
+
+
+class VerifyEmailCodeThrottle(EmailIPRateThrottle):
+    """guesses at an email verification code"""
+    scope = "otp_verify"
+
+
+class SendEmailCodeThrottle(EmailIPRateThrottle):
+    """emails sent with a verification code or link"""
+    scope = "otp_send"
+
+
+class ResendEmailThrottle(EmailIPRateThrottle):
+    """requests for a new verification email"""
+    scope = "otp_resend"
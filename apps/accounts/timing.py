@@ -0,0 +1,76 @@
+"""
+Wall clock timings of the steps of a request.
+
+Wrap the steps in `timed(name)`, they are logged at debug level and,
+inside a `collect()` block, gathered so they can be sent back in a
+`Server-Timing` header. `PerformanceMiddleware` collects the steps of
+the requests it samples.
+"""
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+_timings = ContextVar("timings", default=None)
+
+
+@contextmanager
+def collect():
+    """
+    yields the list of (step, milliseconds) timed inside the block,
+    they are passed on to the enclosing `collect()` if there is one
+    """
+    timings = []
+    outer = _timings.get()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+        if outer is not None:
+            outer.extend(timings)
+
+
+def active():
+    """whether the steps are being collected"""
+    return _timings.get() is not None
+
+
+def record(name, duration=0.0):
+    """add a step measured elsewhere, with no duration it just counts an event"""
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((name, duration))
+
+
+@contextmanager
+def timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = (time.perf_counter() - start) * 1000
+        logger.debug("%s took %.1fms", name, duration)
+        record(name, duration)
+
+
+def summarize(timings):
+    """{step: (total milliseconds, count)} of collected timings"""
+    totals = {}
+    for name, duration in timings:
+        total, count = totals.get(name, (0.0, 0))
+        totals[name] = (total + duration, count + 1)
+    return totals
+
+
+def server_timing(timings):
+    """the `Server-Timing` header value for collected timings, repeated steps are added up"""
+    parts = []
+    for name, (total, count) in summarize(timings).items():
+        part = f"{name};dur={total:.1f}"
+        if count > 1:
+            part += f';desc="{count}x"'
+        parts.append(part)
+    return ", ".join(parts)
@@ -1,12 +1,25 @@
 """accounts url"""
-from django.urls import path, include
+from django.urls import path, re_path, include
 
-from .views import GoogleLogin, GoogleLoginCallback, VerifyEmailCodeView, ProfileImage
+from .views import (
+    GoogleLogin, GoogleLoginCallback, VerifyEmailCodeView, ProfileImage, ProfileImageStatus,
+    CachedUserDetailsView, ClaimsTokenRefreshView, ThrottledResendEmailVerificationView,
+    UserListView, UserExportView,
+)
 
 urlpatterns = [
+    # takes over the dj_rest_auth user details route
+    re_path(r'user/?$', CachedUserDetailsView.as_view(), name='rest_user_details'),
+    # takes over the dj_rest_auth refresh route
+    re_path(r'token/refresh/?$', ClaimsTokenRefreshView.as_view(), name='token_refresh'),
     path('', include('dj_rest_auth.urls')),
+    # takes over the dj_rest_auth resend route
+    re_path(r'signup/resend-email/?$', ThrottledResendEmailVerificationView.as_view(), name='rest_resend_email'),
     path('signup/', include('dj_rest_auth.registration.urls')),
     path('signup/google/', GoogleLogin.as_view(), name='google_login'),
     path('verify-email-code/', VerifyEmailCodeView.as_view(), name='verify-email-code'),
     path('upload-image/', ProfileImage.as_view(), name='upload-user-image'),
+    path('upload-image/<uuid:task_id>/', ProfileImageStatus.as_view(), name='upload-user-image-status'),
+    path('users/', UserListView.as_view(), name='user-list'),
+    path('users/export/', UserExportView.as_view(), name='user-export'),
 ]
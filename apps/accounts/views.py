@@ -1,8 +1,12 @@
-import requests
-from urllib.parse import urljoin
+import os
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views import View
 from django.urls import reverse
-from django.utils import timezone
-from rest_framework import status
+from rest_framework import serializers, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import ListAPIView
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
@@ -10,11 +14,21 @@ from allauth.socialaccount.providers.google.views import GoogleOAuth2Adapter
 from allauth.socialaccount.providers.oauth2.client import OAuth2Client
 from allauth.account.adapter import get_adapter
 from allauth.account.models import EmailAddress
-from dj_rest_auth.registration.views import SocialLoginView
+from dj_rest_auth.registration.views import SocialLoginView, ResendEmailVerificationView
+from dj_rest_auth.views import UserDetailsView
+from dj_rest_auth.jwt_auth import get_refresh_view
 from django.conf import settings
 
-from .serializers import VerifyEmailSerialzer, ProfileImageUploadSerializer
-from .models import OTPModel
+from . import export, images, metrics, search, timing
+from .authentication import resolve_user
+from .cache import get_user_details
+from .pagination import KeysetPagination
+from .serializers import (
+    VerifyEmailSerialzer, ProfileImageUploadSerializer, ProfileImageTaskSerializer, UserListSerializer,
+)
+from .models import User, ProfileImageTask
+from .otp import get_otp_backend
+from .throttling import VerifyEmailCodeThrottle, ResendEmailThrottle
 
 
 class CustomGoogleOAuth2Client(OAuth2Client):
@@ -43,12 +57,45 @@ class CustomGoogleOAuth2Client(OAuth2Client):
             basic_auth,
         )
 
+    def get_access_token(self, *args, **kwargs):
+        with timing.timed("oauth_token"):
+            return super().get_access_token(*args, **kwargs)
+
+
+class TimedGoogleOAuth2Adapter(GoogleOAuth2Adapter):
+    def complete_login(self, *args, **kwargs):
+        with timing.timed("oauth_profile"):
+            return super().complete_login(*args, **kwargs)
+
 
 class GoogleLogin(SocialLoginView):
-    adapter_class = GoogleOAuth2Adapter
+    adapter_class = TimedGoogleOAuth2Adapter
     callback_url = settings.GOOGLE_OAUTH_CALLBACK_URL
     client_class = CustomGoogleOAuth2Client
 
+    def login_with_code(self, code):
+        """the `post` flow, for a code that didn't come in the request body"""
+        with timing.timed("social_login"):
+            self.serializer = self.get_serializer(data={"code": code})
+            self.serializer.is_valid(raise_exception=True)
+        with timing.timed("jwt"):
+            self.login()
+            return self.get_response()
+
+
+def google_login(request, code):
+    """
+    Log in with a Google authorization code in process, as a POST to
+    `GoogleLogin` would. Returns its response with the time each step
+    took in a `Server-Timing` header.
+    """
+    with timing.collect() as timings:
+        with timing.timed("google_login"):
+            view = GoogleLogin(request=request, args=(), kwargs={}, format_kwarg=None)
+            response = view.login_with_code(code)
+    response["Server-Timing"] = timing.server_timing(timings)
+    return response
+
 
 # Google login link: 'https://accounts.google.com/o/oauth2/v2/auth?redirect_uri=http://localhost:8000/accounts/google/login/callback/&prompt=consent&response_type=code&client_id=782621328736-o4u0j11en1kq47t08edirf5f72l9h8sm.apps.googleusercontent.com&scope=openid%20email%20profile&access_type=offline'
 
@@ -64,19 +111,101 @@ class GoogleLoginCallback(APIView):
         code = request.GET.get("code")
         if code is None:
             return Response(status=status.HTTP_400_BAD_REQUEST)
-        
-        host = request.get_host()
-        token_endpoint_url = urljoin(host, reverse("google_login"))
-        response = requests.post(url=token_endpoint_url, data={"code": code})
-        if response.status_code not in [200, 201]:
-            response.raise_for_status() # TODO: implement this properly for a REST response
 
-        return Response(response.json(), status=status.HTTP_200_OK)
+        return google_login(request, code)
+
+
+class CachedUserDetailsView(UserDetailsView):
+    """
+    The dj_rest_auth user details view, reading through the user
+    details cache. Updates go through the default path and the cache
+    is invalidated by the `User`/`Profile` save signals.
+    """
+
+    def get_object(self):
+        """the user and profile in one query"""
+        return User.objects.select_related("profile").get(pk=self.request.user.pk)
+
+    def retrieve(self, request, *args, **kwargs):
+        payload = get_user_details(
+            request, request.user.pk, lambda: self.get_serializer(self.get_object()).data
+            )
+        return Response(payload)
+
+
+class UserListView(ListAPIView):
+    """
+    Staff only listing of the users, newest first, in keyset pages (see
+    `pagination.py`) so the last page costs as little as the first.
+    Filter with `?is_active=` and `?is_staff=`, both indexed, and
+    search names, emails and locations with `?search=` (see `search.py`).
+    On SQLite a search lists the newest matching users only, `count_exact`
+    is false when some were left out.
+    """
+    serializer_class = UserListSerializer
+    permission_classes = [IsAdminUser]
+    pagination_class = KeysetPagination
+    filter_fields = ["is_active", "is_staff"]
+
+    def query_flag(self, name):
+        """a true/false query parameter, None when missing"""
+        value = self.request.query_params.get(name)
+        if value is None:
+            return None
+        try:
+            return serializers.BooleanField().to_internal_value(value)
+        except ValidationError as e:
+            raise ValidationError({name: e.detail})
+
+    def search_limit(self):
+        """the newest matches of a search kept, see `search.search`"""
+        return settings.USER_SEARCH_MAX_RESULTS
+
+    def get_queryset(self):
+        queryset = User.objects.only(*UserListSerializer.Meta.fields)
+        for field in self.filter_fields:
+            value = self.query_flag(field)
+            if value is not None:
+                queryset = queryset.filter(**{field: value})
+        query = self.request.query_params.get("search", "")
+        limit = self.search_limit()
+        # reported by the paginator, the count is then only of the newest matches
+        self.search_capped = limit is not None and search.is_capped(queryset, query, limit)
+        return search.search(queryset, query, limit)
+
+
+class UserExportView(UserListView):
+    """
+    Staff only download of the users and their profile, filtered like the
+    listing. `?file_format=csv` (default) or `jsonl`, `?gzip=true` to
+    compress it. Streamed in constant memory, see `export.py`.
+    """
+
+    def search_limit(self):
+        # every match is exported
+        return None
+
+    def perform_content_negotiation(self, request, force=False):
+        # the file is not rendered by DRF, so an `Accept: text/csv` must not fail
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, *args, **kwargs):
+        file_format = request.query_params.get("file_format", "csv")
+        if file_format not in export.FORMATS:
+            raise ValidationError({"file_format": f"Choose one of {', '.join(export.FORMATS)}"})
+        compress = bool(self.query_flag("gzip"))
+        response = StreamingHttpResponse(
+            export.stream(self.get_queryset(), file_format, compress),
+            content_type="application/gzip" if compress else export.FORMATS[file_format],
+        )
+        response["Content-Disposition"] = f'attachment; filename="{export.filename(file_format, compress)}"'
+        return response
 
 
 class VerifyEmailCodeView(APIView):
     """Use this view if the `EMAIL_VERIFICATION_BY_CODE` setting is set to true"""
     serializer_class = VerifyEmailSerialzer
+    throttle_classes = [VerifyEmailCodeThrottle]
 
     def post(self, request):
         """Verify user email by code sent to their email"""
@@ -91,24 +220,13 @@ class VerifyEmailCodeView(APIView):
                 "error": serializer.errors,
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            otp = OTPModel.objects.get(
-                user__email=email, code=code, is_used=False
-                )
-        except OTPModel.DoesNotExist:
-            return Response({
-                "detail": "Invalid or expired code"
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        if otp.expires_at < timezone.now():
+        user_id = get_otp_backend().verify(email, code) # the code can't be used again
+        if user_id is None:
             return Response({
                 "detail": "Invalid or expired code"
             }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # otp.is_used = True
-        otp.delete() # delete after verifying
 
-        email_address = EmailAddress.objects.get(user=otp.user, email=email)
+        email_address = EmailAddress.objects.select_related("user").get(user_id=user_id, email=email)
         get_adapter().confirm_email(request, email_address)
 
         return Response({
@@ -116,20 +234,108 @@ class VerifyEmailCodeView(APIView):
         })
 
 
+class ClaimsTokenRefreshView(get_refresh_view()):
+    """the dj_rest_auth refresh view, with the `TOKEN_REFRESH_SERIALIZER` of `SIMPLE_JWT`"""
+    serializer_class = None
+
+
+class ThrottledResendEmailVerificationView(ResendEmailVerificationView):
+    """the dj_rest_auth resend view, limited per email and IP"""
+    throttle_classes = [ResendEmailThrottle]
+
+
 class ProfileImage(APIView):
     serializer_class = ProfileImageUploadSerializer
 
     def post(self, request):
-        """upload user image"""
+        """
+        upload user image.
+        The image is processed in the background, so unless that is already
+        done this returns `202 Accepted` with a task to poll for the result.
+        """
         serializer = ProfileImageUploadSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
-            image = serializer.data.get("image", None)
-            host = request.get_host()
-            return Response({
-                "image": host + '/' + image
-            }, status.HTTP_200_OK)
+            user = resolve_user(request.user) if request.user.is_authenticated else None
+            task = serializer.save(user=user)
+            return image_task_response(request, task)
         else:
             return Response({
                 "error": "invalid data"
             }, status.HTTP_400_BAD_REQUEST)
+
+
+class ProfileImageStatus(APIView):
+    serializer_class = ProfileImageTaskSerializer
+
+    def get(self, request, task_id):
+        """progress of an uploaded image, only shown to the user who uploaded it"""
+        if request.user.is_authenticated:
+            tasks = ProfileImageTask.objects.filter(user_id=request.user.pk)
+        else:
+            tasks = ProfileImageTask.objects.filter(user__isnull=True)
+        try:
+            task = tasks.get(pk=task_id)
+        except ProfileImageTask.DoesNotExist:
+            return Response({
+                "detail": "Not found"
+            }, status.HTTP_404_NOT_FOUND)
+        return image_task_response(request, task)
+
+
+def image_task_response(request, task):
+    """the processed image urls if done, or the task progress otherwise"""
+    data = ProfileImageTaskSerializer(task).data
+    if task.status == ProfileImageTask.DONE:
+        data["image"] = images.image_url(request, task.image)
+        data["variants"] = {size: images.image_url(request, name) for size, name in task.variants.items()}
+        return Response(data, status.HTTP_200_OK)
+    data["status_url"] = reverse("upload-user-image-status", args=[task.pk])
+    if task.status == ProfileImageTask.FAILED:
+        return Response(data, status.HTTP_400_BAD_REQUEST)
+    return Response(data, status.HTTP_202_ACCEPTED)
+
+
+class MetricsView(View):
+    """
+    The request metrics of this process for Prometheus. With a
+    `METRICS_TOKEN` only requests with that bearer token are served.
+    Without one they are served to `INTERNAL_IPS`, which checks
+    `REMOTE_ADDR`: behind a proxy that is the proxy's address, so set a
+    token there.
+    """
+
+    def get(self, request):
+        token = settings.METRICS_TOKEN
+        if token:
+            authorized = constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}")
+        else:
+            authorized = request.META.get("REMOTE_ADDR") in settings.INTERNAL_IPS
+        if not authorized:
+            return HttpResponseForbidden()
+        return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4")
+
+
+class ProfileImageFile(APIView):
+    """
+    Serves the stored profile images. The file names are content
+    hashes, so a file never changes and can be cached forever.
+    Put the web server in front of `PROFILE_IMAGE_DIRECTORY` in production.
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request, filename):
+        # only the processed variants, not the temporary files written next to them
+        if not images.STORED_NAME.fullmatch(filename):
+            raise Http404
+        path = os.path.join(settings.PROFILE_IMAGE_DIRECTORY, filename)
+        if not os.path.isfile(path):
+            raise Http404
+        etag = '"' + filename + '"'
+        if request.headers.get("If-None-Match") == etag:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = FileResponse(open(path, "rb"))
+        response["ETag"] = etag
+        response["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
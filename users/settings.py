@@ -46,7 +46,19 @@ INSTALLED_APPS = [
     'apps.accounts',
 ]
 
+# RUNTIME_PROFILE "api" leaves out the admin, the API docs and allauth headless,
+# for workers that only serve the API and should boot fast, default "full"
+RUNTIME_PROFILE = os.getenv("RUNTIME_PROFILE") or "full"
+if RUNTIME_PROFILE == "api":
+    # without headless, the email confirmation links point to dj_rest_auth's account_confirm_email
+    INSTALLED_APPS = [
+        app for app in INSTALLED_APPS
+        if app not in ('django.contrib.admin', 'allauth.headless', 'drf_spectacular')
+    ]
+
 MIDDLEWARE = [
+    # first, so it times the whole request
+    'apps.accounts.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,12 +95,68 @@ WSGI_APPLICATION = 'users.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
+# DATABASE_ENGINE picks the profile: "sqlite" (default) or "postgresql"
+if (os.getenv("DATABASE_ENGINE") or "sqlite") == "postgresql":
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv("DATABASE_NAME") or "users",
+            'USER': os.getenv("DATABASE_USER") or "postgres",
+            'PASSWORD': os.getenv("DATABASE_PASSWORD", ""),
+            'HOST': os.getenv("DATABASE_HOST") or "localhost",
+            'PORT': os.getenv("DATABASE_PORT") or "5432",
+            # keep connections open between requests, checked before reuse
+            'CONN_MAX_AGE': int(os.getenv("DATABASE_CONN_MAX_AGE") or 60),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if int(os.getenv("DATABASE_POOL_SIZE") or 0):
+        # a psycopg 3 pool per process (needs `psycopg[pool]`), it replaces CONN_MAX_AGE
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': 1,
+            'max_size': int(os.getenv("DATABASE_POOL_SIZE")),
+            'timeout': 10, # seconds to wait for a free connection
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # seconds a write waits for the lock before "database is locked"
+                'timeout': 20,
+                # take the write lock when the transaction starts, instead of
+                # failing when a read transaction tries to upgrade to a write
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+    if (os.getenv("DATABASE_SQLITE_WAL") or "true").lower() == "true":
+        # readers don't block the writer and commits don't fsync every time
+        DATABASES['default']['OPTIONS']['init_command'] = (
+            "PRAGMA journal_mode=WAL;"
+            "PRAGMA synchronous=NORMAL;"
+            "PRAGMA cache_size=-20000;" # 20MB
+            "PRAGMA temp_store=MEMORY;"
+            "PRAGMA mmap_size=134217728;" # 128MB
+        )
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
+if os.getenv("REDIS_URL"):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv("REDIS_URL"),
+    }
 
 
 # Password validation
@@ -110,6 +178,10 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# processes hashing passwords, 0 hashes in the request thread
+PASSWORD_HASHING_WORKERS = int(os.getenv("PASSWORD_HASHING_WORKERS") or 0)
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -142,18 +214,66 @@ GOOGLE_OAUTH_CALLBACK_URL = os.getenv("GOOGLE_OAUTH_CALLBACK_URL")
 DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", "admin@admin.com")
 DEFAULT_AVATER_URL = None # url to the default avatar used for the user model
 PROFILE_IMAGE_DIRECTORY = 'profile'
+PROFILE_IMAGE_UPLOAD_DIRECTORY = 'uploads' # raw uploads until they are processed, never served, keep it out of PROFILE_IMAGE_DIRECTORY
+PROFILE_IMAGE_URL = 'profile/' # url prefix the files in `PROFILE_IMAGE_DIRECTORY` are served under
+PROFILE_IMAGE_EXECUTOR = "thread" # where uploads are processed: "inline", "thread" or "process"
+PROFILE_IMAGE_WORKERS = 2 # size of the image processing pool
+PROFILE_IMAGE_TASK_TIMEOUT = 600 # seconds without progress before `recover_image_tasks` takes a task over
+PROFILE_IMAGE_SIZES = [512, 256, 96, 48] # longest side in pixels of each stored variant
+PROFILE_IMAGE_FORMAT = "JPEG" # "JPEG" or "WEBP"
+PROFILE_IMAGE_QUALITY = 85
+PROFILE_IMAGE_MAX_BYTES = 20 * 1024 * 1024 # reject bigger uploads before decoding them
+PROFILE_IMAGE_MAX_PIXELS = 50_000_000 # reject images with more pixels (width * height)
+PROFILE_IMAGE_UPLOAD_FORMATS = ["JPEG", "PNG", "WEBP", "MPO"]
 EMAIL_VERIFICATION_BY_CODE = False # must set to either True or False
 VERIFICATION_CODE_EXPIRATION_TIME = 10 # set time the code should expire in minutes
+OTP_BACKEND = os.getenv("OTP_BACKEND") or 'apps.accounts.otp.DatabaseOTPBackend' # or 'apps.accounts.otp.CacheOTPBackend'
+OTP_CACHE_ALIAS = 'default' # cache from `CACHES` the `CacheOTPBackend` stores codes in
+THROTTLE_CACHE_ALIAS = 'default' # cache from `CACHES` the verification throttle counters are kept in
+USER_DETAILS_CACHE_ALIAS = 'default' # cache from `CACHES` for the user details endpoint, local memory if missing
+USER_DETAILS_CACHE_TIMEOUT = 300 # seconds
+USER_LIST_COUNT_LIMIT = 10000 # the staff user listing counts rows up to this, PostgreSQL estimates them instead
+USER_SEARCH_MAX_RESULTS = 1000 # newest matches of a user search kept on SQLite, refine broader queries
+EMAIL_SEND_MODE = os.getenv("EMAIL_SEND_MODE") or "sync" # "sync" or "queue" (delivered by the `send_queued_mail` worker)
+EMAIL_QUEUE_BACKEND = 'apps.accounts.mail.DatabaseMailQueue'
+EMAIL_QUEUE_BATCH_SIZE = 100 # messages sent per SMTP connection
+EMAIL_QUEUE_MAX_ATTEMPTS = 5 # mark a queued email as failed after this many attempts
+EMAIL_QUEUE_RETRY_BACKOFF = 30 # seconds before the first retry, doubled on every attempt
+EMAIL_QUEUE_LEASE = 300 # seconds a worker holds a claimed batch before others can pick it up
+EMAIL_TEMPLATES = [ # emails compiled at startup, see `email_templates.py`
+    "accounts/email/email_confirmation_code",
+    "accounts/email/welcome",
+    "account/email/email_confirmation_signup",
+    "account/email/password_reset_key",
+]
+BROADCAST_BATCH_SIZE = 500 # users per SMTP connection and per checkpoint of a broadcast
+BROADCAST_RATE_LIMIT = 14 # broadcast messages per second, match the email provider limit, 0 for none
+BROADCAST_LEASE = 300 # seconds a broadcast stays taken after a checkpoint, longer than a batch takes to send
+PERFORMANCE_SAMPLE_RATE = float(os.getenv("PERFORMANCE_SAMPLE_RATE") or 0.1) # share of requests whose steps are timed, 0 to 1
+PERFORMANCE_SERVER_TIMING = True # send the steps of sampled requests in a `Server-Timing` header
+OPENAPI_SCHEMA_DIRECTORY = BASE_DIR / 'schema' # where `build_schema` writes the schema, served from there unless DEBUG
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") # bearer token required by the metrics endpoint, open to `INTERNAL_IPS` if empty
+INTERNAL_IPS = ["127.0.0.1"]
 warnings.filterwarnings("ignore", module="dj_rest_auth") # To ignore all warnings from a specific module
 
 # DJANGO REST FRAMEWORK
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'dj_rest_auth.jwt_auth.JWTCookieAuthentication',
+        # like dj_rest_auth.jwt_auth.JWTCookieAuthentication, without a user query per request
+        'apps.accounts.authentication.StatelessJWTCookieAuthentication',
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_THROTTLE_RATES': {
+        # each limit applies per email and per client ip, see apps/accounts/throttling.py
+        'otp_verify': '5/min', # verification code guesses
+        'otp_send': '3/min', # verification emails sent
+        'otp_resend': '3/min', # calls to the resend endpoint
+    },
 }
+if RUNTIME_PROFILE == "api":
+    # drf_spectacular is not installed, DRF's own schema class doesn't import anything until used
+    REST_FRAMEWORK['DEFAULT_SCHEMA_CLASS'] = 'rest_framework.schemas.openapi.AutoSchema'
 
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Users app',
@@ -167,7 +287,9 @@ SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(hours=1),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=2),
     "UPDATE_LAST_LOGIN": True,
+    "TOKEN_REFRESH_SERIALIZER": "apps.accounts.authentication.ClaimsTokenRefreshSerializer",
 }
+JWT_CLAIMS_MAX_AGE = 3600 # seconds the user flags in a token are trusted before the user is read from the db again
 
 # DJ-REST-AUTH
 REST_AUTH = {
@@ -179,6 +301,7 @@ REST_AUTH = {
     'LOGIN_SERIALIZER': 'apps.accounts.serializers.CustomLoginSerializer',
     'JWT_AUTH_HTTPONLY': False,
     'JWT_AUTH_RETURN_EXPIRATION': True,
+    'JWT_TOKEN_CLAIMS_SERIALIZER': 'apps.accounts.authentication.ClaimsTokenObtainPairSerializer',
 }
 
 # ALLAUTH
@@ -214,6 +337,8 @@ SOCIALACCOUNT_PROVIDERS = {
 SOCIALACCOUNT_EMAIL_AUTHENTICATION = True
 SOCIALACCOUNT_EMAIL_AUTHENTICATION_AUTO_CONNECT = True
 # SOCIALACCOUNT_STORE_TOKENS = True
+SOCIALACCOUNT_REQUESTS_TIMEOUT = 5 # seconds, for the calls to google
+SOCIALACCOUNT_REQUESTS_POOL_SIZE = 10 # keep-alive connections kept per host
 SOCIALACCOUNT_ADAPTER = 'apps.accounts.adapters.CustomSocialAdapter'
 ACCOUNT_ADAPTER = 'apps.accounts.adapters.CustomAccountAdapter'
 HEADLESS_FRONTEND_URLS = {